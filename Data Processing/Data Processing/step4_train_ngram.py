@@ -1,5 +1,6 @@
 import json
-from collections import defaultdict
+from array import array
+from collections import Counter, defaultdict
 import pickle
 
 # Load the preprocessed diary data
@@ -27,4 +28,36 @@ for ngram in ngram_model:
 with open(r'Models\ngram_model.pkl', 'wb') as f:
     pickle.dump(dict(ngram_model), f)  # Convert to dict for pickling
 
-print("N-gram model trained and saved to 'ngram_model.pkl'")
\ No newline at end of file
+print("N-gram model trained and saved to 'ngram_model.pkl'")
+
+# Presorted successor lists for inference. Every context's successors are stored
+# best-first (probability, then overall word frequency as tiebreaker) in flat parallel
+# arrays of word ids and probabilities; the dict only maps a context to its slot in
+# the offsets array. Next-word lookup becomes a dict probe plus a slice, and one
+# small int per context replaces a whole inner dict with a float object per successor.
+word_freq = Counter(word for paragraph in preprocessed_data for word in paragraph)
+vocab = sorted(word_freq)
+word_to_id = {word: i for i, word in enumerate(vocab)}
+
+contexts = {}
+offsets = array('I', [0])
+successor_ids = array('I')
+successor_probs = array('f')
+for ngram, next_words in ngram_model.items():
+    ranked = sorted(next_words.items(), key=lambda item: (-item[1], -word_freq[item[0]], item[0]))
+    contexts[ngram] = len(offsets) - 1
+    successor_ids.extend(word_to_id[word] for word, _ in ranked)
+    successor_probs.extend(prob for _, prob in ranked)
+    offsets.append(len(successor_ids))
+
+ngram_successors = {'n': n, 'vocab': vocab, 'contexts': contexts, 'offsets': offsets,
+                    'ids': successor_ids, 'probs': successor_probs}
+
+with open(r'Models\ngram_successors.pkl', 'wb') as f:
+    pickle.dump(ngram_successors, f)
+
+dict_size = len(pickle.dumps({ngram: dict(words) for ngram, words in ngram_model.items()}))
+packed_size = len(pickle.dumps(ngram_successors))
+print(f"Presorted successors saved to 'ngram_successors.pkl' ({len(contexts)} contexts, "
+      f"{packed_size / len(contexts):.0f} bytes/context vs {dict_size / len(contexts):.0f} "
+      f"for the dict-of-dicts, vocabulary included)")
\ No newline at end of file
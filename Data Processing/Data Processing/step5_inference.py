@@ -15,6 +15,10 @@ with open(r'Models\word_trie.pkl', 'rb') as f:
 with open(r'Models\ngram_model.pkl', 'rb') as f:
     ngram_model = pickle.load(f)
 
+# Successor lists presorted by step4 (flat id/probability arrays, best-first)
+with open(r'Models\ngram_successors.pkl', 'rb') as f:
+    ngram_successors = pickle.load(f)
+
 
 # Function to get word completions with context
 def get_completions(prefix, context, top_k=3):
@@ -55,10 +59,12 @@ def get_completions(prefix, context, top_k=3):
 def get_next_words(context, top_k=5):
     n = 3  # Assuming trigram model
     ngram = tuple(context[-(n - 1):]) if len(context) >= n - 1 else tuple(context)
-    if ngram in ngram_model:
-        # Sort next words by probability
-        next_words = ngram_model[ngram]
-        return sorted(next_words, key=next_words.get, reverse=True)[:top_k]
+    slot = ngram_successors['contexts'].get(ngram)
+    if slot is not None:
+        # Already sorted by probability - just slice the top k
+        start = ngram_successors['offsets'][slot]
+        end = min(ngram_successors['offsets'][slot + 1], start + top_k)
+        return [ngram_successors['vocab'][i] for i in ngram_successors['ids'][start:end]]
     return []
 
 
@@ -0,0 +1,66 @@
+# Benchmark: batched prediction (predict_batch / complete_batch) versus looping
+# over predict_next_word / complete_current_word, replaying the whole diary.
+#
+# Every token position becomes one next-word query (its two previous words) and
+# one completion query per typed-prefix length 1-3.
+#
+# Run from anywhere: python benchmarks/bench_batch.py
+
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from inference_engine import complete_batch, complete_current_word, predict_batch, predict_next_word
+
+CORPUS = os.path.join(os.path.dirname(os.path.dirname(ROOT)), 'Data Processing', 'Data Processing', 'Data',
+                      'preprocessed_diary.json')
+
+
+def replay_queries(sentences):
+    contexts, completions = [], []
+    for sentence in sentences:
+        for i, word in enumerate(sentence):
+            context = sentence[max(0, i - 2):i]
+            contexts.append(context)
+            for length in range(1, min(len(word), 3) + 1):
+                completions.append((context, word[:length]))
+    return contexts, completions
+
+
+def timed(fn, repeat=3):
+    """Result of fn and its best wall time over `repeat` runs."""
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        result = None
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def main(top_k=5):
+    with open(CORPUS, 'r', encoding='utf-8') as f:
+        sentences = json.load(f)
+    contexts, completions = replay_queries(sentences)
+
+    # Warm the lazily built vocabulary before timing
+    predict_batch(contexts[:1], top_k)
+
+    print(f"{'':>14} {'queries':>9} {'loop':>9} {'batch':>9} {'speedup':>8}")
+    for name, queries, single, batched in (
+            ("next word", contexts, lambda: [predict_next_word(c, top_k) for c in contexts],
+             lambda: predict_batch(contexts, top_k)),
+            ("completion", completions, lambda: [complete_current_word(p, c, top_k) for c, p in completions],
+             lambda: complete_batch(completions, top_k))):
+        expected, loop_time = timed(single)
+        result, batch_time = timed(batched)
+        assert result == expected, f"{name}: batch results differ from the single-query path"
+        print(f"{name:>14} {len(queries):>9} {loop_time:>8.2f}s {batch_time:>8.3f}s {loop_time / batch_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# Benchmark: complete_current_word / predict_next_word with and without the LRU
+# result cache.
+#
+# Replays the most common diary sentences keystroke by keystroke, several times
+# over as a user repeating everyday phrases would: one completion query per typed
+# character and one next-word query per finished word.
+#
+# Run from anywhere: python benchmarks/bench_cache.py [sentences] [passes]
+
+import json
+import os
+import sys
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import inference_engine
+from engine.cache import PredictionCache
+
+CORPUS = os.path.join(os.path.dirname(os.path.dirname(ROOT)), 'Data Processing', 'Data Processing', 'Data',
+                      'preprocessed_diary.json')
+
+
+def replay(sentences, passes):
+    queries = 0
+    start = time.perf_counter()
+    for _ in range(passes):
+        for sentence in sentences:
+            for i, word in enumerate(sentence):
+                context = sentence[max(0, i - 2):i]
+                for length in range(1, len(word) + 1):
+                    inference_engine.complete_current_word(word[:length], context, top_k=3)
+                inference_engine.predict_next_word(sentence[max(0, i - 1):i + 1], top_k=5)
+                queries += len(word) + 1
+    return queries, time.perf_counter() - start
+
+
+def main(sentence_count=200, passes=5):
+    with open(CORPUS, 'r', encoding='utf-8') as f:
+        sentences = json.load(f)
+    counts = Counter(tuple(sentence) for sentence in sentences if len(sentence) <= 12)
+    common = [list(sentence) for sentence, _ in counts.most_common(sentence_count)]
+
+    # A cache of size 1 keeps missing, which times the uncached path plus lookup overhead
+    inference_engine.cache = PredictionCache(max_entries=1)
+    queries, uncached_time = replay(common, passes)
+    inference_engine.cache = cache = PredictionCache(max_entries=16384)
+    _, cached_time = replay(common, passes)
+
+    print(f"{len(common)} sentences x {passes} passes = {queries} queries\n")
+    print(f"{'uncached':>10} {uncached_time / queries * 1e6:>8.1f} us/query")
+    print(f"{'cached':>10} {cached_time / queries * 1e6:>8.1f} us/query")
+    stats = cache.stats()
+    print(f"\nHits: {stats['hits']}, misses: {stats['misses']}, evictions: {stats['evictions']}, "
+          f"hit rate: {stats['hit_rate']:.1%}")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
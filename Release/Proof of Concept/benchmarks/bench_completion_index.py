@@ -0,0 +1,76 @@
+# Benchmark: no-context word completion via the per-prefix top-k index
+# versus the original path (enumerate the trie subtree, then sort it).
+#
+# Run from anywhere: python benchmarks/bench_completion_index.py
+
+import os
+import pickle
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine.convert_model import convert_pickles
+from engine.model_format import MappedModel
+from inference_engine import MODELS_DIR
+
+with open(os.path.join(MODELS_DIR, 'word_trie.pkl'), 'rb') as f:
+    word_trie = pickle.load(f)
+
+# Built from the same pickles, so both paths rank the same frequencies
+model = MappedModel(convert_pickles(MODELS_DIR))
+
+
+def scan_completions(prefix):
+    """Every word in the pygtrie under prefix."""
+    if not word_trie.has_node(prefix):
+        return []
+    return [word for word in word_trie.iterkeys(prefix) if word.startswith(prefix)]
+
+
+def scan_and_sort(prefix, top_k):
+    """The pre-index implementation of complete_current_word without context."""
+    return sorted(scan_completions(prefix), key=lambda w: word_trie[w], reverse=True)[:top_k]
+
+
+def complete_by_frequency(prefix, top_k):
+    """The indexed path: walk to the trie node, read its precomputed top-k."""
+    return model.complete(prefix, [], top_k)
+
+
+def time_per_call(fn, prefixes, top_k, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for prefix in prefixes:
+            fn(prefix, top_k)
+    return (time.perf_counter() - start) / (repeat * len(prefixes))
+
+
+def main(top_k=5, repeat=20):
+    print(f"Vocabulary: {len(word_trie)} words, index: top {model.topk_depth} per trie node\n")
+
+    by_length = {}
+    for word in word_trie.keys():
+        for end in range(1, len(word) + 1):
+            by_length.setdefault(end, set()).add(word[:end])
+
+    print(f"{'prefix len':>10} {'prefixes':>9} {'avg subtree':>12} {'scan+sort':>12} {'index':>10} {'speedup':>8}")
+    for length in (1, 2, 3, 4):
+        prefixes = sorted(by_length.get(length, ()))
+        if not prefixes:
+            continue
+
+        # Sanity check: both paths agree on the frequencies they return
+        for prefix in prefixes:
+            expected = [word_trie[w] for w in scan_and_sort(prefix, top_k)]
+            assert [word_trie[w] for w in complete_by_frequency(prefix, top_k)] == expected, prefix
+
+        subtree = sum(len(scan_completions(p)) for p in prefixes) / len(prefixes)
+        scan_time = time_per_call(scan_and_sort, prefixes, top_k, repeat)
+        index_time = time_per_call(complete_by_frequency, prefixes, top_k, repeat)
+        print(f"{length:>10} {len(prefixes):>9} {subtree:>12.1f} {scan_time * 1e6:>10.1f}us "
+              f"{index_time * 1e6:>8.2f}us {scan_time / index_time:>7.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# Benchmark: completion in context via the lexicographic successor index and its
+# sparse table, versus scanning the context's whole best-first successor list.
+#
+# Uses the contexts of the shipped model that are long enough to get a sparse
+# table, plus a synthetic model whose single context is followed by every word of
+# the vocabulary, the worst case for the scan.
+#
+# Run from anywhere: python benchmarks/bench_context_completion.py
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine.csr_model import RMQ_MIN_SUCCESSORS, build_model_bytes, table_from_dict
+from engine.model_format import MappedModel
+from inference_engine import MODEL_PATH
+
+
+def scan_in_range(model, context_index, lo, hi, top_k):
+    """The pre-index path: walk the best-first successors, keeping ids in range."""
+    suggested = []
+    for word_id in model.successor_ids(context_index):
+        if lo <= word_id < hi:
+            suggested.append(word_id)
+            if len(suggested) == top_k:
+                break
+    return suggested
+
+
+def queries_for(model, contexts, lengths=(1, 2, 3)):
+    """(context index, lo, hi) for every prefix of every successor of the contexts."""
+    queries = set()
+    for context_index in contexts:
+        for word_id in model.successor_ids(context_index):
+            word = model.word(word_id).encode('utf-8')
+            for length in lengths:
+                node = model.walk(word[:length])
+                if node >= 0:
+                    queries.add((context_index, *model.id_range(node)))
+    return sorted(queries)
+
+
+def time_per_call(fn, model, queries, top_k, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for context_index, lo, hi in queries:
+            fn(model, context_index, lo, hi, top_k)
+    return (time.perf_counter() - start) / (repeat * len(queries))
+
+
+def compare(label, model, queries, top_k=5, repeat=5):
+    for context_index, lo, hi in queries:
+        assert (model.successor_ids_in_range(context_index, lo, hi, top_k)
+                == scan_in_range(model, context_index, lo, hi, top_k)), (context_index, lo, hi)
+    scan_time = time_per_call(scan_in_range, model, queries, top_k, repeat)
+    index_time = time_per_call(MappedModel.successor_ids_in_range, model, queries, top_k, repeat)
+    print(f"{label:>24} {len(queries):>8} {scan_time * 1e6:>10.2f}us {index_time * 1e6:>8.2f}us "
+          f"{scan_time / index_time:>7.1f}x")
+
+
+def main():
+    model = MappedModel.open(MODEL_PATH)
+    rmq_off = model.array('rmq_off')
+    indexed = [c for c in range(len(model.ctx_keys)) if rmq_off[c + 1] > rmq_off[c]]
+
+    # Every word follows one context, with random probabilities
+    vocab = model.vocabulary()
+    rng = random.Random(0)
+    order = list(range(len(vocab)))
+    rng.shuffle(order)
+    wide = table_from_dict({(0, 0): [(word_id, 1 / (rank + 1)) for rank, word_id in enumerate(order)]})
+    wide_model = MappedModel(build_model_bytes(vocab, model.freq, wide))
+
+    print(f"{'contexts':>24} {'queries':>8} {'scan':>12} {'index':>10} {'speedup':>8}")
+    compare(f"diary (>= {RMQ_MIN_SUCCESSORS} successors)", model, queries_for(model, indexed))
+    compare(f"synthetic ({len(vocab)} successors)", wide_model, queries_for(wide_model, [0]), repeat=1)
+
+
+if __name__ == "__main__":
+    main()
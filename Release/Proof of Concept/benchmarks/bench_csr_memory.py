@@ -0,0 +1,83 @@
+# Benchmark: memory of the CSR-packed trigram tables versus the dict-of-dicts
+# model (dict[tuple[str, str], dict[str, float]]) that step4_train_ngram.py pickles.
+#
+# Uses a synthetic Zipf-distributed corpus so it can be scaled up; the result is
+# reported per trigram and extrapolated to a 100M-token corpus.
+#
+# Run from anywhere: python benchmarks/bench_csr_memory.py [tokens]
+
+import os
+import sys
+import time
+from collections import defaultdict
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine.csr_model import build_ngram_table, count_trigrams
+
+
+def synthetic_corpus(tokens, vocab_size=50000, sentence_length=20, seed=0):
+    rng = np.random.default_rng(seed)
+    ids = (rng.zipf(1.2, size=tokens) - 1) % vocab_size
+    return [ids[i:i + sentence_length].astype(np.uint32) for i in range(0, tokens, sentence_length)]
+
+
+def dict_of_dicts_bytes(ngram_model):
+    """Deep size of the nested dict model, counting each distinct object once."""
+    seen = set()
+    total = 0
+
+    def size(obj):
+        if id(obj) in seen:
+            return 0
+        seen.add(id(obj))
+        return sys.getsizeof(obj)
+
+    total += size(ngram_model)
+    for context, next_words in ngram_model.items():
+        total += size(context) + sum(size(word) for word in context) + size(next_words)
+        for word, prob in next_words.items():
+            total += size(word) + size(prob)
+    return total
+
+
+def main(tokens=1_000_000):
+    sentences = synthetic_corpus(tokens)
+    vocab = [f"w{i}" for i in range(50000)]
+
+    start = time.perf_counter()
+    freq = np.bincount(np.concatenate(sentences), minlength=len(vocab))
+    table = build_ngram_table(*count_trigrams(sentences), freq)
+    build_time = time.perf_counter() - start
+    csr_bytes = sum(array.nbytes for array in table)
+    trigrams = len(table.ids)
+
+    # The same counts as step4's nested dicts of strings and float probabilities
+    start = time.perf_counter()
+    ngram_model = defaultdict(lambda: defaultdict(int))
+    for ids in sentences:
+        words = [vocab[i] for i in ids]
+        for i in range(len(words) - 2):
+            ngram_model[(words[i], words[i + 1])][words[i + 2]] += 1
+    for next_words in ngram_model.values():
+        total = sum(next_words.values())
+        for word in next_words:
+            next_words[word] /= total
+    dict_time = time.perf_counter() - start
+    dict_bytes = dict_of_dicts_bytes(ngram_model)
+
+    print(f"Synthetic corpus: {tokens:,} tokens, {len(table.ctx_keys):,} contexts, {trigrams:,} trigrams\n")
+    print(f"{'':>16} {'build':>9} {'memory':>10} {'bytes/trigram':>14}")
+    print(f"{'dict-of-dicts':>16} {dict_time:>8.2f}s {dict_bytes / 2**20:>8.1f}MB {dict_bytes / trigrams:>14.1f}")
+    print(f"{'CSR (NumPy)':>16} {build_time:>8.2f}s {csr_bytes / 2**20:>8.1f}MB {csr_bytes / trigrams:>14.1f}")
+    print(f"\nCSR uses {csr_bytes / dict_bytes:.1%} of the dict-of-dicts memory.")
+
+    scale = 100_000_000 / tokens
+    print(f"Linear extrapolation to 100M tokens: ~{dict_bytes * scale / 2**30:.1f} GB (dict-of-dicts) "
+          f"vs ~{csr_bytes * scale / 2**30:.1f} GB (CSR)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
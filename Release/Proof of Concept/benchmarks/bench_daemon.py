@@ -0,0 +1,103 @@
+# Benchmark: the prediction daemon (engine.server) seen from its client library.
+#
+# Starts a daemon on a temporary socket, then measures the time for a client
+# process to get its first prediction (vs importing inference_engine), the round
+# trip of one query, pipelined throughput on one connection, and throughput with
+# several concurrent clients.
+#
+# Run from anywhere: python benchmarks/bench_daemon.py [clients]
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from engine.client import PredictionClient
+from engine.protocol import DEFAULT_ADDRESS
+
+CORPUS = os.path.join(os.path.dirname(os.path.dirname(ROOT)), 'Data Processing', 'Data Processing', 'Data',
+                      'preprocessed_diary.json')
+
+FIRST_PREDICTION = {
+    'in-process': "import time; s = time.perf_counter(); import inference_engine; "
+                  "inference_engine.predict_next_word(['i', 'am']); print(time.perf_counter() - s)",
+    'daemon client': "import time; s = time.perf_counter(); from engine.client import PredictionClient; "
+                     "PredictionClient.connect_if_running({address!r}).next_words(['i', 'am']); "
+                     "print(time.perf_counter() - s)",
+}
+
+
+def start_daemon(address):
+    daemon = subprocess.Popen([sys.executable, '-m', 'engine.server', '--address', address], cwd=ROOT,
+                              stdout=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        client = PredictionClient.connect_if_running(address)
+        if client is not None:
+            return daemon, client
+        time.sleep(0.1)
+    daemon.kill()
+    raise RuntimeError("prediction daemon did not start")
+
+
+def main(clients=8):
+    with open(CORPUS, 'r', encoding='utf-8') as f:
+        sentences = json.load(f)
+    queries = [(sentence[max(0, i - 2):i], word[:length])
+               for sentence in sentences[:1000] for i, word in enumerate(sentence) for length in (1, 2, 3)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        address = DEFAULT_ADDRESS if isinstance(DEFAULT_ADDRESS, tuple) else os.path.join(tmp, 'bench.sock')
+        run(address, queries, clients)
+
+
+def run(address, queries, clients):
+    daemon, client = start_daemon(address)
+    try:
+        print("Time to first prediction in a fresh process:")
+        for name, code in FIRST_PREDICTION.items():
+            output = subprocess.run([sys.executable, '-c', code.format(address=address)], cwd=ROOT,
+                                    capture_output=True, text=True, check=True).stdout
+            print(f"{name:>16} {float(output.splitlines()[-1]) * 1000:>8.1f} ms")
+
+        client.complete_many(queries, 3)  # warm the daemon's cache the same way for every run below
+        start = time.perf_counter()
+        for context, prefix in queries[:5000]:
+            client.complete(prefix, context, 3)
+        round_trip = (time.perf_counter() - start) / 5000
+
+        start = time.perf_counter()
+        client.complete_many(queries, 3)
+        pipelined = len(queries) / (time.perf_counter() - start)
+
+        def worker():
+            own = PredictionClient(address)
+            own.complete_many(queries, 3)
+            own.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(clients)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        concurrent = clients * len(queries) / (time.perf_counter() - start)
+
+        print(f"\nOne query per round trip: {round_trip * 1e6:.0f} us")
+        print(f"Pipelined, one connection: {pipelined:,.0f} queries/s")
+        print(f"Pipelined, {clients} concurrent clients: {concurrent:,.0f} queries/s")
+        print(f"Daemon cache: {client.stats()['cache']}")
+    finally:
+        client.close()
+        daemon.terminate()
+        daemon.wait()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 8)
@@ -0,0 +1,77 @@
+# Benchmark: anytime completion under a per-keystroke deadline.
+#
+# Runs the typo-tolerant completion queries of bench_fuzzy.py (the slowest
+# per-keystroke search) with and without a deadline, and reports latency
+# percentiles, how often the deadline cut a search short, and how often the
+# partial ranking already had the final top suggestion. Results that finish
+# within the deadline must equal the unbounded ones.
+#
+# Run from anywhere: python benchmarks/bench_deadline.py [queries] [max_edits] [deadline ms]
+
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_fuzzy import CORPUS, typo
+from engine.deadline import Deadline
+from engine.fuzzy import fuzzy_completion_ids
+from engine.model_format import MappedModel
+from inference_engine import MODEL_PATH
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def timed(model, queries, top_k, max_edits, seconds):
+    """(results, partial flags, latencies) of every query, with a deadline unless seconds is None."""
+    results, partial, latencies = [], [], []
+    for prefix, context_index, last_id in queries:
+        start = time.perf_counter()
+        deadline = Deadline.start(seconds)
+        results.append(fuzzy_completion_ids(model, prefix, context_index, last_id, top_k, max_edits, deadline))
+        latencies.append(time.perf_counter() - start)
+        partial.append(deadline is not None and deadline.hit)
+    return results, partial, latencies
+
+
+def main(count=200, max_edits=2, deadline_ms=8, top_k=5):
+    model = MappedModel.open(MODEL_PATH)
+    with open(CORPUS, 'r', encoding='utf-8') as f:
+        sentences = json.load(f)
+
+    rng = random.Random(0)
+    queries = []
+    while len(queries) < count:
+        sentence = rng.choice(sentences)
+        i = rng.randrange(len(sentence))
+        if len(sentence[i]) >= 3 and sentence[i].isalpha():
+            context_ids = model.context_ids(sentence[max(0, i - 2):i])
+            last_id = context_ids[-1] if context_ids else None
+            queries.append((typo(sentence[i], rng), model.context_index(context_ids), last_id))
+
+    full, _, full_latency = timed(model, queries, top_k, max_edits, None)
+    bounded, partial, bounded_latency = timed(model, queries, top_k, max_edits, deadline_ms / 1e3)
+
+    assert all(cut or got == want for got, want, cut in zip(bounded, full, partial))
+    cut = [i for i, flag in enumerate(partial) if flag]
+    same_top = sum(bool(bounded[i]) and bounded[i][0] == full[i][0] for i in cut)
+
+    print(f"{count} mistyped prefixes, max {max_edits} edit(s), top {top_k}, deadline {deadline_ms} ms\n")
+    print(f"{'':>12} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}")
+    for label, latencies in (('no deadline', full_latency), ('deadline', bounded_latency)):
+        print(f"{label:>12} " + " ".join(f"{percentile(latencies, p) * 1e3:>6.2f}ms" for p in (0.5, 0.9, 0.99))
+              + f" {max(latencies) * 1e3:>6.2f}ms")
+    print(f"\nPartial results: {len(cut)}/{count}; "
+          f"their top suggestion matched the full search for {same_top}/{len(cut)}")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:4]))
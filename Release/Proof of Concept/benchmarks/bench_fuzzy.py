@@ -0,0 +1,106 @@
+# Benchmark: typo-tolerant completion with the Levenshtein automaton walked over
+# the trie, versus a brute-force edit-distance scan of the whole vocabulary.
+#
+# Queries are prefixes of diary words with one random typing mistake (a
+# substitution, insertion or deletion), typed after the word's real context.
+# Both paths must return the same suggestions.
+#
+# Run from anywhere: python benchmarks/bench_fuzzy.py [queries] [max_edits]
+
+import json
+import os
+import random
+import string
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from engine.fuzzy import EDIT_PENALTY, backoff_scores, fuzzy_completion_ids
+from engine.model_format import MappedModel
+from inference_engine import MODEL_PATH
+
+CORPUS = os.path.join(os.path.dirname(os.path.dirname(ROOT)), 'Data Processing', 'Data Processing', 'Data',
+                      'preprocessed_diary.json')
+
+
+def prefix_distance(typed, word, max_edits):
+    """Fewest edits turning typed into some prefix of word (full Wagner-Fischer table)."""
+    row = list(range(len(typed) + 1))
+    best = row[-1]
+    for char in word:
+        new_row = [row[0] + 1]
+        for j in range(1, len(typed) + 1):
+            new_row.append(min(row[j] + 1, new_row[j - 1] + 1, row[j - 1] + (typed[j - 1] != char)))
+        row = new_row
+        best = min(best, row[-1])
+    return best if best <= max_edits else None
+
+
+def brute_force(model, vocabulary, prefix, context_index, last_id, top_k, max_edits):
+    """Score every word within the edit budget and keep the best, as fuzzy_completion_ids ranks them."""
+    max_edits = max(min(max_edits, len(prefix) - 1), 0)
+    candidates = {}
+    for word_id, word in enumerate(vocabulary):
+        edits = prefix_distance(prefix, word, max_edits)
+        if edits is not None:
+            candidates[word_id] = edits
+    scores = backoff_scores(model, context_index, last_id, candidates)
+    return sorted(candidates, key=lambda word_id: (EDIT_PENALTY * candidates[word_id] - scores[word_id],
+                                                   -model.freq[word_id], word_id))[:top_k]
+
+
+def typo(word, rng):
+    """A prefix of word with one random edit."""
+    prefix = list(word[:rng.randint(2, len(word))])
+    position = rng.randrange(len(prefix))
+    kind = rng.choice(('substitute', 'insert', 'delete'))
+    if kind == 'substitute':
+        prefix[position] = rng.choice(string.ascii_lowercase)
+    elif kind == 'insert':
+        prefix.insert(position, rng.choice(string.ascii_lowercase))
+    elif len(prefix) > 2:
+        del prefix[position]
+    return ''.join(prefix)
+
+
+def main(count=200, max_edits=1, top_k=5):
+    model = MappedModel.open(MODEL_PATH)
+    vocabulary = model.vocabulary()
+    with open(CORPUS, 'r', encoding='utf-8') as f:
+        sentences = json.load(f)
+
+    rng = random.Random(0)
+    queries = []
+    while len(queries) < count:
+        sentence = rng.choice(sentences)
+        i = rng.randrange(len(sentence))
+        if len(sentence[i]) >= 3 and sentence[i].isalpha():
+            context_ids = model.context_ids(sentence[max(0, i - 2):i])
+            last_id = context_ids[-1] if context_ids else None
+            queries.append((typo(sentence[i], rng), model.context_index(context_ids), last_id, sentence[i]))
+
+    start = time.perf_counter()
+    automaton = [fuzzy_completion_ids(model, prefix, context_index, last_id, top_k, max_edits)
+                 for prefix, context_index, last_id, _ in queries]
+    automaton_time = (time.perf_counter() - start) / count
+
+    start = time.perf_counter()
+    scanned = [brute_force(model, vocabulary, prefix, context_index, last_id, top_k, max_edits)
+               for prefix, context_index, last_id, _ in queries]
+    scan_time = (time.perf_counter() - start) / count
+
+    assert automaton == scanned
+    exact = sum(bool(model.complete(prefix, [], 1)) for prefix, _, _, _ in queries)
+    recovered = sum(model.word_id(word) in ids for (_, _, _, word), ids in zip(queries, automaton))
+
+    print(f"{count} mistyped prefixes, max {max_edits} edit(s), top {top_k}, vocabulary {len(vocabulary)}\n")
+    print(f"{'brute-force scan':>18} {scan_time * 1e3:>8.2f} ms/query")
+    print(f"{'trie automaton':>18} {automaton_time * 1e3:>8.2f} ms/query ({scan_time / automaton_time:.0f}x)")
+    print(f"\nExact prefix match finds anything for {exact}/{count}; "
+          f"the intended word is suggested for {recovered}/{count}")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
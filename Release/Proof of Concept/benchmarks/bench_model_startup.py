@@ -0,0 +1,53 @@
+# Benchmark: model startup cost - unpickling word_trie.pkl + ngram_model.pkl
+# (the engine's old import-time work) versus mapping model.osk.
+#
+# Run from anywhere: python benchmarks/bench_model_startup.py
+
+import os
+import pickle
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine.model_format import MappedModel
+
+MODELS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Models')
+
+
+def load_pickles():
+    with open(os.path.join(MODELS_DIR, 'word_trie.pkl'), 'rb') as f:
+        word_trie = pickle.load(f)
+    with open(os.path.join(MODELS_DIR, 'ngram_model.pkl'), 'rb') as f:
+        ngram_model = pickle.load(f)
+    return word_trie, ngram_model
+
+
+def open_mapped():
+    model = MappedModel.open(os.path.join(MODELS_DIR, 'model.osk'))
+    model.next_words(["good", "morning"])  # first query touches the pages it needs
+    return model
+
+
+def best_of(fn, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    if not os.path.exists(os.path.join(MODELS_DIR, 'model.osk')):
+        print("model.osk is missing - run 'python -m engine.convert_model' first")
+        return
+
+    pickle_time = best_of(load_pickles)
+    mapped_time = best_of(open_mapped)
+    print(f"pickle.load (trie + n-grams): {pickle_time * 1e3:8.2f} ms")
+    print(f"mmap model.osk + 1st query:   {mapped_time * 1e3:8.2f} ms  ({pickle_time / mapped_time:.0f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
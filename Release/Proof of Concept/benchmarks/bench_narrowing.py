@@ -0,0 +1,67 @@
+# Benchmark: per-keystroke completion cost by prefix length, with prefix
+# narrowing (the previous keystroke's candidates filtered by the longer
+# prefix) versus a fresh lookup on every keystroke.
+#
+# Replays diary words character by character in their real context, as
+# complete_current_word sees them without the result cache. Both paths must
+# return the same completions.
+#
+# Run from anywhere: python benchmarks/bench_narrowing.py [sentences] [top_k]
+
+import json
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from engine.model_format import MappedModel
+from engine.narrowing import NarrowingCompleter
+from inference_engine import MODEL_PATH
+
+CORPUS = os.path.join(os.path.dirname(os.path.dirname(ROOT)), 'Data Processing', 'Data Processing', 'Data',
+                      'preprocessed_diary.json')
+
+
+def main(count=500, top_k=3, repeat=5):
+    model = MappedModel.open(MODEL_PATH)
+    with open(CORPUS, 'r', encoding='utf-8') as f:
+        sentences = random.Random(0).sample(json.load(f), count)
+    keystrokes = [(word[:length], sentence[max(0, i - 2):i])
+                  for sentence in sentences for i, word in enumerate(sentence)
+                  for length in range(1, len(word) + 1)]
+
+    completer = NarrowingCompleter()
+    for prefix, context in keystrokes:
+        assert model.words(completer.completion_ids(model, prefix, context, top_k)) == \
+            model.complete(prefix, context, top_k), (prefix, context)
+
+    fresh, narrowed = defaultdict(float), defaultdict(float)
+    for _ in range(repeat):
+        for prefix, context in keystrokes:
+            start = time.perf_counter()
+            model.complete(prefix, context, top_k)
+            middle = time.perf_counter()
+            model.words(completer.completion_ids(model, prefix, context, top_k))
+            end = time.perf_counter()
+            fresh[len(prefix)] += middle - start
+            narrowed[len(prefix)] += end - middle
+
+    calls = defaultdict(int)
+    for prefix, _ in keystrokes:
+        calls[len(prefix)] += repeat
+    stats = completer.stats()
+    print(f"{len(keystrokes)} keystrokes over {count} sentences, top {top_k}\n")
+    print(f"{'prefix length':>14} {'keystrokes':>11} {'fresh':>10} {'narrowing':>10} {'speedup':>8}")
+    for length in sorted(calls):
+        if calls[length] >= 50 * repeat:
+            print(f"{length:>14} {calls[length] // repeat:>11} {fresh[length] / calls[length] * 1e6:>8.2f}us "
+                  f"{narrowed[length] / calls[length] * 1e6:>8.2f}us {fresh[length] / narrowed[length]:>7.1f}x")
+    print(f"\n{stats['narrowed_rate']:.0%} of keystrokes answered by narrowing")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,80 @@
+# Benchmark: the LSTM next-word engine with the per-session recurrent state
+# advanced one word per commit, versus re-encoding the whole context for every
+# suggestion.
+#
+# Replays diary sentences through a NeuralSession, typing every prefix of every
+# word and committing it, and times the suggestions and the commits. The
+# re-encoding reference must give the same words. Also reports how long the
+# int8 weights take to load, against the same weights stored as float32.
+#
+# Run from anywhere: python benchmarks/bench_neural_lm.py [sentences]
+
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from engine.build_model import DATA_DIR
+from engine.neural_lm import NeuralLanguageModel, NeuralSession
+from inference_engine import NEURAL_LM_PATH
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def timed_load(path, repeat=20):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        model = NeuralLanguageModel.load(path)
+    return model, (time.perf_counter() - start) / repeat
+
+
+def main(count=100):
+    if not os.path.exists(NEURAL_LM_PATH):
+        sys.exit("No neural model yet: run 'python -m engine.train_neural_lm' first")
+    model, int8_seconds = timed_load(NEURAL_LM_PATH)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'float32.npz')
+        model.save(path, quantized=False)
+        float_size = os.path.getsize(path)
+        _, float_seconds = timed_load(path)
+    with open(os.path.join(DATA_DIR, 'preprocessed_diary.json'), 'r', encoding='utf-8') as f:
+        sentences = random.Random(0).sample(json.load(f), count)
+
+    session = NeuralSession(model)
+    timings = {name: [] for name in ('commit (one step)', 'suggest, kept state', 'suggest, re-encoded')}
+    for sentence in sentences:
+        session.reset()
+        for word in sentence:
+            for char in word:
+                session.type_char(char)
+                start = time.perf_counter()
+                words = session.suggestions(5)
+                timings['suggest, kept state'].append(time.perf_counter() - start)
+                start = time.perf_counter()
+                expected = model.completions(model.encode(session.context), session.prefix, 5)
+                timings['suggest, re-encoded'].append(time.perf_counter() - start)
+                assert words == expected, (session.context, session.prefix, words, expected)
+            start = time.perf_counter()
+            session.commit_word()
+            timings['commit (one step)'].append(time.perf_counter() - start)
+
+    words = sum(len(sentence) for sentence in sentences)
+    print(f"{len(timings['suggest, kept state'])} keystrokes and {words} commits over {count} sentences, "
+          f"{len(model.words)} words, hidden size {model.hidden_size}\n")
+    print(f"{'':>22} {'p50':>9} {'p99':>9}")
+    for label, values in timings.items():
+        print(f"{label:>22} {percentile(values, 0.5) * 1e6:>7.1f}us {percentile(values, 0.99) * 1e6:>7.1f}us")
+    print(f"\nLoading: int8 {os.path.getsize(NEURAL_LM_PATH) / 1024:.0f} KiB in {int8_seconds * 1e3:.1f} ms, "
+          f"float32 {float_size / 1024:.0f} KiB in {float_seconds * 1e3:.1f} ms")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:2]))
@@ -0,0 +1,72 @@
+# Benchmark: per-query latency of the n-gram engine alone versus the two-stage
+# predictor (the engine's 50-candidate shortlist reranked by engine.reranker).
+#
+# Replays diary sentences as next-word queries after every word and completion
+# queries for every prefix, and reports latency percentiles of both stages plus
+# how often the reranker went over its budget. Accuracy is reported on held-out
+# sentences by python -m engine.train_reranker, which also writes the weights.
+#
+# Run from anywhere: python benchmarks/bench_reranker.py [sentences] [budget ms]
+
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from engine.build_model import DATA_DIR
+from engine.model_format import MappedModel
+from engine.reranker import Reranker, two_stage_complete, two_stage_next_words
+from inference_engine import MODEL_PATH, RERANKER_PATH
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def main(count=200, budget_ms=4.0):
+    if not os.path.exists(RERANKER_PATH):
+        sys.exit("No reranker yet: run 'python -m engine.train_reranker' first")
+    model = MappedModel.open(MODEL_PATH)
+    reranker = Reranker.load(RERANKER_PATH)
+    with open(os.path.join(DATA_DIR, 'preprocessed_diary.json'), 'r', encoding='utf-8') as f:
+        sentences = random.Random(0).sample(json.load(f), count)
+
+    budget = budget_ms / 1e3
+    timings = {name: [] for name in ('next words', 'next words, reranked', 'completions',
+                                     'completions, reranked')}
+    fallbacks = 0
+    for sentence in sentences:
+        for i, word in enumerate(sentence):
+            context = sentence[:i]
+            for prefix in [word[:j] for j in range(1, len(word) + 1)]:
+                start = time.perf_counter()
+                model.complete(prefix, context, 3)
+                timings['completions'].append(time.perf_counter() - start)
+                start = time.perf_counter()
+                fallbacks += two_stage_complete(model, reranker, prefix, context, 3, budget=budget).partial
+                timings['completions, reranked'].append(time.perf_counter() - start)
+            start = time.perf_counter()
+            model.next_words(context + [word], 5)
+            timings['next words'].append(time.perf_counter() - start)
+            start = time.perf_counter()
+            fallbacks += two_stage_next_words(model, reranker, context + [word], 5, budget).partial
+            timings['next words, reranked'].append(time.perf_counter() - start)
+
+    queries = len(timings['next words']) + len(timings['completions'])
+    print(f"{queries} queries over {count} sentences, reranker budget {budget_ms} ms\n")
+    print(f"{'':>22} {'p50':>9} {'p99':>9} {'max':>9}")
+    for label, values in timings.items():
+        print(f"{label:>22} {percentile(values, 0.5) * 1e6:>7.1f}us {percentile(values, 0.99) * 1e6:>7.1f}us "
+              f"{max(values) * 1e6:>7.1f}us")
+    stats = reranker.stats()
+    print(f"\nForward pass ~{stats['forward_seconds'] * 1e6:.0f}us; {fallbacks} queries fell back to the "
+          f"first stage ({stats['skipped']} skipped, {stats['overran']} overran)")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:2]), *(float(arg) for arg in sys.argv[2:3]))
@@ -0,0 +1,139 @@
+# Benchmark: n-best rescoring of transcripts (engine.rescoring), one vectorized
+# pass over all hypotheses versus scoring them word by word with
+# MappedModel.probability.
+#
+# Simulates a recognizer on held-out diary sentences: every utterance gets an
+# n-best list of the true sentence and variants with words swapped for others
+# starting with the same letter, dropped or repeated, each with a noisy
+# recognizer score that favours fewer errors. Reports how often the true
+# sentence comes first and the word error rate of the first hypothesis, by the
+# recognizer's score alone and rescored, and the latency of both ways of
+# scoring (which must agree).
+#
+# Run from anywhere: python benchmarks/bench_rescoring.py [utterances] [hypotheses] [LM weight] [word bonus]
+
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from engine.build_model import DATA_DIR
+from engine.csr_model import build_from_corpus
+from engine.model_format import MappedModel
+from engine.rescoring import (LM_WEIGHT, UNKNOWN_PROBABILITY, WORD_BONUS, encode, id_log_probabilities,
+                              log_probabilities, rescore_scores, tokenize)
+
+# Seconds in a 60 Hz frame
+FRAME = 1 / 60
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def word_errors(reference, hypothesis):
+    """Levenshtein distance between two word lists."""
+    row = list(range(len(hypothesis) + 1))
+    for i, word in enumerate(reference, 1):
+        previous, row[0] = row[0], i
+        for j, other in enumerate(hypothesis, 1):
+            previous, row[j] = row[j], min(row[j] + 1, row[j - 1] + 1, previous + (word != other))
+    return row[-1]
+
+
+def n_best(sentence, count, by_letter, rng):
+    """The sentence and count - 1 corrupted variants, with simulated recognizer scores."""
+    variants = {' '.join(sentence): 0}
+    for _ in range(20 * count):
+        if len(variants) >= count:
+            break
+        words = list(sentence)
+        for _ in range(rng.randint(1, 3)):
+            i = rng.randrange(len(words))
+            kind = rng.random()
+            if kind < 0.6:
+                words[i] = rng.choice(by_letter.get(words[i][0], [words[i]]))
+            elif kind < 0.8 and len(words) > 1:
+                del words[i]
+            else:
+                words.insert(i, words[i])
+        variants.setdefault(' '.join(words), word_errors(sentence, words))
+    hypotheses = list(variants)
+    rng.shuffle(hypotheses)
+    # The recognizer is right more often than not, but far from always
+    scores = [-2.0 * variants[hypothesis] + rng.gauss(0, 1.5) for hypothesis in hypotheses]
+    return hypotheses, scores
+
+
+def score_word_by_word(model, hypotheses, context):
+    """Reference: MappedModel.probability for every word of every hypothesis."""
+    totals = []
+    for hypothesis in hypotheses:
+        ids = [model.word_id(word) for word in context[-(model.n - 1):] + tokenize(hypothesis)]
+        start = min(len(context), model.n - 1)
+        total = 0.0
+        for i in range(start, len(ids)):
+            if ids[i] is None:
+                total += np.log(UNKNOWN_PROBABILITY)
+            else:
+                total += np.log(model.probability(ids[max(0, i - model.n + 1):i], ids[i]))
+        totals.append(total)
+    return np.array(totals)
+
+
+def main(count=200, size=200, lm_weight=LM_WEIGHT, word_bonus=WORD_BONUS):
+    with open(os.path.join(DATA_DIR, 'preprocessed_diary.json'), 'r', encoding='utf-8') as f:
+        sentences = json.load(f)
+    rng = random.Random(0)
+    rng.shuffle(sentences)
+    split = len(sentences) // 10
+    heldout, training = sentences[:split], sentences[split:]
+    model = MappedModel(build_from_corpus(training)[0])
+    by_letter = {}
+    # Confusable words from the whole diary, so the true words are not the only ones the model lacks
+    for word in sorted({word for sentence in sentences for word in sentence if word.isalpha()}):
+        by_letter.setdefault(word[0], []).append(word)
+
+    utterances = [sentence for sentence in heldout if 3 <= len(sentence) <= 30][:count]
+    lists = [n_best(sentence, size, by_letter, rng) for sentence in utterances]
+    context = []
+    # The key arrays are derived from the model on the first call; time the calls after it
+    rescore_scores(model, ['warm up'])
+    # Both ways in separate passes, so the word-by-word one does not evict the arrays from the caches
+    timings = {'vectorized': [], 'word by word': []}
+    first = {'recognizer': [0, 0], 'rescored': [0, 0]}
+    for sentence, (hypotheses, asr_scores) in zip(utterances, lists):
+        start = time.perf_counter()
+        ranked, _ = rescore_scores(model, hypotheses, asr_scores, context, lm_weight, word_bonus)
+        timings['vectorized'].append(time.perf_counter() - start)
+        by_recognizer = hypotheses[int(np.argmax(asr_scores))]
+        for name, best in (('recognizer', by_recognizer), ('rescored', ranked[0])):
+            first[name][0] += best == ' '.join(sentence)
+            first[name][1] += word_errors(sentence, best.split())
+    for hypotheses, _ in lists:
+        start = time.perf_counter()
+        expected = score_word_by_word(model, hypotheses, context)
+        timings['word by word'].append(time.perf_counter() - start)
+        assert np.allclose(log_probabilities(model, [tokenize(h) for h in hypotheses], context), expected,
+                           rtol=1e-5)
+        assert np.allclose(id_log_probabilities(model, *encode(model, hypotheses, context)), expected, rtol=1e-5)
+
+    words = sum(len(sentence) for sentence in utterances)
+    print(f"{len(utterances)} utterances, {size} hypotheses each, model from {len(training)} sentences, "
+          f"LM weight {lm_weight}, word bonus {word_bonus}\n")
+    for name, (correct, errors) in first.items():
+        print(f"{name:>12}: true sentence first {correct / len(utterances):.1%}, word error rate {errors / words:.1%}")
+    print(f"\n{'':>14} {'p50':>9} {'p99':>9}   (a 60 Hz frame is {FRAME * 1e3:.1f} ms)")
+    for label, values in timings.items():
+        print(f"{label:>14} {percentile(values, 0.5) * 1e3:>7.2f}ms {percentile(values, 0.99) * 1e3:>7.2f}ms")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]), *(float(arg) for arg in sys.argv[3:5]))
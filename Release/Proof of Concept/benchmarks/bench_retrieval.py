@@ -0,0 +1,97 @@
+# Benchmark: retrieval-augmented next words over the diary sentence index.
+#
+# Builds a model from 90% of the diary sentences and two indexes: one of the
+# same sentences, so the held-out ones are new text, and one of every sentence,
+# so they are text the diary has seen before (the writer coming back to a
+# topic). For every word of the held-out sentences it times the retrieval and
+# reports the next-word top-1/top-3 of the model alone and with the retrieved
+# words mixed in. The blocked, budgeted scan must find sentences as similar as
+# scoring every row at once does.
+#
+# Run from anywhere: python benchmarks/bench_retrieval.py [held-out sentences] [dim]
+
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from engine.adaptation import mixed_next_word_ids
+from engine.build_model import DATA_DIR
+from engine.csr_model import build_from_corpus
+from engine.model_format import MappedModel
+from engine.retrieval import QUERY_WORDS, RETRIEVED, HashingEmbedder, RetrievalLayer, SentenceIndex, build_index
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def search_all(index, words, top_k):
+    """Reference: the best similarities with every row scored in one product."""
+    similarities = np.sort(np.asarray(index.embeddings) @ index.embedder.embed([words])[0])[::-1][:top_k]
+    return similarities[similarities > 0]
+
+
+def evaluate(model, layer, sentences, timings):
+    """Top-1 and top-3 next-word hits of the model alone and with the layer mixed in."""
+    hits, count = np.zeros((2, 2)), 0
+    for sentence in sentences:
+        for i in range(1, len(sentence)):
+            context, word = sentence[:i], sentence[i]
+            context_ids = model.context_ids(context[-(model.n - 1):])
+            context_index = model.context_index(context_ids)
+            start = time.perf_counter()
+            layer.refresh(context)
+            timings.append(time.perf_counter() - start)
+            alone = model.next_word_ids(context_index, context_ids[-1], 3)
+            mixed = mixed_next_word_ids(model, [layer] if layer else [], context_index, context_ids[-1],
+                                        context[-1], 3)
+            for k, ids in enumerate((alone, mixed)):
+                predicted = model.words(ids)
+                hits[k] += [predicted[:1] == [word], word in predicted]
+            count += 1
+    return hits / max(count, 1), count
+
+
+def main(count=276, dim=256):
+    with open(os.path.join(DATA_DIR, 'preprocessed_diary.json'), 'r', encoding='utf-8') as f:
+        sentences = json.load(f)
+    random.Random(0).shuffle(sentences)
+    heldout, training = sentences[:count], sentences[count:]
+    model = MappedModel(build_from_corpus(training)[0])
+
+    timings, cut_short = [], 0
+    print(f"Model and index built from {len(training)} sentences, {count} held out, {dim} dims\n")
+    print(f"{'':>26} {'top-1':>7} {'top-3':>7}")
+    with tempfile.TemporaryDirectory() as directory:
+        for label, indexed in (('new text', training), ('recalled text', sentences)):
+            path = os.path.join(directory, label.replace(' ', '_'))
+            build_index(indexed, path, HashingEmbedder(dim))
+            index = SentenceIndex.open(path)
+            for sentence in heldout[:50]:
+                for i in range(1, len(sentence)):
+                    _, similarities = index.search(sentence[:i][-QUERY_WORDS:], RETRIEVED)
+                    expected = search_all(index, sentence[:i][-QUERY_WORDS:], RETRIEVED)
+                    assert np.allclose(similarities[similarities > 0], expected, atol=1e-6)
+            layer = RetrievalLayer(index)
+            hits, queries = evaluate(model, layer, heldout, timings)
+            print(f"{label + ', model':>26} {hits[0][0]:>7.1%} {hits[0][1]:>7.1%}")
+            print(f"{label + ', retrieval':>26} {hits[1][0]:>7.1%} {hits[1][1]:>7.1%}")
+            cut_short += layer.stats()['cut_short']
+            del index, layer
+
+    print(f"\nRetrieval per committed word over {queries} queries: p50 {percentile(timings, 0.5) * 1e6:.0f}us, "
+          f"p99 {percentile(timings, 0.99) * 1e6:.0f}us, max {max(timings) * 1e6:.0f}us "
+          f"({cut_short} scans cut short by the budget)")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,84 @@
+# Benchmark: interpolating a global and a personal model shard at query time,
+# threshold-algorithm merge versus scoring every word of both vocabularies.
+#
+# The personal shard is built in memory from a sample of diary sentences. Next
+# words and completions are asked for diary contexts; both ways must return the
+# same scores. Also reports how deep the threshold merge read the shard lists.
+#
+# Run from anywhere: python benchmarks/bench_shards.py [queries] [personal sentences] [personal weight]
+
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from engine.build_model import DATA_DIR
+from engine.csr_model import build_from_corpus
+from engine.model_format import MappedModel
+from engine.shards import InterpolatedModel, Shard, completion_source, next_word_source
+from inference_engine import MODEL_PATH
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def interpolate_all(sources, top_k, universe):
+    """Reference: every candidate word scored in every shard."""
+    totals = {word: sum(source.weight * source.score(word) for source in sources) for word in universe}
+    best = sorted(totals, key=lambda word: (-totals[word], word))[:top_k]
+    return [totals[word] for word in best]
+
+
+def main(count=300, personal_count=500, personal_weight=0.2):
+    with open(os.path.join(DATA_DIR, 'preprocessed_diary.json'), 'r', encoding='utf-8') as f:
+        sentences = json.load(f)
+    rng = random.Random(0)
+    data, _ = build_from_corpus(rng.sample(sentences, personal_count))
+    shards = InterpolatedModel([Shard('global', MappedModel.open(MODEL_PATH), 1 - personal_weight),
+                                Shard('personal', MappedModel(data), personal_weight)])
+    universe = sorted({word for shard in shards.shards for word in shard.model.vocabulary()})
+
+    queries = []
+    for sentence in rng.sample([s for s in sentences if len(s) > 2], count):
+        i = rng.randrange(1, len(sentence))
+        queries.append((sentence[:i], sentence[i][:2]))
+
+    timings = {name: [] for name in ('next, threshold', 'next, all words', 'complete, threshold',
+                                     'complete, all words')}
+    for context, prefix in queries:
+        start = time.perf_counter()
+        _, scores = shards.next_word_scores(context, 5)
+        timings['next, threshold'].append(time.perf_counter() - start)
+        start = time.perf_counter()
+        expected = interpolate_all([next_word_source(s.model, s.weight, context) for s in shards.shards],
+                                   5, universe)
+        timings['next, all words'].append(time.perf_counter() - start)
+        assert [round(x, 9) for x in scores] == [round(x, 9) for x in expected]
+
+        start = time.perf_counter()
+        _, scores = shards.complete_scores(prefix, context, 3)
+        timings['complete, threshold'].append(time.perf_counter() - start)
+        start = time.perf_counter()
+        sources = [completion_source(s.model, s.weight, prefix, context) for s in shards.shards]
+        expected = interpolate_all([source for source in sources if source is not None], 3,
+                                   [word for word in universe if word.startswith(prefix)])
+        timings['complete, all words'].append(time.perf_counter() - start)
+        assert [round(x, 9) for x in scores] == [round(x, 9) for x in expected]
+
+    stats = shards.stats()
+    print(f"{count} queries, {len(universe)} words across the shards, personal weight {personal_weight}\n")
+    print(f"{'':>22} {'p50':>10} {'p90':>10}")
+    for label, values in timings.items():
+        print(f"{label:>22} {percentile(values, 0.5) * 1e6:>8.1f}us {percentile(values, 0.9) * 1e6:>8.1f}us")
+    print(f"\nThreshold merge read {stats['mean_depth']:.1f} entries per shard list and scored "
+          f"{stats['mean_random_accesses']:.1f} words per query")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]), *(float(arg) for arg in sys.argv[3:4]))
@@ -0,0 +1,91 @@
+# Benchmark: snippet expansion per keystroke with the Aho-Corasick automaton
+# versus checking every abbreviation against the typed word.
+#
+# Generates abbreviation sets of growing size (the user's real ones plus random
+# letter strings), types diary sentences through a SnippetMatcher with a
+# backspace now and then, and times every keystroke. The naive check must find
+# the same expansions; the automaton's cost should not grow with the set.
+#
+# Run from anywhere: python benchmarks/bench_snippets.py [sentences]
+
+import json
+import os
+import random
+import string
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from engine.build_model import DATA_DIR
+from engine.snippets import SnippetAutomaton, SnippetMatcher
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def random_snippets(count, words, rng):
+    """Diary words and random letter strings as abbreviations, so some of them get typed."""
+    snippets = {word: f"<{word}>" for word in rng.sample(words, min(count // 10, len(words)))}
+    while len(snippets) < count:
+        abbreviation = ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(2, 6)))
+        snippets[abbreviation] = f"<{abbreviation}>"
+    return snippets
+
+
+def naive_expansions(snippets, word):
+    """Reference: every abbreviation compared with the typed word."""
+    return [expansion for abbreviation, expansion in snippets.items() if abbreviation == word]
+
+
+def main(count=200):
+    with open(os.path.join(DATA_DIR, 'preprocessed_diary.json'), 'r', encoding='utf-8') as f:
+        sentences = json.load(f)
+    rng = random.Random(0)
+    words = sorted({word for sentence in sentences for word in sentence if word.isalpha()})
+    sample = rng.sample(sentences, count)
+
+    print(f"Typing {count} diary sentences\n")
+    print(f"{'snippets':>9} {'states':>8} {'compile':>9} {'automaton p50':>14} {'p99':>8} "
+          f"{'naive p50':>10} {'expanded':>9}")
+    for size in (10, 1000, 100000):
+        snippets = random_snippets(size, words, rng)
+        start = time.perf_counter()
+        automaton = SnippetAutomaton(snippets)
+        compile_seconds = time.perf_counter() - start
+        matcher = SnippetMatcher(automaton)
+        # Both ways in separate passes, so the naive scans do not evict the automaton from the caches
+        automaton_timings, found = [], []
+        for sentence in sample:
+            matcher.reset()
+            for word in sentence:
+                for i, char in enumerate(word):
+                    start = time.perf_counter()
+                    matcher.type_char(char)
+                    found.append(matcher.expansions())
+                    automaton_timings.append(time.perf_counter() - start)
+                    if (i + len(word)) % 20 == 0:
+                        # A typo fixed now and then
+                        matcher.backspace()
+                        matcher.type_char(char)
+                matcher.commit_word()
+        naive_timings, expected = [], []
+        for sentence in sample:
+            for word in sentence:
+                for i in range(1, len(word) + 1):
+                    start = time.perf_counter()
+                    expected.append(naive_expansions(snippets, word[:i]))
+                    naive_timings.append(time.perf_counter() - start)
+        assert found == expected
+        expanded = sum(bool(expansions) for expansions in found)
+        print(f"{size:>9} {len(automaton.transitions):>8} {compile_seconds * 1e3:>7.0f}ms "
+              f"{percentile(automaton_timings, 0.5) * 1e6:>12.2f}us "
+              f"{percentile(automaton_timings, 0.99) * 1e6:>6.2f}us "
+              f"{percentile(naive_timings, 0.5) * 1e6:>8.1f}us {expanded:>9}")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:2]))
@@ -0,0 +1,72 @@
+# Benchmark: next-word suggestions on commit, served from speculation versus
+# computed on the commit keystroke.
+#
+# Replays diary sentences through two typing sessions, one speculating on the
+# top completions of every prefix, character by character with a short pause
+# per keystroke, and times the next-word query that follows every committed
+# word. Both sessions must suggest the same words throughout.
+#
+# Run from anywhere: python benchmarks/bench_speculation.py [sentences] [keystroke ms]
+
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from engine.model_format import MappedModel
+from engine.session import PredictionSession
+from inference_engine import MODEL_PATH
+
+CORPUS = os.path.join(os.path.dirname(os.path.dirname(ROOT)), 'Data Processing', 'Data Processing', 'Data',
+                      'preprocessed_diary.json')
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def main(count=200, keystroke_ms=1, top_k=5):
+    model = MappedModel.open(MODEL_PATH)
+    with open(CORPUS, 'r', encoding='utf-8') as f:
+        sentences = random.Random(0).sample(json.load(f), count)
+
+    speculating = PredictionSession(model, speculate=True)
+    plain = PredictionSession(model)
+    timings = {speculating: [], plain: []}
+    for sentence in sentences:
+        for word in sentence:
+            for char in word:
+                for session in (speculating, plain):
+                    session.type_char(char)
+                    suggested = session.suggestions(top_k)
+                time.sleep(keystroke_ms / 1e3)
+            for session in (speculating, plain):
+                session.commit_word(word)
+                start = time.perf_counter()
+                suggested = session.suggestions(top_k)
+                timings[session].append(time.perf_counter() - start)
+                if session is speculating:
+                    expected = suggested
+            assert suggested == expected
+        for session in (speculating, plain):
+            session.reset()
+
+    stats = speculating.speculator.stats()
+    speculating.close()
+    print(f"{len(timings[plain])} commits over {count} sentences, {keystroke_ms} ms per keystroke\n")
+    print(f"{'next words on commit':>22} {'p50':>9} {'p90':>9} {'mean':>9}")
+    for label, session in (('computed', plain), ('speculated', speculating)):
+        values = timings[session]
+        print(f"{label:>22} {percentile(values, 0.5) * 1e6:>7.2f}us {percentile(values, 0.9) * 1e6:>7.2f}us "
+              f"{sum(values) / len(values) * 1e6:>7.2f}us")
+    print(f"\nSpeculated {stats['speculated']} contexts: {stats['hits']} hits, {stats['misses']} misses, "
+          f"{stats['wasted']} wasted (hit rate {stats['hit_rate']:.1%})")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,337 @@
+"""
+Per-application adaptation layers on top of the global model.
+
+Each application (the program owning the window being typed into) gets an
+AppLayer: unigram and bigram counts of the words committed while it was active.
+The layers live in memory beside the model, so switching applications is a
+dictionary lookup and never touches the model file.
+
+Layers count words, not model ids, so they stay valid when the model is
+rebuilt or swapped. At query time the active layer, along with any other
+layers a session mixes in (such as engine.learning's delta), is mixed into the
+global ranking,
+
+    P(w) = (1 - sum_i lambda_i) * P_global(w | context) + sum_i lambda_i * P_i(w | previous word)
+
+where P_i interpolates a layer's bigram and unigram estimates and lambda_i
+grows with the layer's size towards its maximum weight (APP_WEIGHT for an
+application layer), so a layer that has seen a handful of words barely moves
+the ranking. Every count table keeps its best LAYER_DEPTH words ranked as
+counts change, and a query only reads the global model's first 2k candidates
+plus the layers' ranked lists for the previous word and for unigrams, so mixing
+costs the same however much a layer has learned.
+"""
+import threading
+
+# Weight of a fully warmed-up application layer in the mix
+APP_WEIGHT = 0.3
+
+# Words an application layer must see before it gets half of APP_WEIGHT
+WARMUP_WORDS = 50
+
+# Words kept ranked per count table (unigrams, and the successors of every word)
+LAYER_DEPTH = 16
+
+
+class RankedCounts:
+    """Word counts that keep their depth most counted words ranked, at constant cost per update."""
+
+    def __init__(self, depth=LAYER_DEPTH):
+        self.depth = depth
+        self.counts = {}
+        self.total = 0
+        self.top = []
+
+    def add(self, word, count=1):
+        self.total += count
+        count = self.counts[word] = self.counts.get(word, 0) + count
+        if word not in self.top:
+            if len(self.top) >= self.depth and count <= self.counts[self.top[-1]]:
+                return
+            self.top.append(word)
+        self.top.sort(key=lambda w: (-self.counts[w], w))
+        del self.top[self.depth:]
+
+    def remove(self, word):
+        """
+        Take back one occurrence of word (nothing if it has none).
+
+        A ranked word losing a count may fall behind unranked ones, so the ranking
+        is then rebuilt from every count; this only happens when a committed word
+        is reopened, never per keystroke.
+        """
+        count = self.counts.get(word, 0)
+        if not count:
+            return
+        self.total -= 1
+        if count == 1:
+            del self.counts[word]
+        else:
+            self.counts[word] = count - 1
+        if word in self.top:
+            self.top = sorted(self.counts, key=lambda w: (-self.counts[w], w))[:self.depth]
+
+    def probability(self, word):
+        return self.counts.get(word, 0) / self.total if self.total else 0.0
+
+
+class AppLayer:
+    """Unigram and bigram counts of committed words, keyed by the words themselves."""
+
+    def __init__(self, depth=LAYER_DEPTH, max_weight=APP_WEIGHT):
+        """
+        Args:
+            depth (int): Words kept ranked per count table.
+            max_weight (float): The layer's share of the mix once warmed up.
+        """
+        self.depth = depth
+        self.max_weight = max_weight
+        self.unigrams = RankedCounts(depth)
+        self.bigrams = {}
+
+    def learn(self, previous, word):
+        """
+        Count one committed word.
+
+        Args:
+            previous (str): The word before it, None at the start of the text.
+            word (str): The committed word.
+        """
+        self.unigrams.add(word)
+        if previous is not None:
+            successors = self.bigrams.get(previous)
+            if successors is None:
+                successors = self.bigrams[previous] = RankedCounts(self.depth)
+            successors.add(word)
+
+    def unlearn(self, previous, word):
+        """Undo learn(previous, word), e.g. when a committed word is reopened to edit it."""
+        self.unigrams.remove(word)
+        successors = self.bigrams.get(previous)
+        if successors is not None:
+            successors.remove(word)
+            if not successors.total:
+                del self.bigrams[previous]
+
+    def merge(self, other):
+        """Add every count of another layer to this one."""
+        for word, count in other.unigrams.counts.items():
+            self.unigrams.add(word, count)
+        for previous, counts in other.bigrams.items():
+            successors = self.bigrams.get(previous)
+            if successors is None:
+                successors = self.bigrams[previous] = RankedCounts(self.depth)
+            for word, count in counts.counts.items():
+                successors.add(word, count)
+
+    @property
+    def weight(self):
+        """lambda: the layer's share of the mix, growing with what it has seen."""
+        seen = self.unigrams.total
+        return self.max_weight * seen / (seen + WARMUP_WORDS)
+
+    def probability(self, previous, word):
+        """P_app(word | previous word): bigram counts smoothed towards the layer's unigrams."""
+        unigram = self.unigrams.probability(word)
+        successors = self.bigrams.get(previous)
+        if successors is None:
+            return unigram
+        return (successors.counts.get(word, 0) + unigram) / (successors.total + 1)
+
+    def candidates(self, previous):
+        """The layer's best successors of the previous word, then its most counted words."""
+        successors = self.bigrams.get(previous)
+        listed = successors.top if successors is not None else []
+        return listed + [word for word in self.unigrams.top if word not in listed]
+
+    def __bool__(self):
+        return self.unigrams.total > 0
+
+
+class AppLayers:
+    """The adaptation layers of every application, with one of them active."""
+
+    def __init__(self, depth=LAYER_DEPTH):
+        """
+        Args:
+            depth (int): Words kept ranked per count table of each layer.
+        """
+        self.depth = depth
+        self._layers = {}
+        self._lock = threading.Lock()
+        self.app = None
+        self.active = None
+
+    def select(self, app):
+        """
+        Make an application's layer the active one (creating it if new); None for none.
+
+        Args:
+            app (str): Application key, e.g. the executable name of the target window.
+        """
+        with self._lock:
+            if app == self.app:
+                return
+            if app is None:
+                layer = None
+            else:
+                layer = self._layers.get(app)
+                if layer is None:
+                    layer = self._layers[app] = AppLayer(self.depth)
+            self.app, self.active = app, layer
+
+    def learn(self, previous, word):
+        """Count a committed word in the active layer, if any."""
+        with self._lock:
+            if self.active is not None:
+                self.active.learn(previous, word)
+
+    def unlearn(self, previous, word):
+        """Undo learn(previous, word) in the active layer, if any."""
+        with self._lock:
+            if self.active is not None:
+                self.active.unlearn(previous, word)
+
+    def layer(self, app):
+        """The named application's layer, None if it never got one."""
+        return self._layers.get(app)
+
+    def apps(self):
+        """Applications that have a layer."""
+        return list(self._layers)
+
+    def __len__(self):
+        return len(self._layers)
+
+
+def global_score(model, context_index, last_id, word_id):
+    """
+    A lower bound on P_global(word | context) for a word outside the global candidates.
+
+    The stored successor probability if the context has one, else the unigram level
+    of the backoff chain (the bigram level is skipped to keep the cost constant).
+    """
+    weight = 1.0
+    if context_index >= 0:
+        weight = model.ctx_backoff[context_index]
+    if last_id is not None:
+        weight *= model.bi_backoff[last_id]
+    return max(model.successor_probability(context_index, word_id), weight * model.uni_probs[word_id])
+
+
+def layer_candidate_ids(model, layers, previous):
+    """Ids of the layers' ranked words after the previous word (words the model lacks are skipped)."""
+    word_index = model.word_index()
+    ids = (word_index.get(word) for layer in layers for word in layer.candidates(previous))
+    return [word_id for word_id in ids if word_id is not None]
+
+
+def mixed_next_word_ids(model, layers, context_index, last_id, previous, top_k):
+    """
+    MappedModel.next_word_ids with adaptation layers mixed in.
+
+    Args:
+        model (MappedModel): The global model.
+        layers (list): Non-empty AppLayers to mix in; none leaves the ranking as is.
+        context_index (int): Resolved n-gram context, -1 if unseen.
+        last_id (int): Id of the previous word, None if unknown or absent.
+        previous (str): The previous word, None if absent.
+        top_k (int): Number of ids to return.
+
+    Returns:
+        list: Up to top_k ids, best-first.
+    """
+    if not layers:
+        return model.next_word_ids(context_index, last_id, top_k)
+    return mixed_next_word_scores(model, layers, context_index, last_id, previous, top_k)[0]
+
+
+def mixed_next_word_scores(model, layers, context_index, last_id, previous, top_k, candidates=None):
+    """
+    mixed_next_word_ids along with the mixed score of every id.
+
+    Args:
+        candidates (list): Global candidate ids to mix the layers into (e.g. a
+            cached or reranked list); None for the model's first 2k.
+        top_k (int): Number of ids to return; None for every candidate.
+        The others as for mixed_next_word_ids.
+
+    Returns:
+        tuple: (ids, scores), best-first.
+    """
+    if candidates is None:
+        ids, scores = model.next_word_scores(context_index, last_id, 2 * top_k)
+    else:
+        ids = candidates
+        scores = [model.next_word_score(context_index, last_id, word_id) for word_id in ids]
+    scored = dict(zip(ids, scores))
+    for word_id in layer_candidate_ids(model, layers, previous):
+        if word_id not in scored:
+            scored[word_id] = global_score(model, context_index, last_id, word_id)
+    return _rank_mixed(model, layers, previous, scored, top_k)
+
+
+def mixed_completion_ids(model, layers, node, context_index, previous, top_k):
+    """
+    MappedModel.completion_ids with adaptation layers mixed in.
+
+    Global candidates are the model's first 2k completions under the node, scored
+    like engine.fuzzy ranks them (the successor probability, or the frequency
+    share weighted by the context's backoff); the layers add their ranked words
+    that fall under the node.
+
+    Args:
+        model (MappedModel): The global model.
+        layers (list): Non-empty AppLayers to mix in; none leaves the ranking as is.
+        node (int): Trie node of the typed prefix.
+        context_index (int): Resolved n-gram context, -1 if unseen.
+        previous (str): The previous word, None if absent.
+        top_k (int): Number of ids to return.
+
+    Returns:
+        list: Up to top_k ids, best-first.
+    """
+    if not layers:
+        return model.completion_ids(node, context_index, top_k)
+    return mixed_completion_scores(model, layers, node, context_index, previous, top_k)[0]
+
+
+def mixed_completion_scores(model, layers, node, context_index, previous, top_k, candidates=None):
+    """
+    mixed_completion_ids along with the mixed score of every id.
+
+    Args:
+        candidates (list): Global completion ids to mix the layers into (e.g. a
+            cached or reranked list); None for the model's first 2k.
+        top_k (int): Number of ids to return; None for every candidate.
+        The others as for mixed_completion_ids.
+
+    Returns:
+        tuple: (ids, scores), best-first.
+    """
+    lo, hi = model.id_range(node)
+    if candidates is None:
+        candidates = model.completion_ids(node, context_index, 2 * top_k)
+    candidates = list(candidates)
+    candidates += [word_id for word_id in layer_candidate_ids(model, layers, previous) if lo <= word_id < hi]
+    total = model.total_tokens
+    weight = model.ctx_backoff[context_index] if context_index >= 0 else 1.0
+    scored = {word_id: max(model.successor_probability(context_index, word_id),
+                           weight * model.freq[word_id] / total)
+              for word_id in candidates}
+    return _rank_mixed(model, layers, previous, scored, top_k)
+
+
+def mix(model, layers, previous, scores):
+    """(1 - sum of lambdas) * global score + sum of lambda * P_layer, for every scored id."""
+    vocabulary = model.vocabulary()
+    remaining = 1 - sum(layer.weight for layer in layers)
+    return {word_id: remaining * score + sum(layer.weight * layer.probability(previous, vocabulary[word_id])
+                                             for layer in layers)
+            for word_id, score in scores.items()}
+
+
+def _rank_mixed(model, layers, previous, scored, top_k):
+    mixed = mix(model, layers, previous, scored)
+    ids = sorted(mixed, key=lambda word_id: (-mixed[word_id], word_id))[:top_k]
+    return ids, [mixed[word_id] for word_id in ids]
@@ -0,0 +1,324 @@
+"""
+Batched prediction for offline evaluation and replay.
+
+complete_current_word / predict_next_word answer one query per Python call. These
+entry points take thousands of queries at once: queries are grouped by their
+n-gram context (and prefix), every distinct context is resolved with a single
+vectorized searchsorted over the sorted context keys, and successor lists, prefix
+filtering and frequency fill-in are all computed with array operations over the
+model's CSR tables. Python only looks up the words of each distinct context list
+once, and builds one result list per query.
+
+With a deadline (engine.deadline.Deadline) a batch runs in chunks of
+DEADLINE_CHUNK queries and stops between chunks once it expires: the queries
+not reached get empty lists and the result is flagged partial.
+"""
+import gc
+from collections import defaultdict
+from contextlib import contextmanager
+from itertools import chain, count, repeat
+from operator import itemgetter
+
+import numpy as np
+
+from engine.deadline import Suggestions
+
+# Queries per chunk when a batch runs against a deadline
+DEADLINE_CHUNK = 4096
+
+
+@contextmanager
+def _gc_paused():
+    """
+    Suspend the cyclic garbage collector while a batch builds its result lists.
+
+    Hundreds of thousands of freshly allocated lists and tuples would otherwise
+    trigger repeated full collections that cost more than the batch itself.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _encode_contexts(model, contexts):
+    """
+    Resolve the last n-1 words of every context, grouping equal ones, without building a key per query.
+
+    The words are looked up in one pass, laid out right-aligned in a matrix of ids
+    (-2 where a context is shorter), and the rows are grouped with np.unique; the
+    distinct ones are then resolved with one vectorized searchsorted over the
+    sorted context keys. Contexts whose words map to the same ids (e.g. different
+    unknown words) answer alike, so they share a group.
+
+    Returns:
+        tuple: (the group of every context, the context index of every group,
+        -1 for unseen contexts, and the id of every group's last word, -1 for none).
+    """
+    size = model.n - 1
+    lengths = np.fromiter(map(len, contexts), dtype=np.int64, count=len(contexts))
+    # Slicing every context costs more than the lookups: only done when some are longer
+    tails = contexts if lengths.max(initial=0) <= size else map(itemgetter(slice(-size, None)), contexts)
+    lengths = np.minimum(lengths, size)
+    total = int(lengths.sum())
+    tails = chain.from_iterable(tails)
+    ids = np.fromiter(map(model.word_index().get, tails, repeat(-1)), dtype=np.int64, count=total)
+    matrix = np.full((len(contexts), size), -2, dtype=np.int64)
+    within = np.arange(total) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    matrix[np.repeat(np.arange(len(contexts)), lengths), within + np.repeat(size - lengths, lengths)] = ids
+    keys = ((matrix[:, 0] + 2) << 32) | (matrix[:, 1] + 2)
+    _, first, groups = np.unique(keys, return_index=True, return_inverse=True)
+    distinct = matrix[first]
+
+    known = (distinct >= 0).all(axis=1)
+    packed = (distinct[:, 0].astype(np.uint64) << np.uint64(32)) | distinct[:, 1].astype(np.uint64)
+    ctx_keys = model.array('ctx_keys')
+    position = np.minimum(np.searchsorted(ctx_keys, packed), max(len(ctx_keys) - 1, 0))
+    found = known & (len(ctx_keys) > 0)
+    found[found] = ctx_keys[position[found]] == packed[found]
+    return groups.ravel(), np.where(found, position, -1), np.maximum(distinct[:, -1], -1)
+
+
+def _group(keys):
+    """
+    Number the distinct keys (any iterable) in order of first appearance.
+
+    Returns:
+        tuple: (the distinct keys, the group number of every key)
+    """
+    index = defaultdict(count().__next__)
+    groups = np.fromiter(map(index.__getitem__, keys), dtype=np.int64)
+    return list(index), groups
+
+
+def _segment_positions(offsets, rows, width):
+    """
+    Positions of the first `width` entries of CSR segments, as a matrix.
+
+    Args:
+        offsets (numpy.ndarray): CSR offsets (e.g. succ_off).
+        rows (numpy.ndarray): Segment of every output row, -1 for none.
+        width (int): Columns of the matrix.
+
+    Returns:
+        tuple: (positions, mask of the entries that exist); masked-out positions are 0.
+    """
+    offsets = offsets.astype(np.int64)
+    present = rows >= 0
+    starts = np.where(present, offsets[rows], 0)
+    lengths = np.where(present, offsets[rows + 1] - starts, 0)
+
+    columns = np.arange(width)
+    mask = columns[None, :] < np.minimum(lengths, width)[:, None]
+    return np.where(mask, starts[:, None] + columns[None, :], 0), mask
+
+
+def _append_unique(ranked, count, fill, fill_mask, top_k):
+    """
+    Append each row's fill ids (where fill_mask) after its `count` ranked ones, skipping
+    ids already ranked, until the row holds top_k. Updates ranked in place.
+
+    Returns:
+        numpy.ndarray: The new number of ids in every row.
+    """
+    keep = fill_mask.copy()
+    for column in range(top_k):
+        keep &= fill != ranked[:, column:column + 1]
+    slot = np.cumsum(keep, axis=1) - 1 + count[:, None]
+    place = keep & (slot < top_k)
+    ranked[np.nonzero(place)[0], slot[place]] = fill[place]
+    return count + place.sum(axis=1)
+
+
+def _rows_to_words(model, rows):
+    """Word lists for a matrix of word ids whose rows are packed to the left and padded with -1."""
+    vocabulary = np.empty(model.vocab_size + 1, dtype=object)
+    vocabulary[:-1] = model.vocabulary()
+    words = vocabulary[rows].tolist()
+    counts = (rows >= 0).sum(axis=1)
+    for row in np.flatnonzero(counts < rows.shape[1]).tolist():
+        words[row] = words[row][:counts[row]]
+    return words
+
+
+def _by_chunks(run, model, queries, top_k, deadline):
+    """Run a batch function over chunks of queries until the deadline expires."""
+    results = Suggestions()
+    for start in range(0, len(queries), DEADLINE_CHUNK):
+        if deadline.expired():
+            results.extend([] for _ in range(len(queries) - start))
+            break
+        results.extend(run(model, queries[start:start + DEADLINE_CHUNK], top_k))
+    results.partial = deadline.hit
+    return results
+
+
+def predict_batch(model, contexts, top_k=5, deadline=None):
+    """
+    Next-word predictions for many contexts at once.
+
+    Args:
+        model (MappedModel): The model to query.
+        contexts (list): One list of previous words per query.
+        top_k (int): Suggestions per query.
+        deadline (Deadline): Optional; see the module docstring.
+
+    Returns:
+        list: One ranked list of words per query, as predict_next_word would return.
+    """
+    if deadline is not None:
+        return _by_chunks(predict_batch, model, contexts, top_k, deadline)
+    if not contexts:
+        return []
+    with _gc_paused():
+        groups, context_index, last_ids = _encode_contexts(model, contexts)
+        return _rows_to_words(model, _ranked_next_ids(model, context_index, last_ids, top_k)[groups])
+
+
+def _ranked_next_ids(model, context_index, last_ids, top_k):
+    """
+    MappedModel.next_word_ids for many rows: the first k entries of every backoff
+    level are scored side by side, and top_k times every row takes its best
+    entry (ties go to the leftmost, i.e. the higher level, as in the merge) and
+    drops the other copies of that id. Each pick removes at most one entry per
+    level (ids are unique within a level), so k entries per level always suffice.
+    """
+    width = top_k
+    has_ctx, has_last = context_index >= 0, last_ids >= 0
+    ctx_weight = np.where(has_ctx, model.array('ctx_backoff')[np.where(has_ctx, context_index, 0)], 1.0)
+    bi_weight = np.where(has_last, model.array('bi_backoff')[np.where(has_last, last_ids, 0)], 1.0)
+
+    ids, scores = [], []
+    for offsets, level_ids, probs, rows, weight in (('succ_off', 'succ_ids', 'succ_probs', context_index, 1.0),
+                                                    ('bi_off', 'bi_ids', 'bi_probs', last_ids, ctx_weight)):
+        positions, mask = _segment_positions(model.array(offsets), rows, width)
+        ids.append(np.where(mask, model.array(level_ids)[positions], -1))
+        level_weight = weight if np.isscalar(weight) else weight[:, None]
+        scores.append(np.where(mask, model.array(probs)[positions].astype(np.float64) * level_weight, -np.inf))
+    unigram = model.array('uni_ids')[:width].astype(np.int64)
+    ids.append(np.broadcast_to(unigram, (len(context_index), len(unigram))))
+    scores.append(model.array('uni_probs')[unigram].astype(np.float64)[None, :] * (ctx_weight * bi_weight)[:, None])
+    ids = np.concatenate(ids, axis=1).astype(np.int32)
+    scores = np.concatenate(scores, axis=1)
+
+    ranked = np.full((len(ids), top_k), -1, dtype=np.int32)
+    for slot in range(top_k):
+        best = np.argmax(scores, axis=1)[:, None]
+        picked = np.where(np.take_along_axis(scores, best, axis=1) > -np.inf, np.take_along_axis(ids, best, axis=1), -1)
+        ranked[:, slot:slot + 1] = picked
+        scores[ids == picked] = -np.inf
+    return ranked
+
+
+def complete_batch(model, queries, top_k=3, deadline=None):
+    """
+    Word completions for many (context, prefix) queries at once.
+
+    Ranking matches complete_current_word: the context's successors that start with
+    the prefix, best-first, then the most frequent completions not already listed.
+
+    Args:
+        model (MappedModel): The model to query.
+        queries (list): (context, prefix) pairs; context is a list of previous words.
+        top_k (int): Suggestions per query.
+        deadline (Deadline): Optional; see the module docstring.
+
+    Returns:
+        list: One ranked list of words per query.
+    """
+    if deadline is not None:
+        return _by_chunks(complete_batch, model, queries, top_k, deadline)
+    if not queries:
+        return []
+    with _gc_paused():
+        return _complete_groups(model, queries, top_k)
+
+
+def _complete_groups(model, queries, top_k):
+    # Replays pass the same context list for consecutive queries (e.g. every prefix
+    # of a word): only the first of each run is resolved
+    contexts = list(map(itemgetter(0), queries))
+    objects = np.fromiter(map(id, contexts), dtype=np.int64, count=len(contexts))
+    new_run = np.empty(len(contexts), dtype=bool)
+    new_run[:1] = True
+    np.not_equal(objects[1:], objects[:-1], out=new_run[1:])
+    run_groups, context_index, _ = _encode_contexts(model, list(map(contexts.__getitem__, np.flatnonzero(new_run))))
+    context_groups = run_groups[np.cumsum(new_run) - 1]
+    prefixes, prefix_groups = _group(map(itemgetter(1), queries))
+
+    # Every distinct prefix is walked down the trie once
+    prefix_nodes = np.fromiter((model.walk(prefix.encode('utf-8')) if prefix else -1 for prefix in prefixes),
+                               dtype=np.int64, count=len(prefixes))
+
+    # Queries with the same prefix whose contexts resolve alike form a pair, computed once
+    query_ctx = np.where(prefix_nodes[prefix_groups] >= 0, context_index[context_groups], -1)
+    pair_keys, first_query, groups = np.unique((query_ctx + 1) * len(prefixes) + prefix_groups,
+                                               return_index=True, return_inverse=True)
+    pair_prefix = prefix_groups[first_query]
+    pair_node = prefix_nodes[pair_prefix]
+    pair_ctx = query_ctx[first_query]
+    pairs = len(pair_keys)
+    live = pair_node >= 0
+    safe_node = np.where(live, pair_node, 0)
+    lo = model.array('node_lo')[safe_node].astype(np.int64)
+    hi = np.where(live, model.array('node_hi')[safe_node].astype(np.int64), lo)
+
+    # Contextual candidates: the run of each context's lexicographic successors inside
+    # the prefix's id range, found by one searchsorted over (context, id) keys
+    succ_off = model.array('succ_off').astype(np.int64)
+    lex_keys = (np.repeat(np.arange(len(succ_off) - 1, dtype=np.uint64), np.diff(succ_off)) << np.uint64(32)
+                | model.array('lex_ids'))
+    has_ctx = pair_ctx >= 0
+    seg_start = np.where(has_ctx, succ_off[pair_ctx], 0)
+    ctx_key = np.where(has_ctx, pair_ctx, 0).astype(np.uint64) << np.uint64(32)
+    run_start = np.searchsorted(lex_keys, ctx_key | lo.astype(np.uint64))
+    run_len = np.where(has_ctx, np.searchsorted(lex_keys, ctx_key | hi.astype(np.uint64)) - run_start, 0)
+    pair_of = np.repeat(np.arange(pairs), run_len)
+    within = np.arange(len(pair_of)) - np.repeat(np.cumsum(run_len) - run_len, run_len)
+    ranks = model.array('lex_rank')[run_start[pair_of] + within].astype(np.int64)
+
+    # Best-first within each pair, keeping the first top_k
+    order = np.lexsort((ranks, pair_of))
+    pair_of, ranks = pair_of[order], ranks[order]
+    position = np.arange(len(pair_of)) - np.searchsorted(pair_of, pair_of, side='left')
+    take = position < top_k
+    kept_pair = pair_of[take]
+
+    contextual = np.full((pairs, top_k), -1, dtype=np.int64)
+    contextual[kept_pair, position[take]] = model.array('succ_ids')[seg_start[kept_pair] + ranks[take]]
+    contextual_count = np.bincount(kept_pair, minlength=pairs)
+
+    # Frequency fill-in from each prefix's precomputed top-k list, read once per prefix
+    depth = model.topk_depth
+    topk_off = model.array('topk_off').astype(np.int64)
+    live_prefix = prefix_nodes >= 0
+    prefix_node = np.where(live_prefix, prefix_nodes, 0)
+    fill_start = topk_off[prefix_node]
+    fill_len = np.where(live_prefix, topk_off[prefix_node + 1] - fill_start, 0)
+    # A row never needs more than top_k fill ids beyond its contextual ones
+    columns = np.arange(min(depth, 2 * top_k))
+    fill_mask = columns[None, :] < fill_len[:, None]
+    prefix_fill = np.full(fill_mask.shape, -1, dtype=np.int64)
+    prefix_fill[fill_mask] = model.array('topk_ids')[(fill_start[:, None] + columns[None, :])[fill_mask]]
+
+    # Pairs without contextual candidates take the list as it is; the others skip the ids they hold
+    empty = np.flatnonzero(contextual_count == 0)
+    width = min(top_k, len(columns))
+    contextual[empty, :width] = prefix_fill[pair_prefix[empty], :width]
+    partial = np.flatnonzero((contextual_count > 0) & (contextual_count < top_k))
+    fill = prefix_fill[pair_prefix[partial]]
+    merged = contextual[partial]
+    _append_unique(merged, contextual_count[partial], fill, fill >= 0, top_k)
+    contextual[partial] = merged
+
+    # Lists deeper than the precomputed top-k fall back to the single-query path
+    deep = live & (top_k + contextual_count > depth) & (fill_len[pair_prefix] == depth)
+    for pair in np.flatnonzero(deep).tolist():
+        ids = model.completion_ids(int(pair_node[pair]), int(pair_ctx[pair]), top_k)
+        contextual[pair] = -1
+        contextual[pair, :len(ids)] = ids
+
+    return _rows_to_words(model, contextual[groups.ravel()])
@@ -0,0 +1,42 @@
+"""
+Build the diary sentence index for retrieval-augmented next words (engine.retrieval).
+
+Usage (from the Proof of Concept directory):
+    python -m engine.build_diary_index [--diary raw_diary.json] [--tokens preprocessed_diary.json]
+                                       [--output Models/diary_index] [--dim 256]
+
+raw_diary.json holds the diary's sentences as written; preprocessed_diary.json
+holds the same sentences, in the same order, split into the tokens the models
+predict. The index embeds the tokens and keeps the text beside them.
+"""
+import argparse
+import json
+import os
+
+from engine.build_model import DATA_DIR, PROOF_OF_CONCEPT_DIR
+from engine.retrieval import HashingEmbedder, build_index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the diary sentence index")
+    parser.add_argument('--diary', default=os.path.join(DATA_DIR, 'raw_diary.json'))
+    parser.add_argument('--tokens', default=os.path.join(DATA_DIR, 'preprocessed_diary.json'))
+    parser.add_argument('--output', default=os.path.join(PROOF_OF_CONCEPT_DIR, 'Models', 'diary_index'))
+    parser.add_argument('--dim', type=int, default=256, help="hashing embedder buckets")
+    args = parser.parse_args()
+
+    with open(args.diary, 'r', encoding='utf-8') as f:
+        texts = json.load(f)
+    with open(args.tokens, 'r', encoding='utf-8') as f:
+        sentences = json.load(f)
+    if len(texts) != len(sentences):
+        raise SystemExit(f"'{args.diary}' has {len(texts)} sentences but '{args.tokens}' has "
+                         f"{len(sentences)}: preprocess the diary again")
+
+    stats = build_index(sentences, args.output, HashingEmbedder(args.dim), texts)
+    print(f"Indexed {stats['sentences']} sentences with the {stats['embedder']} embedder "
+          f"({stats['dim']} dims, {stats['bytes'] / 1024:.0f} KiB of embeddings) in '{args.output}'")
+
+
+if __name__ == "__main__":
+    main()
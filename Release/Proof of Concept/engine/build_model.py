@@ -0,0 +1,60 @@
+"""
+Build the binary model straight from the tokenized corpus, with NumPy.
+
+Usage (from the Proof of Concept directory):
+    python -m engine.build_model [--corpus preprocessed_diary.json] [--vocabulary vocabulary.json]
+                                 [--output Models/model.osk] [--smoothing kn|ml] [--heldout 0.1]
+
+Word ids come from vocabulary.json (plus any corpus token missing from it) and the
+trigram tables are counted and packed as CSR arrays without building any per-n-gram
+Python objects, so the same command scales to corpora far larger than the diary.
+By default the probabilities are smoothed with interpolated modified Kneser-Ney
+(see engine.kneser_ney); --heldout reports the perplexity of that smoothing on a
+random share of the sentences left out of training.
+"""
+import argparse
+import json
+import os
+
+from engine.csr_model import build_from_corpus
+
+PROOF_OF_CONCEPT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(PROOF_OF_CONCEPT_DIR)),
+                        'Data Processing', 'Data Processing', 'Data')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the binary model from the tokenized corpus")
+    parser.add_argument('--corpus', default=os.path.join(DATA_DIR, 'preprocessed_diary.json'))
+    parser.add_argument('--vocabulary', default=os.path.join(DATA_DIR, 'vocabulary.json'))
+    parser.add_argument('--output', default=os.path.join(PROOF_OF_CONCEPT_DIR, 'Models', 'model.osk'))
+    parser.add_argument('--topk-depth', type=int, default=10)
+    parser.add_argument('--smoothing', choices=('kn', 'ml'), default='kn',
+                        help="interpolated modified Kneser-Ney, or relative frequencies with stupid backoff")
+    parser.add_argument('--heldout', type=float, default=0.0,
+                        help="fraction of sentences held out to report perplexity (kn only)")
+    args = parser.parse_args()
+
+    with open(args.corpus, 'r', encoding='utf-8') as f:
+        sentences = json.load(f)
+
+    vocabulary = args.vocabulary if os.path.exists(args.vocabulary) else None
+    data, stats = build_from_corpus(sentences, vocabulary, args.topk_depth, args.smoothing, args.heldout)
+    with open(args.output, 'wb') as f:
+        f.write(data)
+
+    print(f"Tokens: {stats['tokens']}, vocabulary: {stats['vocab_size']}, "
+          f"contexts: {stats['contexts']}, trigrams: {stats['trigrams']}, bigrams: {stats['bigrams']}")
+    ngrams = stats['trigrams'] + stats['bigrams']
+    print(f"CSR n-gram tables: {stats['table_bytes'] / 1024:.0f} KiB "
+          f"({stats['table_bytes'] / max(ngrams, 1):.1f} bytes/n-gram)")
+    if 'perplexity' in stats:
+        print(f"Held-out perplexity: {stats['perplexity']:.1f} over {stats['heldout_tokens']} tokens "
+              f"({stats['heldout_sentences']} sentences, {stats['heldout_oov']} OOV)")
+    elif args.heldout:
+        print("Held-out perplexity needs --smoothing kn (stupid backoff scores are not probabilities)")
+    print(f"Binary model written to '{args.output}' ({stats['model_bytes'] / 1024:.0f} KiB)")
+
+
+if __name__ == "__main__":
+    main()
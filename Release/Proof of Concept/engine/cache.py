@@ -0,0 +1,120 @@
+"""
+Bounded LRU cache for prediction results.
+
+Typing keeps revisiting the same contexts and prefixes, so answers are cached
+under (context n-gram, prefix, top_k), where the context n-gram is the last n-1
+words (all the model looks at). An empty prefix means next-word prediction.
+
+Every entry is also keyed by the model that computed it, so callers answering
+from different models (the facade with interpolated shards and sessions with
+the plain model, or a learned model swapped in) share the table without
+clearing each other's results, and a swapped or reloaded model can never be
+served another model's suggestions. A model is known by a serial number handed
+out on its first lookup and never reused, so the entries of a model that is
+gone simply age out of the LRU. A single lock guards the table and the counters; the
+prediction itself runs outside the lock, so a background worker computing a
+miss never stalls the UI thread reading a hit. Results a deadline cut short
+(see engine.deadline) are passed through without being stored.
+"""
+import itertools
+import threading
+import weakref
+from collections import OrderedDict
+
+
+class PredictionCache:
+    """Thread-safe, size-bounded LRU map from (context n-gram, prefix, top_k) to ranked words."""
+
+    def __init__(self, max_entries=16384):
+        """
+        Args:
+            max_entries (int): Results kept before the least recently used one is evicted.
+        """
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._serials = weakref.WeakKeyDictionary()
+        self._next_serial = itertools.count()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key(model, context, prefix, top_k):
+        """Cache key of a query: only the last n-1 context words affect the answer."""
+        size = model.n - 1
+        return (tuple(context[-size:]) if size > 0 else ()), prefix, top_k
+
+    def get(self, model, key, compute):
+        """
+        Cached result for key, calling compute() and storing its result on a miss.
+
+        Args:
+            model (MappedModel): The model the result comes from; results are only
+                shared between lookups with the same model.
+            key (tuple): From PredictionCache.key.
+            compute (callable): Produces the ranked list of words; a result with a
+                true partial attribute is returned as is and not cached.
+
+        Returns:
+            list: A fresh copy of the ranked words, safe for the caller to modify.
+        """
+        with self._lock:
+            serial = self._serials.get(model)
+            if serial is None:
+                serial = self._serials[model] = next(self._next_serial)
+            key = serial, key
+            generation = self._generation
+            words = self._entries.get(key)
+            if words is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return list(words)
+            self.misses += 1
+
+        result = compute()
+        if getattr(result, 'partial', False):
+            return result
+        words = tuple(result)
+
+        with self._lock:
+            # The cache may have been invalidated while this result was computed
+            if generation == self._generation:
+                self._entries[key] = words
+                self._entries.move_to_end(key)
+                if len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return list(words)
+
+    def invalidate(self):
+        """Drop every cached result (e.g. after the model learned new words in place)."""
+        with self._lock:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._generation += 1
+
+    def stats(self):
+        """
+        Returns:
+            dict: hits, misses, evictions, invalidations, size, max_entries and hit_rate.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+    def __len__(self):
+        return len(self._entries)
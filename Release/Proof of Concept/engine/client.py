@@ -0,0 +1,306 @@
+"""
+Client for the prediction daemon (engine.server).
+
+Importing this module loads no model, so a keyboard talking to a running daemon
+starts instantly. PredictionClient keeps one connection open and reuses it,
+reconnecting once if the daemon restarted; complete_many / predict_many pipeline
+their requests, writing ahead of the responses they are reading, so a batch
+costs about one round trip instead of one per query. RemoteSession mirrors
+PredictionSession for the UI.
+
+A request made with a deadline (see engine.deadline) waits no longer than it
+for the connection, the daemon's answer included: past it the request fails
+with TimeoutError, the half-read connection is dropped (the next request opens
+a fresh one) and RemoteSession returns empty Suggestions flagged partial, which
+the UI refines without a deadline.
+"""
+import json
+import socket
+import threading
+import time
+
+from engine.deadline import Deadline, Suggestions
+from engine.protocol import (DEFAULT_ADDRESS, OP_COMPLETE, OP_FUZZY, OP_NEXT, OP_PING, OP_STATS, RESPONSE_HEADER,
+                             STATUS_OK, ProtocolError, decode_words, encode_request)
+from engine.speculation import Speculator
+
+# Requests written per pipelined chunk; two chunks of responses fit easily in a socket buffer
+PIPELINE_CHUNK = 256
+
+
+class PredictionClient:
+    """A reusable, thread-safe connection to the prediction daemon."""
+
+    def __init__(self, address=DEFAULT_ADDRESS, timeout=2.0):
+        """
+        Args:
+            address (str | tuple): Unix socket path or (host, port).
+            timeout (float): Seconds to wait for the daemon before giving up.
+        """
+        self.address = address
+        self.timeout = timeout
+        self._sock = None
+        self._file = None
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def connect_if_running(cls, address=DEFAULT_ADDRESS, timeout=2.0, connect_timeout=0.5):
+        """
+        Args:
+            address (str | tuple): Unix socket path or (host, port).
+            timeout (float): Seconds to wait for the daemon once connected.
+            connect_timeout (float): Seconds to wait for a daemon that may not be running.
+
+        Returns:
+            PredictionClient: A connected client, or None when no daemon answers.
+        """
+        client = cls(address, timeout)
+        try:
+            client._connect(connect_timeout)
+            client.ping()
+        except (OSError, ProtocolError):
+            client.close()
+            return None
+        return client
+
+    def _timeout(self, deadline):
+        """Seconds a socket operation may wait: the client timeout, cut to what is left of the deadline."""
+        if deadline is None:
+            return self.timeout
+        remaining = deadline.expires - time.perf_counter()
+        if remaining <= 0:
+            deadline.hit = True
+            raise TimeoutError("deadline expired before the daemon answered")
+        return min(self.timeout, remaining)
+
+    def _connect(self, connect_timeout=None):
+        family = socket.AF_INET if isinstance(self.address, tuple) else socket.AF_UNIX
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.settimeout(connect_timeout or self.timeout)
+        try:
+            sock.connect(self.address)
+        except OSError:
+            sock.close()
+            raise
+        sock.settimeout(self.timeout)
+        if family == socket.AF_INET:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._sock = sock
+        self._file = sock.makefile('rb')
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        if self._sock is not None:
+            self._sock.close()
+        self._sock = self._file = None
+
+    def _read_response(self):
+        header = self._file.read(RESPONSE_HEADER.size)
+        if len(header) < RESPONSE_HEADER.size:
+            raise ConnectionError("prediction daemon closed the connection")
+        length, request_id, status = RESPONSE_HEADER.unpack(header)
+        body = self._file.read(length)
+        if len(body) < length:
+            raise ConnectionError("prediction daemon closed the connection")
+        return request_id, status, body
+
+    def _exchange(self, requests, deadline=None):
+        """
+        Send (op, top_k, words) requests and return their bodies, in order.
+
+        Requests go out in chunks, the next chunk being written before the responses
+        to the previous one are read. Neither side ever has more than two chunks in
+        flight, so a huge batch cannot fill both socket buffers and deadlock. With a
+        deadline, each chunk's writes and reads wait no longer than what is left of it.
+        """
+        first_id = self._next_id
+        self._next_id = (first_id + len(requests)) & 0xFFFFFFFF
+        chunks = [range(start, min(start + PIPELINE_CHUNK, len(requests)))
+                  for start in range(0, len(requests), PIPELINE_CHUNK)]
+
+        def send(chunk):
+            self._sock.settimeout(self._timeout(deadline))
+            self._sock.sendall(b''.join(encode_request((first_id + i) & 0xFFFFFFFF, *requests[i]) for i in chunk))
+
+        bodies = [None] * len(requests)
+        send(chunks[0])
+        for position, chunk in enumerate(chunks):
+            if position + 1 < len(chunks):
+                send(chunks[position + 1])
+            self._sock.settimeout(self._timeout(deadline))
+            for _ in chunk:
+                request_id, status, body = self._read_response()
+                index = (request_id - first_id) & 0xFFFFFFFF
+                if index >= len(requests):
+                    raise ProtocolError(f"unexpected response id {request_id}")
+                if status != STATUS_OK:
+                    raise ProtocolError(body.decode('utf-8', 'replace'))
+                bodies[index] = body
+        return bodies
+
+    def request(self, requests, deadline=None):
+        """
+        Send a pipelined batch of requests over the shared connection.
+
+        Args:
+            requests (list): (op, top_k, words) tuples, see engine.protocol.
+            deadline (Deadline): Optional; waiting for the connection (held by another
+                thread, or being reopened) and for the answers stops once it expires.
+
+        Returns:
+            list: Response bodies, in request order.
+
+        Raises:
+            TimeoutError: If the deadline expired first (it is then marked hit).
+        """
+        if not self._lock.acquire(timeout=-1 if deadline is None else self._timeout(deadline)):
+            deadline.hit = True
+            raise TimeoutError("deadline expired waiting for the daemon connection")
+        try:
+            for attempt in range(2):
+                try:
+                    if self._sock is None:
+                        self._connect(self._timeout(deadline))
+                    return self._exchange(requests, deadline)
+                except ConnectionError:
+                    # A daemon restart leaves a dead connection behind; retry once on a fresh one
+                    self.close()
+                    if attempt:
+                        raise
+                except (OSError, ProtocolError) as e:
+                    # Unread responses would be mistaken for the next request's
+                    self.close()
+                    if deadline is not None and isinstance(e, TimeoutError):
+                        deadline.hit = True
+                    raise
+        finally:
+            self._lock.release()
+
+    def ping(self):
+        self.request([(OP_PING, 0, ())])
+
+    def stats(self):
+        """Model and cache statistics of the daemon."""
+        return json.loads(self.request([(OP_STATS, 0, ())])[0])
+
+    def complete(self, prefix, context, top_k=3, max_edits=0, deadline=None):
+        """Same as inference_engine.complete_current_word, answered by the daemon."""
+        return self.complete_many([(context, prefix)], top_k, max_edits, deadline)[0]
+
+    def next_words(self, context, top_k=5, deadline=None):
+        """Same as inference_engine.predict_next_word, answered by the daemon."""
+        return self.predict_many([context], top_k, deadline)[0]
+
+    def complete_many(self, queries, top_k=3, max_edits=0, deadline=None):
+        """Pipelined completions for (context, prefix) pairs."""
+        if max_edits:
+            requests = [(OP_FUZZY, top_k, [str(max_edits), prefix, *context]) for context, prefix in queries]
+        else:
+            requests = [(OP_COMPLETE, top_k, [prefix, *context]) for context, prefix in queries]
+        return [decode_words(body) for body in self.request(requests, deadline)] if requests else []
+
+    def predict_many(self, contexts, top_k=5, deadline=None):
+        """Pipelined next-word predictions for many contexts."""
+        requests = [(OP_NEXT, top_k, list(context)) for context in contexts]
+        return [decode_words(body) for body in self.request(requests, deadline)] if requests else []
+
+
+class RemoteSession:
+    """PredictionSession's interface for the UI, with the predictions answered by the daemon."""
+
+    def __init__(self, client, context_size=2, history_size=64, max_edits=0, speculate=False):
+        """
+        Args:
+            client (PredictionClient): Connection to the daemon.
+            context_size (int): Words of context sent with each request (n-1).
+            history_size (int): Committed words remembered for backspacing into them.
+            max_edits (int): Typing mistakes tolerated in completions.
+            speculate (bool): Request next words for likely completions in the
+                background (see engine.speculation).
+        """
+        self.client = client
+        self.context_size = context_size
+        self.history_size = history_size
+        self.max_edits = max_edits
+        self.prefix_chars = []
+        self.history = []
+        self.speculator = Speculator(self._speculative_next_words, context_size) if speculate else None
+        # Learning rebuilds the model, which the daemon owns and does not do
+        self.learner = None
+
+    @property
+    def prefix(self):
+        return ''.join(self.prefix_chars)
+
+    @property
+    def context(self):
+        return list(self.history)
+
+    def reset(self):
+        self.prefix_chars.clear()
+        self.history.clear()
+        if self.speculator is not None:
+            self.speculator.cancel()
+
+    def type_char(self, char):
+        self.prefix_chars.append(char)
+
+    def backspace(self):
+        if self.prefix_chars:
+            self.prefix_chars.pop()
+        elif self.history:
+            self.prefix_chars.extend(self.history.pop())
+        if not self.prefix_chars and self.speculator is not None:
+            self.speculator.cancel()
+
+    def commit_word(self, word=None):
+        word = self.prefix if word is None else word
+        self.prefix_chars.clear()
+        if word:
+            self.history.append(word)
+            del self.history[:-self.history_size]
+
+    def suggestions(self, top_k=5, deadline=None):
+        """
+        Ranked words for the prediction bar; empty if the daemon went away.
+
+        Args:
+            top_k (int): Number of words to return.
+            deadline (float): Optional time limit in seconds for the daemon's answer.
+
+        Returns:
+            list: Up to top_k words; with a deadline, a Suggestions list that is
+            empty and flagged partial if the daemon had not answered in time.
+        """
+        limit = Deadline.start(deadline)
+        context = self.history[-self.context_size:]
+        if self.speculator is not None and not self.prefix_chars:
+            words = self.speculator.take(context, top_k)
+            if words is not None:
+                return words if limit is None else Suggestions(words)
+        try:
+            if self.prefix_chars:
+                words = self.client.complete(self.prefix, context, top_k, self.max_edits, limit)
+            else:
+                words = self.client.next_words(context, top_k, limit)
+        except (OSError, ProtocolError):
+            words = []
+        if self.speculator is not None and self.prefix_chars:
+            self.speculator.speculate(context, words)
+        return words if limit is None else Suggestions.of(words, limit)
+
+    def select_app(self, app):
+        """Application layers live with the model, in the daemon, which does not keep them: a no-op."""
+
+    def _speculative_next_words(self, context, top_k):
+        try:
+            return self.client.next_words(context, top_k)
+        except (OSError, ProtocolError):
+            return []
+
+    def close(self):
+        """Stop the session's background speculation, if any."""
+        if self.speculator is not None:
+            self.speculator.close()
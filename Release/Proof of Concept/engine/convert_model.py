@@ -0,0 +1,85 @@
+"""
+Convert the pickled models from the Data Processing pipeline into the binary model format.
+
+Usage (from the Proof of Concept directory):
+    python -m engine.convert_model [--models-dir Models] [--output Models/model.osk]
+
+Reads word_trie.pkl plus ngram_successors.pkl (or ngram_model.pkl when the presorted
+successors have not been built) and writes model.osk next to them.
+"""
+import argparse
+import os
+import pickle
+
+from engine.csr_model import build_model_bytes, table_from_dict
+
+DEFAULT_MODELS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Models')
+
+
+def load_pickled_ngrams(models_dir):
+    """
+    Load trigram successors from the pickles as {(w1, w2): [(word, prob), ...]}, best-first.
+    """
+    path = os.path.join(models_dir, 'ngram_successors.pkl')
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+        vocab, offsets, ids, probs = data['vocab'], data['offsets'], data['ids'], data['probs']
+        return data['n'], {
+            context: [(vocab[ids[i]], probs[i]) for i in range(offsets[slot], offsets[slot + 1])]
+            for context, slot in data['contexts'].items()
+        }
+
+    with open(os.path.join(models_dir, 'ngram_model.pkl'), 'rb') as f:
+        ngram_model = pickle.load(f)
+    return 3, {context: sorted(next_words.items(), key=lambda item: -item[1])
+               for context, next_words in ngram_model.items()}
+
+
+def convert_pickles(models_dir=DEFAULT_MODELS_DIR, topk_depth=10):
+    """
+    Build the binary model from the pickles in models_dir.
+
+    Returns:
+        bytes: The model file contents.
+    """
+    with open(os.path.join(models_dir, 'word_trie.pkl'), 'rb') as f:
+        word_trie = pickle.load(f)
+    word_freq = dict(word_trie.items())
+
+    n, ngrams = load_pickled_ngrams(models_dir)
+    words = set(word_freq)
+    for context, successors in ngrams.items():
+        words.update(context)
+        words.update(word for word, _ in successors)
+
+    vocab = sorted(words)
+    word_to_id = {word: i for i, word in enumerate(vocab)}
+    freq = [word_freq.get(word, 0) for word in vocab]
+
+    # Ties keep the pickle's order, except that more frequent words go first
+    id_ngrams = {}
+    for context, successors in ngrams.items():
+        ranked = sorted(successors, key=lambda item: (-item[1], -word_freq.get(item[0], 0)))
+        id_ngrams[tuple(word_to_id[word] for word in context)] = [(word_to_id[w], p) for w, p in ranked]
+
+    return build_model_bytes(vocab, freq, table_from_dict(id_ngrams), n=n, topk_depth=topk_depth,
+                             meta={'source': 'pickles'})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert the pickled models to the binary model format")
+    parser.add_argument('--models-dir', default=DEFAULT_MODELS_DIR)
+    parser.add_argument('--output', default=None, help="defaults to <models-dir>/model.osk")
+    parser.add_argument('--topk-depth', type=int, default=10)
+    args = parser.parse_args()
+
+    output = args.output or os.path.join(args.models_dir, 'model.osk')
+    data = convert_pickles(args.models_dir, args.topk_depth)
+    with open(output, 'wb') as f:
+        f.write(data)
+    print(f"Binary model written to '{output}' ({len(data) / 1024:.0f} KiB)")
+
+
+if __name__ == "__main__":
+    main()
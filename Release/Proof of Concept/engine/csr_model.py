@@ -0,0 +1,496 @@
+"""
+Integer-id, CSR-packed n-gram tables built with NumPy, and the writer for the binary model format.
+
+Words are mapped to dense uint32 ids through a single vocabulary (sorted, so ids
+follow lexicographic order). A trigram context is packed into one uint64 key,
+(w1 << 32) | w2, and every context's successors live in three flat arrays:
+
+    offsets[c]:offsets[c + 1]  ->  ids (uint32), probs (float32), counts (uint32)
+
+The same tables hold the bigram backoff level, keyed by the previous word id alone.
+Probabilities are plain relative frequencies scored with stupid backoff unless a
+smoothed model (engine.kneser_ney) supplies its own tables and backoff weights.
+
+Counting is fully vectorized and done in chunks, so building from a corpus of
+hundreds of millions of tokens never materializes a Python object per n-gram.
+A trigram then costs ~8 bytes (id + probability) plus ~16-20 bytes per context,
+against well over 100 bytes per entry for a dict-of-dicts of strings and floats.
+"""
+import json
+from collections import namedtuple
+
+import numpy as np
+
+from engine.model_format import (FORMAT_VERSION, HASH_MULTIPLIER, HEADER, MAGIC, ORDER, SECTIONS,
+                                 SECTION_ENTRY, rmq_level_start)
+
+# Shorter successor lists are scanned faster than the heap walks a sparse table
+RMQ_MIN_SUCCESSORS = 64
+
+# Backoff weight of every context in unsmoothed models ("stupid backoff", Brants et al. 2007)
+STUPID_BACKOFF = 0.4
+
+# CSR successor table: contexts sorted by key, successors best-first within each context
+NgramTable = namedtuple('NgramTable', ['ctx_keys', 'offsets', 'ids', 'probs', 'counts'])
+
+
+def load_vocabulary(path, extra_words=()):
+    """
+    Load the vocabulary from a JSON list of words (e.g. Data/vocabulary.json).
+
+    Args:
+        path (str): JSON file containing a list of words.
+        extra_words (iterable): Words to add, e.g. corpus tokens missing from the file.
+
+    Returns:
+        list: Sorted, de-duplicated words; a word's index is its uint32 id.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        words = set(json.load(f))
+    words.update(extra_words)
+    return sorted(words)
+
+
+def encode_sentences(sentences, vocab):
+    """
+    Map tokenized sentences to uint32 id arrays.
+
+    Args:
+        sentences (iterable): Lists of tokens.
+        vocab (list): Sorted vocabulary; every token must be in it.
+
+    Yields:
+        np.ndarray: One uint32 array per sentence.
+    """
+    word_to_id = {word: i for i, word in enumerate(vocab)}
+    for sentence in sentences:
+        yield np.fromiter((word_to_id[word] for word in sentence), dtype=np.uint32, count=len(sentence))
+
+
+def _reduce_counts(keys, next_ids, counts):
+    """Sort (key, next_id) rows and sum the counts of duplicate rows."""
+    if len(keys) == 0:
+        return keys, next_ids, counts
+    order = np.lexsort((next_ids, keys))
+    keys, next_ids, counts = keys[order], next_ids[order], counts[order]
+    boundary = np.empty(len(keys), dtype=bool)
+    boundary[0] = True
+    boundary[1:] = (keys[1:] != keys[:-1]) | (next_ids[1:] != next_ids[:-1])
+    starts = np.flatnonzero(boundary)
+    return keys[starts], next_ids[starts], np.add.reduceat(counts, starts)
+
+
+def _count_chunk(chunk, order):
+    if order == 2:
+        keys = np.concatenate([ids[:-1] for ids in chunk]).astype(np.uint64)
+        next_ids = np.concatenate([ids[1:] for ids in chunk])
+    else:
+        first = np.concatenate([ids[:-2] for ids in chunk]).astype(np.uint64)
+        second = np.concatenate([ids[1:-1] for ids in chunk]).astype(np.uint64)
+        next_ids = np.concatenate([ids[2:] for ids in chunk])
+        keys = (first << np.uint64(32)) | second
+    return _reduce_counts(keys, next_ids, np.ones(len(keys), dtype=np.uint32))
+
+
+def count_trigrams(encoded_sentences, chunk_tokens=1 << 23, order=3):
+    """
+    Count trigrams (or bigrams) over id-encoded sentences, chunk by chunk.
+
+    Args:
+        encoded_sentences (iterable): uint32 id arrays, one per sentence.
+        chunk_tokens (int): Tokens counted per vectorized pass; bounds peak memory.
+        order (int): 3 for trigrams keyed by (w1 << 32) | w2, 2 for bigrams keyed by w1.
+
+    Returns:
+        tuple: (keys, next_ids, counts) with one row per distinct n-gram,
+        sorted by packed context key and then next id.
+    """
+    if order not in (2, 3):
+        raise ValueError("only bigrams and trigrams are supported")
+    parts = []
+    chunk, chunk_size = [], 0
+    for ids in encoded_sentences:
+        if len(ids) < order:
+            continue
+        chunk.append(ids)
+        chunk_size += len(ids)
+        if chunk_size >= chunk_tokens:
+            parts.append(_count_chunk(chunk, order))
+            chunk, chunk_size = [], 0
+            if len(parts) >= 8:  # fold partial counts so they never pile up
+                parts = [_reduce_counts(*(np.concatenate(column) for column in zip(*parts)))]
+    if chunk:
+        parts.append(_count_chunk(chunk, order))
+    if not parts:
+        return np.zeros(0, np.uint64), np.zeros(0, np.uint32), np.zeros(0, np.uint32)
+    return _reduce_counts(*(np.concatenate(column) for column in zip(*parts)))
+
+
+def build_ngram_table(keys, next_ids, counts, freq):
+    """
+    Turn distinct trigram counts into a CSR table with successors ordered best-first.
+
+    Successors are ranked by count (i.e. probability), then by overall word
+    frequency, then by id (alphabetically).
+
+    Args:
+        keys (np.ndarray): uint64 packed contexts, sorted (output of count_trigrams).
+        next_ids (np.ndarray): uint32 successor ids.
+        counts (np.ndarray): Occurrences of each (context, successor) row.
+        freq (np.ndarray): Word frequencies indexed by id.
+
+    Returns:
+        NgramTable: The packed table.
+    """
+    if len(keys) == 0:
+        return NgramTable(np.zeros(0, np.uint64), np.zeros(1, np.uint32), np.zeros(0, np.uint32),
+                          np.zeros(0, np.float32), np.zeros(0, np.uint32))
+
+    ctx_keys, ctx_start, ctx_len = np.unique(keys, return_index=True, return_counts=True)
+    totals = np.add.reduceat(counts.astype(np.float64), ctx_start)
+    ctx_index = np.repeat(np.arange(len(ctx_keys)), ctx_len)
+
+    order = np.lexsort((next_ids, -np.asarray(freq, dtype=np.int64)[next_ids],
+                        -counts.astype(np.int64), ctx_index))
+    offsets = np.concatenate(([0], np.cumsum(ctx_len)))
+    if offsets[-1] >= 1 << 32:
+        raise ValueError("too many n-grams for 32-bit offsets")
+
+    return NgramTable(ctx_keys=ctx_keys.astype(np.uint64),
+                      offsets=offsets.astype(np.uint32),
+                      ids=next_ids[order].astype(np.uint32),
+                      probs=(counts / totals[ctx_index])[order].astype(np.float32),
+                      counts=counts[order].astype(np.uint32))
+
+
+def table_from_dict(ngrams):
+    """
+    Pack {(first_id, second_id): [(word_id, prob), ...]} (best-first lists) into an NgramTable.
+    """
+    keys = sorted(ngrams, key=lambda context: (context[0] << 32) | context[1])
+    ctx_keys = np.array([(first << 32) | second for first, second in keys], dtype=np.uint64)
+    offsets = np.concatenate(([0], np.cumsum([len(ngrams[context]) for context in keys], dtype=np.int64)))
+    pairs = [pair for context in keys for pair in ngrams[context]]
+    return NgramTable(ctx_keys=ctx_keys, offsets=offsets.astype(np.uint32),
+                      ids=np.array([word_id for word_id, _ in pairs], dtype=np.uint32),
+                      probs=np.array([prob for _, prob in pairs], dtype=np.float32),
+                      counts=np.zeros(len(pairs), dtype=np.uint32))
+
+
+def bigrams_from_trigrams(table, scale=1000):
+    """
+    Approximate bigram counts by summing a trigram table over its first context word.
+
+    Used when only trigram tables are available (the pickled models); tables without
+    raw counts are weighted by their probabilities, as pseudo-counts out of `scale`.
+
+    Returns:
+        tuple: (keys, next_ids, counts) like count_trigrams(..., order=2).
+    """
+    lengths = np.diff(np.asarray(table.offsets, dtype=np.int64))
+    keys = np.repeat(np.asarray(table.ctx_keys, dtype=np.uint64) & np.uint64(0xFFFFFFFF), lengths)
+    counts = np.asarray(table.counts, dtype=np.uint32)
+    if not counts.any():
+        counts = np.maximum(np.rint(np.asarray(table.probs) * scale), 1).astype(np.uint32)
+    return _reduce_counts(keys, np.asarray(table.ids, dtype=np.uint32), counts)
+
+
+def dense_offsets(table, vocab_size):
+    """
+    CSR offsets indexed directly by word id for a table keyed by single words,
+    so looking a word up is one array access instead of a hash probe.
+    """
+    starts = np.searchsorted(np.asarray(table.ctx_keys), np.arange(vocab_size + 1, dtype=np.uint64))
+    return np.asarray(table.offsets, dtype=np.int64)[starts].astype(np.uint32)
+
+
+def build_lexicographic_index(table, min_successors=RMQ_MIN_SUCCESSORS):
+    """
+    Successors of every context in id order, with a sparse table for range-best queries.
+
+    Level j of a context's table holds, for every window of 2^j lexicographic
+    positions, the position of its best-ranked successor. Levels are built for all
+    contexts at once, each from the one below.
+
+    Args:
+        table (NgramTable): Successor table, best-first within each context.
+        min_successors (int): Shorter successor lists get no sparse table.
+
+    Returns:
+        tuple: (lex_ids, lex_rank, rmq_off, rmq_pos) as stored in the model file.
+    """
+    offsets = np.asarray(table.offsets, dtype=np.int64)
+    lengths = np.diff(offsets)
+    ctx_of = np.repeat(np.arange(len(lengths)), lengths)
+    order = np.lexsort((np.asarray(table.ids), ctx_of))
+    lex_ids = np.asarray(table.ids)[order]
+    lex_rank = order - offsets[ctx_of]
+
+    levels = np.zeros(len(lengths), dtype=np.int64)
+    long_lists = lengths >= max(min_successors, 2)
+    levels[long_lists] = np.floor(np.log2(lengths[long_lists])).astype(np.int64)
+    sizes = np.where(long_lists, levels * (lengths + 1) - (1 << levels) + 2, 0)
+    rmq_off = np.concatenate(([0], np.cumsum(sizes)))
+    rmq_pos = np.zeros(rmq_off[-1], dtype=np.int64)
+
+    for level in range(1, int(levels.max(initial=0)) + 1):
+        contexts = np.flatnonzero(levels >= level)
+        windows = lengths[contexts] - (1 << level) + 1
+        context = np.repeat(contexts, windows)
+        position = np.arange(windows.sum()) - np.repeat(np.cumsum(windows) - windows, windows)
+        half = 1 << (level - 1)
+        if level == 1:
+            left, right = position, position + half
+        else:
+            below = rmq_off[context] + rmq_level_start(lengths[context], level - 1)
+            left, right = rmq_pos[below + position], rmq_pos[below + position + half]
+        start = offsets[context]
+        best = np.where(lex_rank[start + left] <= lex_rank[start + right], left, right)
+        rmq_pos[rmq_off[context] + rmq_level_start(lengths[context], level) + position] = best
+
+    if rmq_off[-1] >= 1 << 32:
+        raise ValueError("too many sparse-table entries for 32-bit offsets")
+    return lex_ids.astype(np.uint32), lex_rank.astype(np.uint32), rmq_off.astype(np.uint32), rmq_pos.astype(np.uint32)
+
+
+def build_context_hash(ctx_keys):
+    """
+    Build the open-addressing ctx_hash table (linear probing) over sorted context keys.
+
+    Insertion runs in vectorized rounds: every pending key tries its current slot,
+    one key wins each free slot, and the losers move one slot along. A key only
+    moves past slots that end up occupied, so probing from its home slot finds it.
+
+    Returns:
+        tuple: (table, bits) where table is uint32[2**bits] holding index + 1.
+    """
+    bits = max(4, (2 * len(ctx_keys)).bit_length())
+    mask = (1 << bits) - 1
+    table = np.zeros(1 << bits, dtype=np.uint32)
+    with np.errstate(over='ignore'):
+        slots = ((ctx_keys * np.uint64(HASH_MULTIPLIER)) >> np.uint64(64 - bits)).astype(np.int64)
+
+    pending = np.arange(len(ctx_keys))
+    while len(pending):
+        candidate_slots = slots[pending]
+        free = np.flatnonzero(table[candidate_slots] == 0)
+        won_slots, first = np.unique(candidate_slots[free], return_index=True)
+        winners = free[first]
+        table[won_slots] = pending[winners] + 1
+
+        lost = np.ones(len(pending), dtype=bool)
+        lost[winners] = False
+        pending = pending[lost]
+        slots[pending] = (slots[pending] + 1) & mask
+    return table, bits
+
+
+def build_model_bytes(vocab, freq, table, n=3, topk_depth=10, meta=None, bigrams=None, smoothing=None):
+    """
+    Serialize a model into the binary format (see engine.model_format).
+
+    Args:
+        vocab (list): Words sorted lexicographically; a word's position is its id.
+        freq (sequence): Frequency of every word, indexed by id.
+        table (NgramTable): Trigram successors.
+        n (int): N-gram order of the table; must be ORDER (3), the only one the format holds.
+        topk_depth (int): Number of completions kept at every trie node.
+        meta (dict): Extra build information stored in the meta section.
+        bigrams (NgramTable): Bigram backoff successors keyed by word id; derived
+            from the trigram table when omitted.
+        smoothing (kneser_ney.Smoothing): Backoff weights and unigram probabilities
+            matching the tables; stupid backoff over relative frequencies when omitted.
+
+    Returns:
+        bytes: The complete model file.
+
+    Raises:
+        ValueError: If n is not ORDER, or vocab is not sorted and unique.
+    """
+    if n != ORDER:
+        raise ValueError(f"cannot store a {n}-gram model: contexts are packed as two word ids, "
+                         f"so the format only holds {ORDER}-gram models")
+    if not np.little_endian:
+        raise RuntimeError("the binary model format requires a little-endian machine")
+
+    encoded = [word.encode('utf-8') for word in vocab]
+    if any(a >= b for a, b in zip(encoded, encoded[1:])):
+        raise ValueError("vocab must be sorted and free of duplicates")
+    freq = np.asarray(freq, dtype=np.uint32)
+
+    str_off = np.concatenate(([0], np.cumsum([len(word) for word in encoded], dtype=np.int64)))
+
+    # Trie over UTF-8 bytes. Words arrive in id order, so a node's range only grows.
+    children = [{}]
+    node_lo = [0]
+    node_hi = [0]
+    paths = []
+    for word_id, word in enumerate(encoded):
+        node = 0
+        path = [0]
+        for byte in word:
+            child = children[node].get(byte)
+            if child is None:
+                child = len(children)
+                children[node][byte] = child
+                children.append({})
+                node_lo.append(word_id)
+                node_hi.append(word_id)
+            node = child
+            path.append(node)
+        for node in path:
+            node_hi[node] = word_id + 1
+        paths.append(path)
+
+    edge_off = [0]
+    edge_byte = []
+    edge_node = []
+    for node_children in children:
+        for byte in sorted(node_children):
+            edge_byte.append(byte)
+            edge_node.append(node_children[byte])
+        edge_off.append(len(edge_byte))
+
+    # Top-k completions per node: visit words best-first and fill every node on the path
+    topk = [[] for _ in children]
+    for word_id in np.lexsort((np.arange(len(vocab)), -freq.astype(np.int64))):
+        for node in paths[word_id]:
+            if len(topk[node]) < topk_depth:
+                topk[node].append(word_id)
+    topk_off = np.concatenate(([0], np.cumsum([len(node_topk) for node_topk in topk], dtype=np.int64)))
+
+    ctx_hash, bits = build_context_hash(table.ctx_keys)
+    lex_ids, lex_rank, rmq_off, rmq_pos = build_lexicographic_index(table)
+    if bigrams is None:
+        bigrams = build_ngram_table(*bigrams_from_trigrams(table), freq)
+    if smoothing is None:
+        smoothing_name = 'stupid-backoff'
+        ctx_backoff = np.full(len(table.ctx_keys), STUPID_BACKOFF, dtype=np.float32)
+        bi_backoff = np.full(len(vocab), STUPID_BACKOFF, dtype=np.float32)
+        uni_probs = (freq / max(int(freq.sum()), 1)).astype(np.float32)
+    else:
+        smoothing_name, ctx_backoff, bi_backoff, uni_probs = smoothing
+    uni_ids = np.lexsort((np.arange(len(vocab)), -freq.astype(np.int64), -np.asarray(uni_probs)))
+
+    meta = dict(meta or {}, n=n, topk_depth=topk_depth, vocab_size=len(vocab),
+                contexts=len(table.ctx_keys), hash_bits=bits, bigrams=len(bigrams.ids), smoothing=smoothing_name)
+    sections = {
+        'meta': json.dumps(meta).encode('utf-8'),
+        'str_off': str_off.astype(np.uint32),
+        'str_data': b''.join(encoded),
+        'freq': freq,
+        'node_edge': np.array(edge_off, dtype=np.uint32),
+        'edge_byte': np.array(edge_byte, dtype=np.uint8),
+        'edge_node': np.array(edge_node, dtype=np.uint32),
+        'node_lo': np.array(node_lo, dtype=np.uint32),
+        'node_hi': np.array(node_hi, dtype=np.uint32),
+        'topk_off': topk_off.astype(np.uint32),
+        'topk_ids': np.array([word_id for node_topk in topk for word_id in node_topk], dtype=np.uint32),
+        'ctx_keys': np.asarray(table.ctx_keys, dtype=np.uint64),
+        'ctx_hash': ctx_hash,
+        'succ_off': np.asarray(table.offsets, dtype=np.uint32),
+        'succ_ids': np.asarray(table.ids, dtype=np.uint32),
+        'succ_probs': np.asarray(table.probs, dtype=np.float32),
+        'lex_ids': lex_ids,
+        'lex_rank': lex_rank,
+        'rmq_off': rmq_off,
+        'rmq_pos': rmq_pos,
+        'bi_off': dense_offsets(bigrams, len(vocab)),
+        'bi_ids': np.asarray(bigrams.ids, dtype=np.uint32),
+        'bi_probs': np.asarray(bigrams.probs, dtype=np.float32),
+        'uni_ids': uni_ids.astype(np.uint32),
+        'ctx_backoff': np.asarray(ctx_backoff, dtype=np.float32),
+        'bi_backoff': np.asarray(bi_backoff, dtype=np.float32),
+        'uni_probs': np.asarray(uni_probs, dtype=np.float32),
+    }
+    assert set(sections) == set(SECTIONS)
+
+    table_size = HEADER.size + SECTION_ENTRY.size * len(sections)
+    offset = (table_size + 7) & ~7
+    header = [HEADER.pack(MAGIC, FORMAT_VERSION, len(sections))]
+    body = []
+    for name, data in sections.items():
+        data = data.tobytes() if isinstance(data, np.ndarray) else bytes(data)
+        header.append(SECTION_ENTRY.pack(name.encode('ascii'), offset, len(data)))
+        padding = -len(data) % 8
+        body.append(data + b'\0' * padding)
+        offset += len(data) + padding
+
+    head = b''.join(header)
+    return head + b'\0' * (-len(head) % 8) + b''.join(body)
+
+
+def build_from_corpus(sentences, vocabulary_path=None, topk_depth=10, smoothing='kn', heldout=0.0):
+    """
+    Build a binary model straight from tokenized sentences.
+
+    Args:
+        sentences (list): Lists of tokens (e.g. Data/preprocessed_diary.json).
+        vocabulary_path (str): Optional vocabulary.json; corpus words missing from
+            it are added so every token has an id.
+        topk_depth (int): Number of completions kept at every trie node.
+        smoothing (str): 'kn' for interpolated modified Kneser-Ney, 'ml' for relative
+            frequencies with stupid backoff.
+        heldout (float): Fraction of sentences set aside to measure perplexity on,
+            with a model trained on the rest (Kneser-Ney only); the returned model
+            is always trained on every sentence.
+
+    Returns:
+        tuple: (model bytes, stats dict)
+    """
+    if smoothing not in ('kn', 'ml'):
+        raise ValueError(f"unknown smoothing '{smoothing}'")
+    corpus_words = {word for sentence in sentences for word in sentence}
+    if vocabulary_path:
+        vocab = load_vocabulary(vocabulary_path, corpus_words)
+    else:
+        vocab = sorted(corpus_words)
+
+    encoded = list(encode_sentences(sentences, vocab))
+    stats = {}
+    if heldout and smoothing == 'kn':
+        # The vocabulary stays shared, so held-out words unseen in training get the
+        # unigram floor instead of being skipped as out-of-vocabulary
+        from engine import kneser_ney
+        from engine.model_format import MappedModel
+
+        test = np.random.default_rng(0).random(len(encoded)) < heldout
+        train_part = [ids for ids, is_test in zip(encoded, test) if not is_test]
+        test_part = [ids for ids, is_test in zip(encoded, test) if is_test]
+        data, _ = _build_encoded(vocab, train_part, topk_depth, smoothing)
+        ppl, scored, oov = kneser_ney.perplexity(MappedModel(data), test_part)
+        stats.update(heldout_sentences=len(test_part), heldout_tokens=scored, heldout_oov=oov, perplexity=ppl)
+
+    data, model_stats = _build_encoded(vocab, encoded, topk_depth, smoothing)
+    stats.update(model_stats)
+    return data, stats
+
+
+def _build_encoded(vocab, encoded, topk_depth, smoothing):
+    tokens = sum(len(ids) for ids in encoded)
+    freq = np.bincount(np.concatenate(encoded), minlength=len(vocab)) if tokens else np.zeros(len(vocab))
+    meta = {'source': 'corpus', 'tokens': int(tokens)}
+
+    if smoothing == 'kn':
+        from engine import kneser_ney
+
+        model = kneser_ney.train(encoded, len(vocab), freq)
+        table, bigrams = model.trigrams, model.bigrams
+        meta['discounts'] = model.discounts
+        data = build_model_bytes(vocab, freq, table, n=3, topk_depth=topk_depth, meta=meta, bigrams=bigrams,
+                                 smoothing=model.smoothing)
+    else:
+        table = build_ngram_table(*count_trigrams(encoded), freq)
+        bigrams = build_ngram_table(*count_trigrams(encoded, order=2), freq)
+        data = build_model_bytes(vocab, freq, table, n=3, topk_depth=topk_depth, meta=meta, bigrams=bigrams)
+
+    stats = {
+        'tokens': int(tokens),
+        'vocab_size': len(vocab),
+        'contexts': len(table.ctx_keys),
+        'trigrams': len(table.ids),
+        'bigrams': len(bigrams.ids),
+        'table_bytes': int(sum(array.nbytes for array in table) + sum(array.nbytes for array in bigrams)),
+        'model_bytes': len(data),
+    }
+    return data, stats
@@ -0,0 +1,53 @@
+"""
+Deadlines for anytime prediction.
+
+Every entry point of inference_engine takes an optional deadline in seconds. The
+searches that can run long (fuzzy matching, completions deeper than the
+precomputed top-k lists, phrase search, batches) check a Deadline as they go and
+stop once it expires, keeping the best ranking found so far; lookups that are a
+handful of array reads simply finish. Results come back as Suggestions, a list
+whose partial flag tells the caller the deadline cut the search short, so a UI
+can show them at once and ask again without a deadline to refine them.
+"""
+import time
+
+
+class Deadline:
+    """A point in time after which anytime searches return what they have."""
+
+    def __init__(self, seconds):
+        """
+        Args:
+            seconds (float): Time from now until the deadline.
+        """
+        self.expires = time.perf_counter() + seconds
+        self.hit = False
+
+    @classmethod
+    def start(cls, seconds):
+        """A Deadline for seconds from now, or None for no deadline."""
+        return None if seconds is None else cls(seconds)
+
+    def expired(self):
+        """True once the deadline has passed; also records that a search was cut short."""
+        if not self.hit and time.perf_counter() >= self.expires:
+            self.hit = True
+        return self.hit
+
+
+class Suggestions(list):
+    """Ranked results of a call made with a deadline."""
+
+    def __init__(self, items=(), partial=False):
+        """
+        Args:
+            items (iterable): The ranked results.
+            partial (bool): True if the deadline stopped the search before it finished.
+        """
+        super().__init__(items)
+        self.partial = partial
+
+    @classmethod
+    def of(cls, items, deadline):
+        """Wrap items, flagged partial if the deadline (possibly None) was hit or items already were."""
+        return cls(items, partial=getattr(items, 'partial', False) or (deadline is not None and deadline.hit))
@@ -0,0 +1,240 @@
+"""
+Typo-tolerant completion: a Levenshtein automaton walked in lockstep with the word trie.
+
+The automaton state for a trie node is the row of edit distances between every
+prefix of the typed text and the node's string (Wagner-Fischer, one row per
+trie edge). A node whose last entry is within the edit budget matches the typed
+prefix, so every word under it is a candidate; a node whose row minimum exceeds
+the budget can never match again, and its whole subtree is skipped. Only the
+trie paths within max_edits of the typed text are visited, never the vocabulary.
+
+Candidates are ranked by
+
+    log(score(w)) - EDIT_PENALTY * edits
+
+where score is the model's backoff score, MappedModel.next_word_score: the best
+of the context's successor probability, the previous word's bigram probability
+and the unigram probability, each weighted by the backoff weights above it. A
+word one edit away must be EDIT_PENALTY-fold likelier to outrank an exact match.
+Candidates are every matching node's best top_k words by each of the three
+levels (the context's successors in the node's id range, the previous word's
+bigram successors in it, and its highest unigram probabilities), so the top-k
+over all nodes is exactly the top-k over every word within the budget.
+
+The trie is explored best-first, fewest edits so far first, so when a deadline
+stops the walk early the nodes already matched are the closest ones and the
+partial ranking favours the words the user most likely meant.
+"""
+import math
+import weakref
+from heapq import heappop, heappush
+
+from engine.adaptation import layer_candidate_ids, mix
+
+# Score lost per edit, in log-probability (a factor of 30)
+EDIT_PENALTY = math.log(30)
+
+# Per model: every word's position when ranked by unigram probability, built on first use
+_unigram_ranks = weakref.WeakKeyDictionary()
+
+
+def char_edges(model, node):
+    """
+    Children of a trie node one character (not one UTF-8 byte) down.
+
+    Yields:
+        tuple: (character, child node)
+    """
+    start, end = model.node_edge[node], model.node_edge[node + 1]
+    for edge in range(start, end):
+        byte, child = model.edge_byte[edge], model.edge_node[edge]
+        if byte < 0x80:
+            yield chr(byte), child
+            continue
+        # Follow the continuation bytes of a multi-byte character
+        pending = [(bytes((byte,)), child)]
+        while pending:
+            encoded, child = pending.pop()
+            try:
+                yield encoded.decode('utf-8'), child
+            except UnicodeDecodeError:
+                sub_start, sub_end = model.node_edge[child], model.node_edge[child + 1]
+                pending.extend((encoded + bytes((model.edge_byte[sub],)), model.edge_node[sub])
+                               for sub in range(sub_end - 1, sub_start - 1, -1))
+
+
+def matching_nodes(model, prefix, max_edits, deadline=None):
+    """
+    Trie nodes whose string is within max_edits of prefix.
+
+    A node is only reported if it matches with fewer edits than its closest
+    reported ancestor; words under both are already covered by the ancestor.
+
+    Args:
+        model (MappedModel): The model whose trie is walked.
+        prefix (str): The typed text.
+        max_edits (int): Edit budget (insertions, deletions and substitutions).
+        deadline (Deadline): Optional; stops the walk, keeping the nodes matched so far.
+
+    Returns:
+        list: (node, edits) pairs.
+    """
+    length = len(prefix)
+    limit = max_edits + 1
+
+    def step(row, depth, char, bound):
+        """The next row and its minimum after one more trie character; None once every cell reaches bound."""
+        new_row = [limit] * (length + 1)
+        new_row[0] = min(depth, limit)
+        best = new_row[0]
+        # Cells further than the budget from the diagonal always exceed it (Ukkonen's band)
+        for j in range(max(depth - max_edits, 1), min(depth + max_edits, length) + 1):
+            cell = min(row[j] + 1, new_row[j - 1] + 1, row[j - 1] + (prefix[j - 1] != char), limit)
+            new_row[j] = cell
+            best = min(best, cell)
+        return (new_row, best) if best < bound else None
+
+    matches = []
+    first_row = [min(j, limit) for j in range(length + 1)]
+    if first_row[-1] < limit:
+        matches.append((0, first_row[-1]))
+    # Entries are (row minimum, order pushed, node, depth, row, covered)
+    heap = [(0, 0, 0, 0, first_row, min(first_row[-1], limit))]
+    pushed = 1
+    while heap:
+        if deadline is not None and deadline.expired():
+            break
+        _, _, node, depth, row, covered = heappop(heap)
+        depth += 1
+        # Row minima never decrease with depth, so a subtree whose row cannot beat the
+        # edits of a match above it (or the budget) holds nothing new
+        if step(row, depth, None, covered) is None:
+            # Out of budget for a mismatch: only a character matching the prefix where
+            # the row is still under the bound can follow, so look those edges up
+            # instead of scanning the node
+            band = range(max(depth - max_edits, 1), min(depth + max_edits, length) + 1)
+            window = {prefix[j - 1] for j in band if row[j - 1] < covered}
+            edges = ((char, model.walk(char.encode('utf-8'), node)) for char in window)
+        else:
+            edges = char_edges(model, node)
+        for char, child in edges:
+            stepped = step(row, depth, char, covered) if child >= 0 else None
+            if stepped is None:
+                continue
+            new_row, best = stepped
+            edits = new_row[-1]
+            if edits < covered:
+                matches.append((child, edits))
+            heappush(heap, (best, pushed, child, depth, new_row, min(edits, covered)))
+            pushed += 1
+    return matches
+
+
+def bigram_ids_in_range(model, last_id, lo, hi, top_k):
+    """The best top_k bigram successors of the previous word whose ids lie in [lo, hi), best-first."""
+    if last_id is None:
+        return []
+    ids = model.array('bi_ids')[model.bi_off[last_id]:model.bi_off[last_id + 1]]
+    return ids[(ids >= lo) & (ids < hi)][:top_k].tolist()
+
+
+def unigram_ids_in_range(model, lo, hi, top_k):
+    """The top_k ids in [lo, hi) by unigram probability, ties going to the more frequent word, then the lower id."""
+    ranks = _unigram_ranks.get(model)
+    if ranks is None:
+        import numpy as np
+        order = np.lexsort((np.arange(model.vocab_size), -model.array('freq').astype(np.int64),
+                            -model.array('uni_probs')))
+        ranks = _unigram_ranks[model] = np.empty_like(order)
+        ranks[order] = np.arange(len(order))
+    window = ranks[lo:hi]
+    best = window.argpartition(top_k)[:top_k] if len(window) > top_k else window.argsort()
+    return (best[window[best].argsort()] + lo).tolist()
+
+
+def fuzzy_completion_ids(model, prefix, context_index, last_id=None, top_k=3, max_edits=1, deadline=None,
+                         layers=(), previous=None):
+    """
+    Ranked completion ids of prefix, allowing up to max_edits typing mistakes.
+
+    The budget never exceeds len(prefix) - 1, so at least one typed character
+    always constrains the completions.
+
+    Args:
+        model (MappedModel): The model to query.
+        prefix (str): The typed text.
+        context_index (int): Resolved n-gram context, -1 if unseen.
+        last_id (int): Id of the previous word, None if unknown or absent.
+        top_k (int): Number of ids to return.
+        max_edits (int): Edit budget.
+        deadline (Deadline): Optional; ranks only the nodes matched before it expires.
+        layers (list): Optional adaptation layers (engine.adaptation) whose words
+            join the candidates and whose probabilities are mixed into the scores.
+        previous (str): The previous word, for the layers' bigrams.
+
+    Returns:
+        list: Up to top_k ids, best-first.
+    """
+    max_edits = max(min(max_edits, len(prefix) - 1), 0)
+    matches = matching_nodes(model, prefix, max_edits, deadline)
+
+    # The fewest edits of every candidate, over all matching nodes containing it
+    candidates = {}
+    for node, edits in matches:
+        lo, hi = model.id_range(node)
+        listed = unigram_ids_in_range(model, lo, hi, top_k) + bigram_ids_in_range(model, last_id, lo, hi, top_k)
+        if context_index >= 0:
+            listed += model.successor_ids_in_range(context_index, lo, hi, top_k)
+        for word_id in listed:
+            if candidates.get(word_id, max_edits + 1) > edits:
+                candidates[word_id] = edits
+    if layers:
+        for word_id in layer_candidate_ids(model, layers, previous):
+            for node, edits in matches:
+                lo, hi = model.id_range(node)
+                if lo <= word_id < hi and candidates.get(word_id, max_edits + 1) > edits:
+                    candidates[word_id] = edits
+    closer = sorted((edits, *model.id_range(node)) for node, edits in matches if edits < max_edits)
+    for word_id, listed_edits in candidates.items():
+        for edits, lo, hi in closer:
+            if edits >= listed_edits:
+                break
+            if lo <= word_id < hi:
+                candidates[word_id] = edits
+                break
+
+    scores = backoff_scores(model, context_index, last_id, candidates)
+    if layers:
+        mixed = mix(model, layers, previous, {word_id: math.exp(score) for word_id, score in scores.items()})
+        scores = {word_id: math.log(probability) for word_id, probability in mixed.items()}
+    return sorted(candidates, key=lambda word_id: (EDIT_PENALTY * candidates[word_id] - scores[word_id],
+                                                   -model.freq[word_id], word_id))[:top_k]
+
+
+def fuzzy_complete(model, prefix, context, top_k=3, max_edits=1, deadline=None):
+    """
+    Word-level fuzzy_completion_ids, resolving the context like MappedModel.complete.
+
+    Args:
+        model (MappedModel): The model to query.
+        prefix (str): The typed text, possibly mistyped.
+        context (list): Previous words.
+        top_k (int): Number of suggestions to return.
+        max_edits (int): Edit budget.
+        deadline (Deadline): Optional time limit.
+
+    Returns:
+        list: Up to top_k words.
+    """
+    if not prefix:
+        return []
+    context_ids = model.context_ids(context) if context else []
+    context_index = model.context_index(context_ids) if context else -1
+    last_id = context_ids[-1] if context_ids else None
+    return model.words(fuzzy_completion_ids(model, prefix, context_index, last_id, top_k, max_edits, deadline))
+
+
+def backoff_scores(model, context_index, last_id, word_ids):
+    """log(MappedModel.next_word_score) of every word id: the score next-word prediction ranks by."""
+    return {word_id: math.log(max(model.next_word_score(context_index, last_id, word_id), 1e-300))
+            for word_id in word_ids}
@@ -0,0 +1,183 @@
+"""
+Interpolated modified Kneser-Ney smoothing, computed offline with NumPy.
+
+Smoothing covers orders 1-3: the model format packs every context as two word
+ids (engine.model_format.ORDER), so higher orders cannot be stored.
+
+The training counts of the corpus builder are turned into the arrays the engine
+already reads, so a smoothed query costs exactly what an unsmoothed one does:
+
+    P(w | u v) = max(c(u v w) - D3(c), 0) / c(u v ·) + gamma(u v) * P(w | v)
+    P(w | v)   = max(N1+(· v w) - D2(N), 0) / N1+(· v ·) + gamma(v) * P(w)
+    P(w)       = max(N1+(· w) - D1(N), 0) / N1+(· ·) + gamma() / V
+
+Lower orders use continuation counts (how many distinct words precede the n-gram,
+a sentence start counting as one), and every order has its own three discounts
+D(1), D(2), D(3+) estimated from counts of counts (Chen & Goodman). The stored
+trigram and bigram probabilities are the fully interpolated ones, and gamma is
+kept per context, so a word missing from a successor list gets the backoff
+weight times the lower-order probability: the same trigram -> bigram -> unigram
+chain as the unsmoothed model, with no extra work at query time.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+from engine.csr_model import NgramTable, _reduce_counts, count_trigrams
+
+# Backoff arrays stored next to the n-gram tables (see engine.model_format)
+Smoothing = namedtuple('Smoothing', ['name', 'ctx_backoff', 'bi_backoff', 'uni_probs'])
+
+# Modified Kneser-Ney model: both tables hold interpolated probabilities, best-first
+KneserNey = namedtuple('KneserNey', ['trigrams', 'bigrams', 'smoothing', 'discounts'])
+
+LOW32 = np.uint64(0xFFFFFFFF)
+
+
+def modified_discounts(counts):
+    """
+    Discounts D(1), D(2), D(3+) for one order from its counts of counts.
+
+    Args:
+        counts (np.ndarray): The (continuation) count of every distinct n-gram.
+
+    Returns:
+        np.ndarray: float64[4], indexed by min(count, 3); entry 0 is 0.
+    """
+    n1, n2, n3, n4 = (np.count_nonzero(counts == k) for k in (1, 2, 3, 4))
+    discounts = np.zeros(4)
+    if n1 == 0 or n2 == 0:
+        discounts[1:] = 0.5  # too little data for the estimate; fall back to absolute discounting
+        return discounts
+    y = n1 / (n1 + 2 * n2)
+    discounts[1] = 1 - 2 * y * n2 / n1
+    discounts[2] = 2 - 3 * y * n3 / n2
+    discounts[3] = 3 - 4 * y * n4 / n3 if n3 else discounts[2]
+    # Each discount must stay in [0, count] for the estimate to remain a distribution
+    return np.clip(discounts, 0, [0, 1, 2, 3])
+
+
+def _interpolate(keys, next_ids, counts, lower):
+    """
+    Interpolated probabilities of one order.
+
+    Args:
+        keys, next_ids, counts: Distinct n-gram rows sorted by (key, next id).
+        lower (np.ndarray): Lower-order probability of every row's (shortened) n-gram.
+
+    Returns:
+        tuple: (row probabilities, context keys, gamma of every context, discounts)
+    """
+    discounts = modified_discounts(counts)
+    ctx_keys, ctx_start, ctx_len = np.unique(keys, return_index=True, return_counts=True)
+    ctx_of = np.repeat(np.arange(len(ctx_keys)), ctx_len)
+    counts = counts.astype(np.float64)
+    discount = discounts[np.minimum(counts, 3).astype(np.int64)]
+
+    totals = np.add.reduceat(counts, ctx_start)
+    gamma = np.add.reduceat(discount, ctx_start) / totals
+    probs = np.maximum(counts - discount, 0) / totals[ctx_of] + gamma[ctx_of] * lower
+    return probs, ctx_keys, gamma, discounts
+
+
+def _ranked_table(keys, next_ids, probs, counts, freq):
+    """Pack rows into an NgramTable with successors ordered by probability, then frequency, then id."""
+    ctx_keys, ctx_len = np.unique(keys, return_counts=True)
+    ctx_of = np.repeat(np.arange(len(ctx_keys)), ctx_len)
+    order = np.lexsort((next_ids, -np.asarray(freq, dtype=np.int64)[next_ids], -probs, ctx_of))
+    return NgramTable(ctx_keys=ctx_keys.astype(np.uint64),
+                      offsets=np.concatenate(([0], np.cumsum(ctx_len))).astype(np.uint32),
+                      ids=next_ids[order].astype(np.uint32),
+                      probs=probs[order].astype(np.float32),
+                      counts=counts[order].astype(np.uint32))
+
+
+def continuation_counts(tri_keys, tri_next, encoded):
+    """
+    Continuation counts of the bigram and unigram orders.
+
+    N1+(· v w) is the number of distinct words u seen before (v, w), plus one if
+    (v, w) opens a sentence; N1+(· w) likewise over distinct bigrams.
+
+    Returns:
+        tuple: (bigram keys, bigram next ids, bigram counts, unigram ids, unigram counts)
+    """
+    starts = [ids[:2] for ids in encoded if len(ids) >= 2]
+    start_first = np.array([ids[0] for ids in starts], dtype=np.uint64)
+    start_second = np.array([ids[1] for ids in starts], dtype=np.uint32)
+    start_keys, start_next, _ = _reduce_counts(start_first, start_second, np.ones(len(starts), np.uint32))
+
+    bi_keys, bi_next, bi_counts = _reduce_counts(
+        np.concatenate([tri_keys & LOW32, start_keys]),
+        np.concatenate([tri_next, start_next]).astype(np.uint32),
+        np.ones(len(tri_keys) + len(start_keys), dtype=np.uint32))
+
+    openers = np.unique(np.array([ids[0] for ids in encoded if len(ids)], dtype=np.uint32))
+    uni_ids, uni_counts = np.unique(np.concatenate([bi_next, openers]), return_counts=True)
+    return bi_keys, bi_next, bi_counts, uni_ids, uni_counts
+
+
+def train(encoded, vocab_size, freq):
+    """
+    Estimate an interpolated modified Kneser-Ney trigram model.
+
+    Args:
+        encoded (list): uint32 id arrays, one per sentence.
+        vocab_size (int): Number of word ids; words never seen get a share of gamma() / V.
+        freq (np.ndarray): Word frequencies, used to break probability ties.
+
+    Returns:
+        KneserNey: Tables and backoff arrays ready for build_model_bytes.
+    """
+    tri_keys, tri_next, tri_counts = count_trigrams(encoded)
+    bi_keys, bi_next, bi_counts, uni_ids, uni_counts = continuation_counts(tri_keys, tri_next, encoded)
+
+    # Unigrams interpolate with the uniform distribution
+    uni_discounts = modified_discounts(uni_counts)
+    uni_discount = uni_discounts[np.minimum(uni_counts, 3)]
+    total = max(uni_counts.sum(), 1)
+    uni_probs = np.full(vocab_size, uni_discount.sum() / total / vocab_size)
+    uni_probs[uni_ids] += np.maximum(uni_counts - uni_discount, 0) / total
+    if not len(uni_ids):
+        uni_probs[:] = 1 / vocab_size
+
+    bi_probs, bi_ctx, bi_gamma, bi_discounts = _interpolate(bi_keys, bi_next, bi_counts, uni_probs[bi_next])
+    bi_backoff = np.ones(vocab_size)
+    bi_backoff[bi_ctx.astype(np.int64)] = bi_gamma
+
+    # The lower-order probability of a trigram (u, v, w) is that of its bigram (v, w)
+    bi_packed = (bi_keys << np.uint64(32)) | bi_next.astype(np.uint64)
+    tri_suffix = ((tri_keys & LOW32) << np.uint64(32)) | tri_next.astype(np.uint64)
+    tri_lower = bi_probs[np.searchsorted(bi_packed, tri_suffix)]
+    tri_probs, tri_ctx, tri_gamma, tri_discounts = _interpolate(tri_keys, tri_next, tri_counts, tri_lower)
+
+    return KneserNey(
+        trigrams=_ranked_table(tri_keys, tri_next, tri_probs, tri_counts, freq),
+        bigrams=_ranked_table(bi_keys, bi_next, bi_probs, bi_counts, freq),
+        smoothing=Smoothing('modified-kneser-ney', tri_gamma.astype(np.float32), bi_backoff.astype(np.float32),
+                            uni_probs.astype(np.float32)),
+        discounts={'unigram': uni_discounts[1:].tolist(), 'bigram': bi_discounts[1:].tolist(),
+                   'trigram': tri_discounts[1:].tolist()})
+
+
+def perplexity(model, encoded):
+    """
+    Per-word perplexity of a smoothed MappedModel on id-encoded sentences.
+
+    Every token is predicted from the (up to n-1) words before it in its sentence.
+    Ids that are not in the model's vocabulary (-1) are skipped and counted as OOV.
+
+    Returns:
+        tuple: (perplexity, scored tokens, OOV tokens)
+    """
+    log_sum, scored, oov = 0.0, 0, 0
+    for ids in encoded:
+        ids = [int(word_id) for word_id in ids]
+        for i, word_id in enumerate(ids):
+            if word_id < 0:
+                oov += 1
+                continue
+            context = [None if prev < 0 else prev for prev in ids[max(0, i - model.n + 1):i]]
+            log_sum += np.log(model.probability(context, word_id))
+            scored += 1
+    return float(np.exp(-log_sum / max(scored, 1))), scored, oov
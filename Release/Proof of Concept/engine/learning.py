@@ -0,0 +1,406 @@
+"""
+Online learning from the words the user commits.
+
+The model file is immutable while it is mapped, so an OnlineLearner keeps what
+it learns in two places instead:
+
+- a delta layer in memory (an engine.adaptation.AppLayer of its own), which is
+  mixed into the suggestions right away. observe() updates it in place and
+  hands the word to a queue, so a commit costs a few dictionary updates and
+  never waits for the disk;
+- an append-only log on disk (one word per line, a blank line between
+  sentences), written by a background thread, so nothing learned is lost when
+  the keyboard exits: the log is replayed into the delta on the next start.
+
+Every compact_every words the log is compacted into the model. The delta and
+the log are rotated out (the rotated delta stays mixed in meanwhile), and the
+background thread has a separate process rebuild the model from the base corpus
+plus the last LEARNED_SENTENCES learned sentences and write it as
+learned-<generation>.osk. Building a model holds the interpreter for seconds, so
+it must not run on a thread of the keyboard's process; the background thread
+only waits for the process and maps the finished file. A new name each time: a
+mapped file cannot be replaced on Windows, and sessions still holding the
+previous model keep using it until their next commit. Once the new model is
+installed the rotated delta is dropped, its counts now being part of the model,
+along with words the model did not know before.
+
+Learned sentences are appended to learned.sentences (in the log's format), never
+rewritten in full: once it holds twice LEARNED_SENTENCES, it is cut back to the
+last LEARNED_SENTENCES, so older sentences fade from the model. learned.json
+only records the model generation and the sentence count.
+
+A compaction that fails merges the rotated delta back into the live one, so its
+words stay mixed in, and the next rotation retries with the rotated log still
+on disk. Without the base corpus (a release shipped without Data), no rebuild
+can succeed: compaction stops for the run and everything learned stays in the
+delta and the log, which is replayed on the next start as usual.
+
+unobserve() takes a word back when it is reopened to be edited: it leaves the
+delta and its line is cut from the end of the log. Words already rotated out
+for compaction stay learned.
+"""
+import json
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from engine.adaptation import LAYER_DEPTH, AppLayer
+from engine.model_format import MappedModel
+
+# Weight of the delta layer in the mix once warmed up
+LEARNED_WEIGHT = 0.2
+
+# Words logged between compactions into the model
+COMPACT_EVERY = 500
+
+# Learned sentences a rebuild uses, the most recent ones
+LEARNED_SENTENCES = 20000
+
+LOG_NAME = 'learned.log'
+COMPACTING_NAME = 'learned.log.compacting'
+SENTENCES_NAME = 'learned.sentences'
+STATE_NAME = 'learned.json'
+MODEL_PREFIX = 'learned-'
+
+# Queue markers besides words: end of sentence, rotate the log and compact, take
+# back the last word, stop
+_BREAK = object()
+_ROTATE = object()
+_UNDO = object()
+_STOP = object()
+
+
+def rebuild_with_corpus(learned, corpus_path=None, vocabulary_path=None, smoothing='kn'):
+    """
+    Model bytes for the base corpus plus the learned sentences, as engine.build_model builds them.
+
+    Args:
+        learned (list): Learned sentences, lists of words.
+        corpus_path (str): Tokenized base corpus; defaults to Data/preprocessed_diary.json.
+        vocabulary_path (str): Optional vocabulary.json; defaults to Data/vocabulary.json if present.
+        smoothing (str): 'kn' or 'ml', as for build_from_corpus.
+
+    Returns:
+        bytes: The model file contents.
+    """
+    from engine.build_model import DATA_DIR
+    from engine.csr_model import build_from_corpus
+    corpus_path = corpus_path or os.path.join(DATA_DIR, 'preprocessed_diary.json')
+    if vocabulary_path is None:
+        vocabulary_path = os.path.join(DATA_DIR, 'vocabulary.json')
+    with open(corpus_path, 'r', encoding='utf-8') as f:
+        sentences = json.load(f)
+    vocabulary = vocabulary_path if os.path.exists(vocabulary_path) else None
+    data, _ = build_from_corpus(sentences + learned, vocabulary, smoothing=smoothing)
+    return data
+
+
+def read_log(path):
+    """Sentences of an append-only log (words one per line, blank lines between sentences)."""
+    sentences = [[]]
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            word = line.rstrip('\n')
+            if word:
+                sentences[-1].append(word)
+            elif sentences[-1]:
+                sentences.append([])
+    return [sentence for sentence in sentences if sentence]
+
+
+def log_text(sentences):
+    """Sentences in the log's format (see read_log)."""
+    return ''.join('\n'.join(sentence) + '\n\n' for sentence in sentences)
+
+
+def append_sentences(path, sentences):
+    """Append sentences to a log-format file."""
+    with open(path, 'a', encoding='utf-8', newline='\n') as f:
+        f.write(log_text(sentences))
+
+
+def _write_atomically(path, data):
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(data)
+    os.replace(temporary, path)
+
+
+def _rebuild_model(rebuild, sentences_path, pending, path):
+    """Run in the compaction process: rebuild from the kept and pending sentences, write the model to path."""
+    learned = read_log(sentences_path) if os.path.exists(sentences_path) else []
+    _write_atomically(path, rebuild((learned + pending)[-LEARNED_SENTENCES:]))
+
+
+class OnlineLearner:
+    """Delta layer plus append-only log of committed words, compacted into the model periodically."""
+
+    def __init__(self, directory, rebuild=rebuild_with_corpus, compact_every=COMPACT_EVERY,
+                 depth=LAYER_DEPTH, install=MappedModel.open):
+        """
+        Args:
+            directory (str): Where the log, learned.json and the learned models are kept.
+            rebuild (callable): rebuild(learned_sentences) -> model bytes; called in
+                a separate process, so it must pickle (a module-level function, or
+                a functools.partial of one).
+            compact_every (int): Words learned between compactions.
+            depth (int): Words kept ranked per count table of the delta layer.
+            install (callable): install(path) -> MappedModel, called with every new
+                learned model (and the latest one on start); its result becomes self.model.
+        """
+        if compact_every < 1:
+            raise ValueError("compact_every must be at least 1")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.compact_every = compact_every
+        self.depth = depth
+        self._rebuild = rebuild
+        self._install = install
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self.log_path = os.path.join(directory, LOG_NAME)
+        self.compacting_path = os.path.join(directory, COMPACTING_NAME)
+        self.sentences_path = os.path.join(directory, SENTENCES_NAME)
+        self.state_path = os.path.join(directory, STATE_NAME)
+
+        self.model = None
+        self.generation = self._load_state()['generation']
+        if self.generation and os.path.exists(self.model_path()):
+            self.model = install(self.model_path())
+
+        # Replay what was learned but not compacted yet, a rotated log first
+        self.layer = self._new_layer()
+        self._compacting = None
+        self._unrotated = 0
+        self._can_compact = True
+        if os.path.exists(self.compacting_path):
+            self._compacting = self._replay(self.compacting_path, self._new_layer())
+            self._queue.put(_ROTATE)
+        if os.path.exists(self.log_path):
+            self._replay(self.log_path, self.layer)
+            self._unrotated = self.layer.unigrams.total
+
+        self.observed = 0
+        self.logged = 0
+        self.compactions = 0
+        self.failures = 0
+        self._thread = threading.Thread(target=self._run, name='online-learner', daemon=True)
+        self._thread.start()
+
+    def _new_layer(self):
+        return AppLayer(self.depth, LEARNED_WEIGHT)
+
+    @staticmethod
+    def _replay(path, layer):
+        for sentence in read_log(path):
+            previous = None
+            for word in sentence:
+                layer.learn(previous, word)
+                previous = word
+        return layer
+
+    def observe(self, previous, word):
+        """
+        Learn one committed word. Constant cost; the disk is written in the background.
+
+        Args:
+            previous (str): The word before it, None at the start of a sentence.
+            word (str): The committed word.
+        """
+        if not word or '\n' in word:
+            return
+        with self._lock:
+            self.layer.learn(previous, word)
+            self.observed += 1
+            self._unrotated += 1
+            self._queue.put(word)
+            if self._unrotated >= self.compact_every and self._compacting is None and self._can_compact:
+                self._compacting, self.layer = self.layer, self._new_layer()
+                self._unrotated = 0
+                self._queue.put(_ROTATE)
+
+    def unobserve(self, previous, word):
+        """
+        Take back the last observe(previous, word), e.g. when its word is reopened
+        with backspace. Nothing happens once the word was rotated out for compaction.
+
+        Args:
+            previous (str): The word before it, as passed to observe.
+            word (str): The word to take back.
+        """
+        if not word or '\n' in word:
+            return
+        with self._lock:
+            if not self._unrotated:
+                return
+            self.layer.unlearn(previous, word)
+            self.observed -= 1
+            self._unrotated -= 1
+            self._queue.put(_UNDO)
+
+    def end_sentence(self):
+        """Mark a sentence boundary in the log (e.g. on Enter), so no n-gram spans it."""
+        self._queue.put(_BREAK)
+
+    def layers(self):
+        """The non-empty delta layers to mix into suggestions (a rotated one while it is compacted)."""
+        with self._lock:
+            return [layer for layer in (self._compacting, self.layer) if layer]
+
+    def model_path(self, generation=None):
+        """Path of a learned model generation, the latest by default."""
+        generation = self.generation if generation is None else generation
+        return os.path.join(self.directory, f'{MODEL_PREFIX}{generation}.osk')
+
+    def flush(self):
+        """Block until every queued word is logged and any compaction it triggered is done."""
+        self._queue.join()
+
+    def close(self):
+        """Log what is still queued and stop the background thread."""
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _open_log(self):
+        # Untranslated newlines, so the writer can count the bytes it wrote
+        return open(self.log_path, 'a', encoding='utf-8', newline='\n')
+
+    def _run(self):
+        log = self._open_log()
+        # Leftover text from a crash may lack its final newline
+        if log.tell():
+            log.write('\n')
+        size = log.tell()
+        # Offsets of the words at the end of the log that an undo can cut
+        word_lines = []
+        try:
+            while True:
+                item = self._queue.get()
+                try:
+                    if item is _STOP:
+                        return
+                    if item is _BREAK:
+                        log.write('\n')
+                        size += 1
+                        word_lines.clear()
+                    elif item is _ROTATE:
+                        log.close()
+                        self._rotate_log()
+                        log = self._open_log()
+                        size = log.tell()
+                        word_lines.clear()
+                        self._compact()
+                    elif item is _UNDO:
+                        if word_lines:
+                            size = word_lines.pop()
+                            log.truncate(size)
+                            self.logged -= 1
+                    else:
+                        word_lines.append(size)
+                        log.write(item + '\n')
+                        size += len(item.encode('utf-8')) + 1
+                        self.logged += 1
+                    if self._queue.empty():
+                        log.flush()
+                finally:
+                    self._queue.task_done()
+        finally:
+            log.close()
+
+    def _rotate_log(self):
+        if not os.path.exists(self.log_path):
+            return
+        if not os.path.exists(self.compacting_path):
+            os.replace(self.log_path, self.compacting_path)
+            return
+        # A compaction that failed earlier left its log behind: compact both
+        with open(self.log_path, 'r', encoding='utf-8') as f:
+            text = f.read()
+        with open(self.compacting_path, 'a', encoding='utf-8') as f:
+            f.write('\n' + text)
+        os.remove(self.log_path)
+
+    def _load_state(self):
+        if not os.path.exists(self.state_path):
+            return {'generation': 0, 'sentences': 0}
+        with open(self.state_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        if isinstance(state['sentences'], list):
+            # Older state kept every learned sentence in learned.json itself
+            append_sentences(self.sentences_path, state['sentences'])
+            state['sentences'] = len(state['sentences'])
+            _write_atomically(self.state_path, json.dumps(state).encode('utf-8'))
+        return state
+
+    def _compact(self):
+        """Fold the rotated log into a new learned model, built in a separate process, and install it."""
+        try:
+            state = self._load_state()
+            pending = read_log(self.compacting_path) if os.path.exists(self.compacting_path) else []
+            state['generation'] += 1
+            path = self.model_path(state['generation'])
+            # spawn, not fork: the keyboard's process runs Qt and other threads
+            with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                executor.submit(_rebuild_model, self._rebuild, self.sentences_path, pending, path).result()
+            append_sentences(self.sentences_path, pending)
+            state['sentences'] += len(pending)
+            if state['sentences'] > 2 * LEARNED_SENTENCES:
+                kept = read_log(self.sentences_path)[-LEARNED_SENTENCES:]
+                _write_atomically(self.sentences_path, log_text(kept).encode('utf-8'))
+                state['sentences'] = len(kept)
+            _write_atomically(self.state_path, json.dumps(state).encode('utf-8'))
+            if os.path.exists(self.compacting_path):
+                os.remove(self.compacting_path)
+            model = self._install(path)
+        except Exception as e:
+            print(f"Compacting the learned words failed: {e}")
+            with self._lock:
+                self.failures += 1
+                # The rotated log stays on disk for the next rotation (or start) to
+                # retry, and its words stay mixed in from the live delta meanwhile
+                if self._compacting is not None:
+                    self.layer.merge(self._compacting)
+                    self._compacting = None
+                if isinstance(e, FileNotFoundError):
+                    # e.g. no base corpus: later attempts would fail the same way
+                    print("Learned words stay in the delta and the log until the next start")
+                    self._can_compact = False
+            return
+
+        with self._lock:
+            self.model = model
+            self.generation = state['generation']
+            self._compacting = None
+            self.compactions += 1
+            # Words learned meanwhile may be enough for the next compaction already
+            if self._unrotated >= self.compact_every:
+                self._compacting, self.layer = self.layer, self._new_layer()
+                self._unrotated = 0
+                self._queue.put(_ROTATE)
+
+        for entry in os.listdir(self.directory):
+            if entry.startswith(MODEL_PREFIX) and entry.endswith('.osk') and entry != os.path.basename(path):
+                try:
+                    os.remove(os.path.join(self.directory, entry))
+                except OSError:
+                    # Still mapped somewhere (Windows); removed after a later compaction
+                    pass
+
+    def stats(self):
+        """
+        Returns:
+            dict: observed (words learned this run), logged (written to the log),
+            pending (learned since the last rotation), generation (of the learned
+            model), compactions and failures.
+        """
+        with self._lock:
+            return {
+                'observed': self.observed,
+                'logged': self.logged,
+                'pending': self._unrotated,
+                'generation': self.generation,
+                'compactions': self.compactions,
+                'failures': self.failures,
+            }
@@ -0,0 +1,541 @@
+"""
+Versioned binary model format for the inference engine.
+
+The file is opened with mmap and queried in place: nothing is deserialized at
+startup, so opening a model costs the same regardless of corpus size, and every
+process that maps the same file shares one copy in the OS page cache.
+
+Layout (native byte order, which must be little-endian):
+    header    magic b'OSKM', uint16 format version, uint16 section count
+    table     one entry per section: 16-byte name, uint64 offset, uint64 length
+    sections  flat arrays, each aligned to 8 bytes
+
+Sections:
+    meta        JSON with the n-gram order, completion depth and build info
+    str_off     uint32[V + 1]  offsets into str_data, ids in lexicographic order
+    str_data    uint8[]        UTF-8 bytes of every word, concatenated
+    freq        uint32[V]      word frequencies
+    node_edge   uint32[N + 1]  children of node i are edges node_edge[i]:node_edge[i + 1]
+    edge_byte   uint8[E]       edge labels (UTF-8 bytes), sorted per node
+    edge_node   uint32[E]      edge targets
+    node_lo     uint32[N]      first word id under the node
+    node_hi     uint32[N]      one past the last word id under the node
+    topk_off    uint32[N + 1]  CSR offsets into topk_ids
+    topk_ids    uint32[]       most frequent words under every node, best-first
+    ctx_keys    uint64[C]      n-gram contexts packed as (w1 << 32) | w2, sorted
+    ctx_hash    uint32[H]      open-addressing table: context index + 1, 0 = empty
+    succ_off    uint32[C + 1]  CSR offsets into succ_ids / succ_probs
+    succ_ids    uint32[S]      successors of every context, best-first
+    succ_probs  float32[S]     matching probabilities
+    lex_ids     uint32[S]      successors of every context again, in id (lexicographic) order
+    lex_rank    uint32[S]      best-first rank of each lex_ids entry within its context
+    rmq_off     uint32[C + 1]  CSR offsets into rmq_pos (empty for short successor lists)
+    rmq_pos     uint32[R]      sparse table: best lexicographic position of every 2^j window
+    bi_off      uint32[V + 1]  bigram backoff: successors of word i are bi_ids[bi_off[i]:bi_off[i + 1]]
+    bi_ids      uint32[B]      bigram successors of every word, best-first
+    bi_probs    float32[B]     matching probabilities
+    uni_ids     uint32[V]      every word id by unigram probability, best-first
+    ctx_backoff float32[C]     backoff weight of every n-gram context
+    bi_backoff  float32[V]     backoff weight of every word as a bigram context
+    uni_probs   float32[V]     unigram probabilities
+
+Probabilities follow the backoff form: a word missing from a context's successor
+list scores the context's backoff weight times its probability one order down
+(a weight of 1 for unseen contexts). Unsmoothed models use stupid backoff
+(weights of 0.4, raw relative frequencies); models trained with Kneser-Ney store
+interpolated probabilities and the matching weights (see engine.kneser_ney).
+
+Next-word prediction merges the trigram -> bigram -> unigram levels by score.
+Each level is one lookup into presorted arrays (a hash probe, a direct index and
+a fixed list), so the chain never sorts and never comes back empty.
+
+Because word ids follow lexicographic order, the words under a trie node form
+the contiguous id range [node_lo, node_hi). In a context's lex_ids that range is
+a contiguous run found by bisection, and the sparse table answers "best successor
+in positions [a, b)" with two lookups, so the best completions of a prefix in
+context come out in O(log S + k log k) however many successors the context has.
+For a context with n successors, level j >= 1 of its table holds n - 2^j + 1
+positions, levels stored one after the other (level 0 is the identity).
+
+Reading needs only the standard library; models are written by engine.csr_model.
+"""
+import json
+import mmap
+import struct
+import sys
+from bisect import bisect_left
+from heapq import heappop, heappush, nsmallest
+from itertools import chain
+
+MAGIC = b'OSKM'
+FORMAT_VERSION = 4
+
+# N-gram order of every model: a context is packed as two 32-bit word ids (pack_context)
+ORDER = 3
+
+HEADER = struct.Struct('<4sHH')
+SECTION_ENTRY = struct.Struct('<16sQQ')
+
+# Section name -> memoryview/array typecode
+SECTIONS = {
+    'meta': 'B',
+    'str_off': 'I',
+    'str_data': 'B',
+    'freq': 'I',
+    'node_edge': 'I',
+    'edge_byte': 'B',
+    'edge_node': 'I',
+    'node_lo': 'I',
+    'node_hi': 'I',
+    'topk_off': 'I',
+    'topk_ids': 'I',
+    'ctx_keys': 'Q',
+    'ctx_hash': 'I',
+    'succ_off': 'I',
+    'succ_ids': 'I',
+    'succ_probs': 'f',
+    'lex_ids': 'I',
+    'lex_rank': 'I',
+    'rmq_off': 'I',
+    'rmq_pos': 'I',
+    'bi_off': 'I',
+    'bi_ids': 'I',
+    'bi_probs': 'f',
+    'uni_ids': 'I',
+    'ctx_backoff': 'f',
+    'bi_backoff': 'f',
+    'uni_probs': 'f',
+}
+
+HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+MASK64 = (1 << 64) - 1
+
+# Word ids ranked per deadline check when a completion list is deeper than topk_ids
+SCAN_CHUNK = 4096
+
+
+def pack_context(first_id, second_id):
+    """Pack a two-word context into the 64-bit key used by ctx_keys."""
+    return (first_id << 32) | second_id
+
+
+def rmq_level_start(n, level):
+    """Offset of a sparse-table level (>= 1) within the table of a context with n successors."""
+    return (level - 1) * (n + 1) - (1 << level) + 2
+
+
+def hash_slot(key, bits):
+    """Home slot of a packed context key in a ctx_hash table of 2**bits entries."""
+    return ((key * HASH_MULTIPLIER) & MASK64) >> (64 - bits)
+
+
+class MappedModel:
+    """
+    A binary model queried in place over an mmap (or any bytes-like buffer).
+
+    All lookups read the flat arrays directly; words are only decoded for the
+    handful of ids that are returned.
+    """
+
+    def __init__(self, buffer, path=None):
+        self.path = path
+        self._buffer = buffer
+        self._views = []
+        self._arrays = {}
+        self._vocabulary = None
+        self._word_index = None
+        self._total_tokens = None
+        self._decoded_bytes = 0
+
+        view = memoryview(buffer)
+        self._views.append(view)
+        magic, version, count = HEADER.unpack_from(view, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path or 'buffer'} is not an OSK model file")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"unsupported model format version {version} (expected {FORMAT_VERSION}); "
+                             f"rebuild it with 'python -m engine.build_model'")
+
+        for i in range(count):
+            name, offset, length = SECTION_ENTRY.unpack_from(view, HEADER.size + i * SECTION_ENTRY.size)
+            name = name.rstrip(b'\0').decode('ascii')
+            if name in SECTIONS:
+                section = view[offset:offset + length].cast(SECTIONS[name])
+                self._views.append(section)
+                setattr(self, name, section)
+
+        self.meta = json.loads(bytes(self.meta))
+        self.n = self.meta['n']
+        if self.n != ORDER:
+            raise ValueError(f"{path or 'buffer'} is a {self.n}-gram model; the format only holds "
+                             f"{ORDER}-gram models")
+        self.topk_depth = self.meta['topk_depth']
+        self.vocab_size = len(self.freq)
+        self._hash_bits = self.meta['hash_bits']
+        self._hash_mask = (1 << self._hash_bits) - 1
+
+    @classmethod
+    def open(cls, path):
+        """Map a model file read-only."""
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer, path)
+
+    def close(self):
+        """Release the memory views and unmap the file."""
+        self._arrays.clear()
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+
+    @property
+    def nbytes(self):
+        """Size of the underlying file/buffer in bytes."""
+        return len(self._buffer)
+
+    @property
+    def resident_bytes(self):
+        """Memory the model holds: the file/buffer plus the vocabulary and word index, once decoded."""
+        return len(self._buffer) + self._decoded_bytes
+
+    @property
+    def total_tokens(self):
+        """Tokens the model was built from: meta's count, else the sum of the word frequencies (at least 1)."""
+        if self._total_tokens is None:
+            self._total_tokens = self.meta.get('tokens') or int(self.array('freq').sum()) or 1
+        return self._total_tokens
+
+    def array(self, name):
+        """Zero-copy NumPy view of a section, for vectorized queries (NumPy is imported on first use)."""
+        view = self._arrays.get(name)
+        if view is None:
+            import numpy as np
+            view = self._arrays[name] = np.frombuffer(getattr(self, name), dtype=np.dtype(SECTIONS[name]))
+        return view
+
+    # Vocabulary
+
+    def word(self, word_id):
+        """Decode the word with the given id."""
+        return bytes(self.str_data[self.str_off[word_id]:self.str_off[word_id + 1]]).decode('utf-8')
+
+    def words(self, word_ids):
+        return [self.word(word_id) for word_id in word_ids]
+
+    def vocabulary(self):
+        """Every word, indexed by id. Decoded once on first use, for bulk work such as batches."""
+        if self._vocabulary is None:
+            data = bytes(self.str_data)
+            offsets = self.str_off
+            self._vocabulary = [data[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(self.vocab_size)]
+            self._decoded_bytes += sys.getsizeof(self._vocabulary) + sum(map(sys.getsizeof, self._vocabulary))
+        return self._vocabulary
+
+    def word_index(self):
+        """Dict from word to id, built on first use (see vocabulary)."""
+        if self._word_index is None:
+            self._word_index = {word: i for i, word in enumerate(self.vocabulary())}
+            self._decoded_bytes += sys.getsizeof(self._word_index)
+        return self._word_index
+
+    def word_id(self, word):
+        """Id of word, or None if it is not in the vocabulary."""
+        encoded = word.encode('utf-8')
+        node = self.walk(encoded)
+        if node < 0:
+            return None
+        word_id = self.node_lo[node]
+        if self.str_off[word_id + 1] - self.str_off[word_id] != len(encoded):
+            return None  # the node is only a prefix of longer words
+        return word_id
+
+    # Trie
+
+    def child(self, node, byte):
+        """Follow the edge labelled byte out of node; -1 if there is none."""
+        lo, hi = self.node_edge[node], self.node_edge[node + 1]
+        i = bisect_left(self.edge_byte, byte, lo, hi)
+        if i < hi and self.edge_byte[i] == byte:
+            return self.edge_node[i]
+        return -1
+
+    def walk(self, encoded, node=0):
+        """Follow a run of UTF-8 bytes from node; -1 if the path leaves the trie."""
+        for byte in encoded:
+            node = self.child(node, byte)
+            if node < 0:
+                return -1
+        return node
+
+    def id_range(self, node):
+        """Word ids under node, as a half-open range."""
+        return self.node_lo[node], self.node_hi[node]
+
+    def top_completion_ids(self, node, top_k, deadline=None):
+        """
+        Most frequent word ids under node, best-first.
+
+        Deeper than the precomputed lists, the node's whole id range is ranked a
+        chunk at a time, starting from the precomputed list; if the deadline
+        (engine.deadline.Deadline) expires the ranking so far is returned.
+        """
+        start, end = self.topk_off[node], self.topk_off[node + 1]
+        if top_k <= self.topk_depth:
+            return self.topk_ids[start:min(end, start + top_k)]
+        lo, hi = self.id_range(node)
+        best = list(self.topk_ids[start:end])
+        listed = set(best)
+        for chunk in range(lo, hi, SCAN_CHUNK):
+            if deadline is not None and deadline.expired():
+                break
+            unlisted = (i for i in range(chunk, min(chunk + SCAN_CHUNK, hi)) if i not in listed)
+            best = nsmallest(top_k, chain(best, unlisted), key=lambda i: (-self.freq[i], i))
+        return best
+
+    # N-grams
+
+    def context_index(self, context_ids):
+        """Index of the packed context in ctx_keys, or -1 if the context is unseen."""
+        if len(context_ids) != self.n - 1 or None in context_ids:
+            return -1
+        key = pack_context(*context_ids)
+        slot = hash_slot(key, self._hash_bits)
+        while True:
+            entry = self.ctx_hash[slot]
+            if not entry:
+                return -1
+            if self.ctx_keys[entry - 1] == key:
+                return entry - 1
+            slot = (slot + 1) & self._hash_mask
+
+    def successor_ids(self, context_index, top_k=None):
+        """Successor word ids of a context, best-first."""
+        if context_index < 0:
+            return self.succ_ids[:0]
+        start, end = self.succ_off[context_index], self.succ_off[context_index + 1]
+        if top_k is not None:
+            end = min(end, start + top_k)
+        return self.succ_ids[start:end]
+
+    def bigram_successor_ids(self, word_id, top_k=None):
+        """Successor word ids of a single word (the bigram backoff level), best-first."""
+        if word_id is None:
+            return self.bi_ids[:0]
+        start, end = self.bi_off[word_id], self.bi_off[word_id + 1]
+        if top_k is not None:
+            end = min(end, start + top_k)
+        return self.bi_ids[start:end]
+
+    def _backoff_levels(self, context_index, last_id):
+        """
+        The (ids, probabilities, weight) of each level of the chain, highest order first.
+        """
+        weight = 1.0
+        levels = []
+        if context_index >= 0:
+            start, end = self.succ_off[context_index], self.succ_off[context_index + 1]
+            levels.append((self.succ_ids[start:end], self.succ_probs[start:end], weight))
+            weight = self.ctx_backoff[context_index]
+        if last_id is not None:
+            start, end = self.bi_off[last_id], self.bi_off[last_id + 1]
+            levels.append((self.bi_ids[start:end], self.bi_probs[start:end], weight))
+            weight *= self.bi_backoff[last_id]
+        levels.append((self.uni_ids, None, weight))
+        return levels
+
+    def next_word_ids(self, context_index, last_id, top_k):
+        """
+        Ranked next-word ids through the trigram -> bigram -> unigram backoff chain.
+
+        Args:
+            context_index (int): Resolved n-gram context, -1 if unseen.
+            last_id (int): Id of the previous word, None if unknown or absent.
+            top_k (int): Number of ids to return.
+
+        Returns:
+            list: Up to top_k ids, best-first; ties go to the higher level.
+        """
+        return self.next_word_scores(context_index, last_id, top_k)[0]
+
+    def next_word_scores(self, context_index, last_id, top_k):
+        """
+        next_word_ids along with the score of every id.
+
+        Each level's list is presorted, and scaling it by its backoff weight keeps
+        it sorted, so the levels are merged like sorted runs and only the first few
+        entries of each are ever read. A word listed at several levels ranks by its
+        best score, which for Kneser-Ney is always the highest-order one, so the
+        scores are then exactly P(word | context).
+
+        Returns:
+            tuple: (ids, scores), best-first.
+        """
+        levels = self._backoff_levels(context_index, last_id)
+        positions = [0] * len(levels)
+        suggested = []
+        scores = []
+        while len(suggested) < top_k:
+            best, best_score = -1, -1.0
+            for level, (ids, probs, weight) in enumerate(levels):
+                i = positions[level]
+                while i < len(ids) and ids[i] in suggested:
+                    i += 1
+                positions[level] = i
+                if i < len(ids):
+                    prob = probs[i] if probs is not None else self.uni_probs[ids[i]]
+                    if prob * weight > best_score:
+                        best, best_score = level, prob * weight
+            if best < 0:
+                break
+            suggested.append(levels[best][0][positions[best]])
+            scores.append(best_score)
+            positions[best] += 1
+        return suggested, scores
+
+    def next_word_score(self, context_index, last_id, word_id):
+        """
+        The score next_word_scores gives one word, without merging the levels.
+
+        The successor level is found by bisection and the bigram level (short
+        lists) by a vectorized scan; the best level wins, as in the merge.
+        """
+        score = self.successor_probability(context_index, word_id)
+        weight = self.ctx_backoff[context_index] if context_index >= 0 else 1.0
+        if last_id is not None:
+            start, end = self.bi_off[last_id], self.bi_off[last_id + 1]
+            hits = (self.array('bi_ids')[start:end] == word_id).nonzero()[0]
+            if len(hits):
+                score = max(score, self.bi_probs[start + int(hits[0])] * weight)
+            weight *= self.bi_backoff[last_id]
+        return max(score, self.uni_probs[word_id] * weight)
+
+    def probability(self, context_ids, word_id):
+        """
+        Probability (a score, for stupid backoff) of word_id after the context.
+
+        Args:
+            context_ids (list): Ids of the previous words, None for unknown ones.
+            word_id (int): The predicted word.
+        """
+        context_ids = context_ids[-(self.n - 1):] if self.n > 1 else []
+        last_id = context_ids[-1] if context_ids else None
+        *levels, (_, _, unigram_weight) = self._backoff_levels(self.context_index(context_ids), last_id)
+        for ids, probs, weight in levels:
+            for i, successor in enumerate(ids):
+                if successor == word_id:
+                    return probs[i] * weight
+        return self.uni_probs[word_id] * unigram_weight
+
+    def context_ids(self, context):
+        """Ids of the last n-1 context words (None for out-of-vocabulary words)."""
+        return [self.word_id(word) for word in context[-(self.n - 1):]] if self.n > 1 else []
+
+    # Queries
+
+    def successor_probability(self, context_index, word_id):
+        """Stored probability of word_id after a context, found by bisection; 0.0 if it is not a successor."""
+        if context_index < 0:
+            return 0.0
+        start, end = self.succ_off[context_index], self.succ_off[context_index + 1]
+        i = bisect_left(self.lex_ids, word_id, start, end)
+        if i < end and self.lex_ids[i] == word_id:
+            return self.succ_probs[start + self.lex_rank[i]]
+        return 0.0
+
+    def _best_position(self, context_index, start, n, a, b):
+        """Lexicographic position (relative to start) of the best successor in positions [a, b)."""
+        if b - a == 1:
+            return a
+        level = (b - a).bit_length() - 1
+        base = self.rmq_off[context_index] + rmq_level_start(n, level)
+        left, right = self.rmq_pos[base + a], self.rmq_pos[base + b - (1 << level)]
+        return left if self.lex_rank[start + left] <= self.lex_rank[start + right] else right
+
+    def successor_ids_in_range(self, context_index, lo, hi, top_k):
+        """
+        The best top_k successors of a context whose ids lie in [lo, hi), best-first.
+
+        Short successor lists are scanned; longer ones bisect their lexicographic
+        copy for the run of ids in range and pop the best of each sub-run from a
+        heap, the sparse table answering each range-best query in O(1).
+        """
+        start, end = self.succ_off[context_index], self.succ_off[context_index + 1]
+        if self.rmq_off[context_index] == self.rmq_off[context_index + 1]:
+            suggested = []
+            for word_id in self.succ_ids[start:end]:
+                if lo <= word_id < hi:
+                    suggested.append(word_id)
+                    if len(suggested) == top_k:
+                        break
+            return suggested
+
+        n = end - start
+        a = bisect_left(self.lex_ids, lo, start, end) - start
+        b = bisect_left(self.lex_ids, hi, start + a, end) - start
+        heap = []
+
+        def push(a, b):
+            if a < b:
+                position = self._best_position(context_index, start, n, a, b)
+                heappush(heap, (self.lex_rank[start + position], position, a, b))
+
+        push(a, b)
+        suggested = []
+        while heap and len(suggested) < top_k:
+            rank, position, a, b = heappop(heap)
+            suggested.append(self.succ_ids[start + rank])
+            push(a, position)
+            push(position + 1, b)
+        return suggested
+
+    def completion_ids(self, node, context_index, top_k, deadline=None):
+        """
+        Ranked completion ids under a trie node, given an already resolved context.
+
+        The context's successors inside the node's id range come first, best-first;
+        the remaining slots are filled by frequency (see top_completion_ids for
+        the deadline).
+        """
+        suggested = []
+        if context_index >= 0:
+            lo, hi = self.id_range(node)
+            suggested = self.successor_ids_in_range(context_index, lo, hi, top_k)
+            if len(suggested) == top_k:
+                return suggested
+
+        for word_id in self.top_completion_ids(node, top_k + len(suggested), deadline):
+            if word_id not in suggested:
+                suggested.append(word_id)
+                if len(suggested) == top_k:
+                    break
+        return suggested
+
+    def complete(self, prefix, context, top_k=3, deadline=None):
+        """
+        Completions of prefix, ranked by n-gram probability in context, then frequency.
+
+        Args:
+            prefix (str): The partial word being typed.
+            context (list): Previous words.
+            top_k (int): Number of suggestions to return.
+            deadline (Deadline): Optional; stops ranking completions deeper than
+                the precomputed lists, keeping the best so far.
+
+        Returns:
+            list: Up to top_k words.
+        """
+        if not prefix:
+            return []
+        node = self.walk(prefix.encode('utf-8'))
+        if node < 0:
+            return []
+        context_index = self.context_index(self.context_ids(context)) if context else -1
+        return self.words(self.completion_ids(node, context_index, top_k, deadline))
+
+    def next_words(self, context, top_k=5):
+        """Most probable next words after context, best-first, backing off to shorter contexts."""
+        context_ids = self.context_ids(context)
+        last_id = context_ids[-1] if context_ids else None
+        return self.words(self.next_word_ids(self.context_index(context_ids), last_id, top_k))
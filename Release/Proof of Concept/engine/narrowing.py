@@ -0,0 +1,134 @@
+"""
+Prefix-narrowing memoization for stateless completion calls.
+
+complete_current_word is called once per keystroke with the whole prefix, so
+between "be" and "bea" it would walk the trie from the root, resolve the
+context again and rank the completions from scratch. The completions of "bea"
+are a subset of those of "be", though: NarrowingCompleter keeps the previous
+keystroke's resolved context, trie node and the context's best RETAINED
+successors under that node, and when the next call extends the prefix in the
+same context it walks only the new characters and filters the retained
+successors by the new node's id range. The frequency fill is read from the new
+node's precomputed list as usual.
+
+Filtering a best-first list keeps it best-first, so the filtered successors rank
+exactly like a fresh lookup as long as they still hold top_k entries (or held
+every successor under the node to begin with). Once they run out, a fresh
+lookup retains a new set.
+"""
+import threading
+from collections import namedtuple
+
+# Best successors retained per keystroke for later ones to filter
+RETAINED = 32
+
+# State kept from one keystroke to the next; all_successors says whether
+# successors lists every successor of the context under the node
+Retained = namedtuple('Retained', 'key prefix context_index node successors all_successors')
+
+
+class NarrowingCompleter:
+    """Completion ids that reuse the previous keystroke's candidates when the prefix grows."""
+
+    def __init__(self, retained=RETAINED):
+        """
+        Args:
+            retained (int): Successors retained by a fresh lookup.
+        """
+        self.retained = retained
+        self._lock = threading.Lock()
+        self._model = None
+        self._last = None
+        self.narrowed = 0
+        self.fresh = 0
+
+    def completion_ids(self, model, prefix, context, top_k, deadline=None):
+        """
+        Ranked completion ids of prefix in context, as MappedModel.completion_ids ranks them.
+
+        Args:
+            model (MappedModel): The model to query; a different model than the
+                previous call's drops the retained candidates.
+            prefix (str): The partial word being typed.
+            context (list): Previous words.
+            top_k (int): Number of ids to return.
+            deadline (Deadline): Optional, as for MappedModel.completion_ids.
+
+        Returns:
+            list: Up to top_k ids, best-first.
+        """
+        key = tuple(context[-(model.n - 1):]) if model.n > 1 else ()
+        with self._lock:
+            if model is not self._model:
+                self._model, self._last = model, None
+            last = self._last
+
+        ids = None
+        if last is not None and last.key == key and prefix.startswith(last.prefix):
+            state = self._narrow(model, last, prefix)
+            ids = self._rank(model, state, top_k, deadline)
+        narrowed = ids is not None
+        if not narrowed:
+            state = self._fresh(model, last, key, prefix, context, max(self.retained, top_k))
+            ids = self._rank(model, state, top_k, deadline)
+
+        with self._lock:
+            if narrowed:
+                self.narrowed += 1
+            else:
+                self.fresh += 1
+            if model is self._model:
+                self._last = state
+        return ids
+
+    @staticmethod
+    def _narrow(model, last, prefix):
+        """Follow the new characters from the previous node and filter its candidates."""
+        node = last.node
+        if node >= 0 and len(prefix) > len(last.prefix):
+            node = model.walk(prefix[len(last.prefix):].encode('utf-8'), node)
+        if node < 0:
+            return last._replace(prefix=prefix, node=-1, successors=[], all_successors=True)
+        lo, hi = model.id_range(node)
+        return last._replace(prefix=prefix, node=node, successors=[i for i in last.successors if lo <= i < hi])
+
+    @staticmethod
+    def _fresh(model, last, key, prefix, context, retained):
+        """Walk the prefix from the root and retain the context's best successors under it."""
+        if last is not None and last.key == key:
+            context_index = last.context_index
+        else:
+            context_index = model.context_index(model.context_ids(context)) if context else -1
+        node = model.walk(prefix.encode('utf-8'))
+        if node < 0:
+            return Retained(key, prefix, context_index, -1, [], True)
+        successors = []
+        if context_index >= 0:
+            successors = model.successor_ids_in_range(context_index, *model.id_range(node), retained)
+        return Retained(key, prefix, context_index, node, successors, len(successors) < retained)
+
+    @staticmethod
+    def _rank(model, state, top_k, deadline):
+        """MappedModel.completion_ids over the retained successors; None if they ran out."""
+        suggested = state.successors[:top_k]
+        if len(suggested) == top_k or state.node < 0:
+            return suggested
+        if not state.all_successors:
+            return None
+        for word_id in model.top_completion_ids(state.node, top_k + len(suggested), deadline):
+            if word_id not in suggested:
+                suggested.append(word_id)
+                if len(suggested) == top_k:
+                    break
+        return suggested
+
+    def stats(self):
+        """
+        Returns:
+            dict: narrowed (answered by filtering), fresh (answered by a new lookup)
+            and narrowed_rate.
+        """
+        with self._lock:
+            calls = self.narrowed + self.fresh
+            return {'narrowed': self.narrowed, 'fresh': self.fresh,
+                    'narrowed_rate': self.narrowed / calls if calls else 0.0}
@@ -0,0 +1,254 @@
+"""
+A compact LSTM next-word model, an alternative engine to the n-gram model.
+
+The network is one embedding layer, one LSTM layer and a softmax over its own
+vocabulary (trained by engine.train_neural_lm). Reading a context word costs
+one LSTM step, so a NeuralSession keeps the recurrent state of the words
+committed so far and advances it by one step per committed word instead of
+re-encoding the whole context. The step also computes the output scores of
+every word once. The keystrokes in between only pick the best of them in the
+prefix's range: the vocabulary is sorted, so the words starting with a prefix
+are one contiguous run, found by bisection.
+
+Weights are stored as int8 with a float32 scale per output unit, four times
+smaller than float32, and are expanded back to float32 once when loaded (NumPy
+has no int8 matrix product, so running on int8 would not be faster).
+"""
+from bisect import bisect_left
+from collections import deque, namedtuple
+
+import numpy as np
+
+from engine.deadline import Suggestions
+
+# Rows of the out-of-vocabulary word and of the start of a sentence; words follow
+UNKNOWN, START = 0, 1
+
+# Recurrent state after some words: hidden and cell vectors, and the output
+# scores (logits) of every word as the next one
+LstmState = namedtuple('LstmState', 'h c logits')
+
+
+def quantize(matrix, axis=0):
+    """
+    Symmetric int8 quantization with one scale per slice along axis.
+
+    Returns:
+        tuple: (int8 values, float32 scales), matrix ~= values * scales.
+    """
+    scales = np.abs(matrix).max(axis=axis, keepdims=True) / 127
+    scales[scales == 0] = 1
+    return np.round(matrix / scales).astype(np.int8), scales.astype(np.float32)
+
+
+def sigmoid(x):
+    return 1 / (1 + np.exp(-x))
+
+
+class NeuralLanguageModel:
+    """Embedding -> LSTM -> softmax over a sorted vocabulary."""
+
+    # Quantized matrices, with the axis that shares a scale (per output unit)
+    QUANTIZED = {'E': 1, 'W': 0, 'O': 0}
+
+    def __init__(self, words, params):
+        """
+        Args:
+            words (list): Vocabulary in sorted order; row i + 2 is words[i].
+            params (dict): E (V x d) embeddings, W (d + H x 4H) and b (4H) for
+                the LSTM gates (input, forget, cell, output), O (H x V) and c (V)
+                for the output layer.
+        """
+        self.words = list(words)
+        self.index = {word: i + 2 for i, word in enumerate(self.words)}
+        self.params = params
+        self.hidden_size = params['b'].shape[0] // 4
+
+    @classmethod
+    def load(cls, path):
+        """Read a model saved by save(), expanding quantized weights to float32."""
+        with np.load(path) as data:
+            words = bytes(data['words']).decode('utf-8').split('\n') if len(data['words']) else []
+            params = {}
+            for name in ('E', 'W', 'b', 'O', 'c'):
+                if name + '_scale' in data:
+                    params[name] = data[name].astype(np.float32) * data[name + '_scale']
+                else:
+                    params[name] = data[name].astype(np.float32)
+        return cls(words, params)
+
+    def save(self, path, quantized=True):
+        """Write the vocabulary and weights, the large matrices as int8 unless quantized is False."""
+        arrays = {'words': np.frombuffer('\n'.join(self.words).encode('utf-8'), dtype=np.uint8)}
+        for name, value in self.params.items():
+            if quantized and name in self.QUANTIZED:
+                arrays[name], arrays[name + '_scale'] = quantize(value, self.QUANTIZED[name])
+            else:
+                arrays[name] = value.astype(np.float32)
+        with open(path, 'wb') as f:
+            np.savez(f, **arrays)
+
+    def row(self, word):
+        """Row of a word, UNKNOWN if it is outside the vocabulary."""
+        return self.index.get(word, UNKNOWN)
+
+    def initial_state(self):
+        """The state at the start of a sentence (after reading the start token)."""
+        zeros = np.zeros(self.hidden_size, dtype=np.float32)
+        return self.step(LstmState(zeros, zeros, None), START)
+
+    def step(self, state, row):
+        """
+        Advance the state by one word.
+
+        Args:
+            state (LstmState): The state before the word.
+            row (int): The word's row (see row()).
+
+        Returns:
+            LstmState: The state after it, with the next word's logits.
+        """
+        p = self.params
+        size = self.hidden_size
+        gates = np.concatenate([p['E'][row], state.h]) @ p['W'] + p['b']
+        i, f, o = sigmoid(gates[:size]), sigmoid(gates[size:2 * size]), sigmoid(gates[3 * size:])
+        c = f * state.c + i * np.tanh(gates[2 * size:3 * size])
+        h = o * np.tanh(c)
+        return LstmState(h, c, h @ p['O'] + p['c'])
+
+    def encode(self, words, state=None):
+        """The state after reading words from the start of a sentence (or from state)."""
+        state = self.initial_state() if state is None else state
+        for word in words:
+            state = self.step(state, self.row(word))
+        return state
+
+    def prefix_rows(self, prefix):
+        """Half-open range of the rows of the words starting with prefix."""
+        lo = bisect_left(self.words, prefix)
+        hi = bisect_left(self.words, prefix + '\U0010ffff', lo)
+        return lo + 2, hi + 2
+
+    def best_rows(self, logits, lo, hi, top_k):
+        """Rows in [lo, hi) with the highest logits, best-first (the special rows never)."""
+        lo = max(lo, START + 1)
+        if hi - lo <= 0:
+            return []
+        scores = logits[lo:hi]
+        if hi - lo > top_k:
+            candidates = np.argpartition(-scores, top_k)[:top_k]
+        else:
+            candidates = np.arange(hi - lo)
+        return (lo + candidates[np.argsort(-scores[candidates], kind='stable')]).tolist()
+
+    def next_words(self, state, top_k=5):
+        """Most probable next words after a state, best-first."""
+        rows = self.best_rows(state.logits, 0, len(self.words) + 2, top_k)
+        return [self.words[row - 2] for row in rows]
+
+    def completions(self, state, prefix, top_k=3):
+        """Most probable words starting with prefix after a state, best-first."""
+        rows = self.best_rows(state.logits, *self.prefix_rows(prefix), top_k)
+        return [self.words[row - 2] for row in rows]
+
+
+class NeuralSession:
+    """PredictionSession's interface for the UI, answered by a NeuralLanguageModel."""
+
+    def __init__(self, model, history_size=64):
+        """
+        Args:
+            model (NeuralLanguageModel): The network.
+            history_size (int): Committed words remembered for backspacing into them.
+        """
+        self.model = model
+        self.prefix_chars = []
+        self.history = deque(maxlen=history_size)
+        # The state after every committed word, so backspacing into one restores
+        # the state before it without re-encoding
+        self.states = deque(maxlen=history_size)
+        self.start = model.initial_state()
+        self.speculator = None
+        self.learner = None
+        self.steps = 0
+
+    @property
+    def prefix(self):
+        """The word currently being typed."""
+        return ''.join(self.prefix_chars)
+
+    @property
+    def context(self):
+        """Committed words, oldest first."""
+        return list(self.history)
+
+    @property
+    def state(self):
+        """The recurrent state after the committed words."""
+        return self.states[-1] if self.states else self.start
+
+    def reset(self):
+        """Forget the current word and the context (e.g. on Enter)."""
+        self.prefix_chars.clear()
+        self.history.clear()
+        self.states.clear()
+
+    def type_char(self, char):
+        self.prefix_chars.append(char)
+
+    def backspace(self):
+        """
+        Undo the last character. With an empty prefix, the last committed word
+        becomes the prefix again so it can be edited.
+        """
+        if self.prefix_chars:
+            self.prefix_chars.pop()
+        elif self.history:
+            self.prefix_chars.extend(self.history.pop())
+            self.states.pop()
+
+    def commit_word(self, word=None):
+        """
+        Finish the current word (space) or accept a suggestion in its place,
+        advancing the recurrent state by that one word.
+
+        Args:
+            word (str): The accepted word; defaults to the typed prefix.
+        """
+        word = self.prefix if word is None else word
+        self.prefix_chars.clear()
+        if not word:
+            return
+        if len(self.history) == self.history.maxlen:
+            # The oldest word is forgotten, but its effect stays in the state
+            self.history.popleft()
+        self.states.append(self.model.step(self.state, self.model.row(word)))
+        self.history.append(word)
+        self.steps += 1
+
+    def select_app(self, app):
+        """The neural model has no application layers: a no-op."""
+
+    def suggestion_words(self, top_k=5):
+        """Completions of the prefix, or next words if there is none."""
+        if self.prefix_chars:
+            return self.model.completions(self.state, self.prefix, top_k)
+        return self.model.next_words(self.state, top_k)
+
+    def suggestions(self, top_k=5, deadline=None):
+        """
+        Ranked words for the prediction bar.
+
+        Args:
+            top_k (int): Number of words to return.
+            deadline (float): Optional; the scores are ready after every commit,
+                so the result is never partial.
+
+        Returns:
+            list: Up to top_k words; a Suggestions list when a deadline is given.
+        """
+        words = self.suggestion_words(top_k)
+        return words if deadline is None else Suggestions(words)
+
+    def close(self):
+        """Nothing runs in the background: a no-op."""
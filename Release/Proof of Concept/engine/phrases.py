@@ -0,0 +1,150 @@
+"""
+Multi-word phrase suggestions: a bounded beam search over the n-gram model.
+
+A hypothesis is a run of predicted words with their log-probabilities. Level L of
+the search holds the best beam_width hypotheses of L words; level L + 1 is built
+by expanding every hypothesis of level L with its most likely next words
+(MappedModel.next_word_scores) and keeping the best again. Phrases of min_words
+to max_words words are ranked by their log-probability per word, so a confident
+longer phrase can beat a short one.
+
+A PhraseSearch lives as long as a typing session. Expansions are memoized by
+their n-gram context, and when a word is committed the hypotheses that started
+with it are kept, shortened by that word, as seeds of the next search: typing
+the predicted word continues the search where it left off instead of starting
+over. Each call stops at a hard time budget, or the caller's deadline if that
+comes first, and returns what the finished levels allow, flagged partial.
+"""
+import math
+
+from engine.deadline import Deadline, Suggestions
+
+# Expansion memo entries kept before the memo is cleared
+MEMO_SIZE = 4096
+
+
+class PhraseSearch:
+    """Beam search state carried across the keystrokes of one input stream."""
+
+    def __init__(self, model, beam_width=8, max_words=4, min_words=2, budget=0.005):
+        """
+        Args:
+            model (MappedModel): The model to query.
+            beam_width (int): Hypotheses kept per phrase length.
+            max_words (int): Longest phrase suggested.
+            min_words (int): Shortest phrase suggested.
+            budget (float): Seconds a single call may spend searching.
+        """
+        self.model = model
+        self.beam_width = beam_width
+        self.max_words = max_words
+        self.min_words = min_words
+        self.budget = budget
+        self._memo = {}
+        self._is_word = {}
+        self.reset()
+
+    def reset(self, context_ids=()):
+        """Start over after the given context word ids (None for unknown words)."""
+        self.context_ids = list(context_ids)[-max(self.model.n - 1, 0):] if self.model.n > 1 else []
+        self._seeds = [[] for _ in range(self.max_words + 1)]
+        self._levels = None
+        self.partial = False
+
+    def advance(self, word_id):
+        """
+        Commit one word: hypotheses that predicted it become seeds of the next search.
+
+        Args:
+            word_id (int): Id of the committed word, None if unknown.
+        """
+        seeds = [[] for _ in range(self.max_words + 1)]
+        for length, level in enumerate(self._levels or []):
+            if length >= 2:
+                seeds[length - 1] = [(score - steps[0], words[1:], steps[1:]) for score, words, steps in level
+                                     if words[0] == word_id]
+        self.reset(self.context_ids + [word_id])
+        self._seeds = seeds
+
+    def _expand(self, words):
+        """The next words after context + words, as (log-probability, id) pairs, memoized by n-gram context."""
+        history = (self.context_ids + list(words))[-(self.model.n - 1):]
+        key = tuple(history)
+        expansion = self._memo.get(key)
+        if expansion is None:
+            last_id = history[-1] if history else None
+            ids, scores = self.model.next_word_scores(self.model.context_index(history), last_id,
+                                                      2 * self.beam_width)
+            expansion = [(math.log(score), word_id) for word_id, score in zip(ids, scores)
+                         if score > 0 and self._word_like(word_id)][:self.beam_width]
+            if len(self._memo) >= MEMO_SIZE:
+                self._memo.clear()
+            self._memo[key] = expansion
+        return expansion
+
+    def _word_like(self, word_id):
+        """Punctuation tokens end a phrase rather than continue it."""
+        is_word = self._is_word.get(word_id)
+        if is_word is None:
+            is_word = self._is_word[word_id] = any(char.isalnum() for char in self.model.word(word_id))
+        return is_word
+
+    def search(self, deadline=None):
+        """
+        Fill the levels up to max_words, or until the time budget or deadline runs out.
+
+        Args:
+            deadline (Deadline): Optional limit on top of the time budget.
+
+        Returns:
+            list: Levels of (log-probability, word ids, per-word log-probabilities)
+            hypotheses, best-first; level L holds L-word hypotheses and only
+            finished levels are included.
+        """
+        budget = Deadline(self.budget)
+        self.partial = False
+        levels = [[(0.0, (), ())]]
+        for length in range(1, self.max_words + 1):
+            candidates = {words: (score, words, steps) for score, words, steps in self._seeds[length]}
+            for score, words, steps in levels[-1]:
+                if budget.expired() or (deadline is not None and deadline.expired()):
+                    self.partial = True
+                    self._levels = levels
+                    return levels
+                for log_prob, word_id in self._expand(words):
+                    extended = words + (word_id,)
+                    if extended not in candidates:
+                        candidates[extended] = (score + log_prob, extended, steps + (log_prob,))
+            levels.append(sorted(candidates.values(),
+                                 key=lambda hypothesis: (-hypothesis[0], hypothesis[1]))[:self.beam_width])
+        self._levels = levels
+        return levels
+
+    def phrase_ids(self, top_k=3, deadline=None):
+        """
+        Ranked phrase continuations of the current context.
+
+        Args:
+            top_k (int): Number of phrases to return.
+            deadline (Deadline): Optional limit on top of the time budget.
+
+        Returns:
+            list: Up to top_k tuples of word ids, best per-word log-probability first;
+            a phrase starting with the same word as a better one is skipped, so
+            the suggestions differ from the first word on.
+        """
+        levels = self.search(deadline)
+        ranked = sorted(((score / length, words) for length in range(self.min_words, len(levels))
+                         for score, words, _ in levels[length]), key=lambda phrase: (-phrase[0], phrase[1]))
+        chosen = {}
+        for _, words in ranked:
+            if words[0] not in chosen:
+                chosen[words[0]] = words
+                if len(chosen) == top_k:
+                    break
+        return list(chosen.values())
+
+    def phrases(self, top_k=3, deadline=None):
+        """Ranked phrase continuations as lists of words, flagged partial if the search was cut short."""
+        ids = self.phrase_ids(top_k, deadline)
+        return Suggestions((self.model.words(words) for words in ids), self.partial)
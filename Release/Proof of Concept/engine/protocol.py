@@ -0,0 +1,79 @@
+"""
+Wire format shared by the prediction daemon (engine.server) and its client (engine.client).
+
+Every message is one frame: a fixed little-endian header followed by a body.
+
+    request:  <I body length> <I request id> <B opcode> <B top_k>  body
+    response: <I body length> <I request id> <B status>            body
+
+Bodies are UTF-8 words joined by NUL bytes, which never occur in words:
+COMPLETE sends the prefix followed by the context words, NEXT sends the context
+words, FUZZY sends the edit budget (as a decimal number), the prefix and the
+context words, and an OK response carries the ranked suggestions. STATS answers with a
+JSON object and ERROR responses with a message. Request ids are chosen by the
+client and echoed back, so a client may pipeline many requests on one
+connection and match the responses as they arrive.
+"""
+import os
+import struct
+import sys
+import tempfile
+
+REQUEST_HEADER = struct.Struct('<IIBB')
+RESPONSE_HEADER = struct.Struct('<IIB')
+
+OP_PING = 0
+OP_COMPLETE = 1
+OP_NEXT = 2
+OP_STATS = 3
+OP_FUZZY = 4
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+SEPARATOR = b'\0'
+MAX_BODY = 1 << 20
+
+# Windows has no AF_UNIX support in asyncio, so the daemon listens on loopback there
+DEFAULT_ADDRESS = (('127.0.0.1', 47615) if sys.platform == 'win32'
+                   else os.path.join(tempfile.gettempdir(), 'osk-predict.sock'))
+
+
+class ProtocolError(Exception):
+    """Malformed frame or a request the daemon refused."""
+
+
+def parse_address(text):
+    """'host:port' for TCP, anything else is a Unix socket path."""
+    host, sep, port = text.rpartition(':')
+    if sep and port.isdigit() and os.sep not in host:
+        return host, int(port)
+    return text
+
+
+def encode_words(words):
+    return SEPARATOR.join(word.encode('utf-8') for word in words)
+
+
+def decode_words(body):
+    return [word.decode('utf-8') for word in body.split(SEPARATOR)] if body else []
+
+
+def encode_request(request_id, op, top_k=0, words=()):
+    """
+    Args:
+        request_id (int): Echoed back in the response.
+        op (int): One of the OP_* codes.
+        top_k (int): Number of suggestions wanted (0-255).
+        words (iterable): COMPLETE: [prefix, *context]; NEXT: context;
+            FUZZY: [str(max_edits), prefix, *context].
+
+    Returns:
+        bytes: The complete frame.
+    """
+    body = encode_words(words)
+    return REQUEST_HEADER.pack(len(body), request_id, op, top_k) + body
+
+
+def encode_response(request_id, status, body):
+    return RESPONSE_HEADER.pack(len(body), request_id, status) + body
@@ -0,0 +1,148 @@
+"""
+Named models loaded on demand, within a memory budget.
+
+A ModelRegistry maps names to model files (by default <name>.osk in the models
+directory, or any path given to register) and opens each one the first time it
+is asked for. Loaded models stay resident, so switching back to one used
+recently costs a dictionary lookup, not a trip to disk. Each model's resident
+size (MappedModel.resident_bytes: the mapping plus whatever it has decoded) is
+tracked, and when the total exceeds the budget the least recently used models
+are unloaded until it fits again. The model just asked for is never evicted,
+even if it alone is over budget.
+
+Unloading only drops the registry's reference: a session or cache still holding
+the model keeps it usable, and the file is unmapped once the last user lets go.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from engine.model_format import MappedModel
+
+# Extension of model files found by name in the models directory
+MODEL_EXTENSION = '.osk'
+
+
+class ModelRegistry:
+    """Thread-safe LRU set of loaded models, bounded by their resident size."""
+
+    def __init__(self, directory, budget_bytes=512 * 1024 * 1024, loader=MappedModel.open):
+        """
+        Args:
+            directory (str): Where <name>.osk files are looked up.
+            budget_bytes (int): Resident bytes of all loaded models before the least
+                recently used ones are unloaded.
+            loader (callable): loader(path) -> MappedModel.
+        """
+        if budget_bytes < 0:
+            raise ValueError("budget_bytes must not be negative")
+        self.directory = directory
+        self.budget_bytes = budget_bytes
+        self._loader = loader
+        self._paths = {}
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def register(self, name, path):
+        """Name a model file outside the models directory (or override the default path)."""
+        with self._lock:
+            self._paths[name] = path
+
+    def path(self, name):
+        """The file a model name refers to."""
+        return self._paths.get(name) or os.path.join(self.directory, name + MODEL_EXTENSION)
+
+    def available(self):
+        """Names of every registered model and model file in the directory."""
+        names = set(self._paths)
+        if os.path.isdir(self.directory):
+            names.update(os.path.splitext(entry)[0] for entry in os.listdir(self.directory)
+                         if entry.endswith(MODEL_EXTENSION))
+        return sorted(names)
+
+    def get(self, name):
+        """
+        The named model, loading it on first use and marking it most recently used.
+
+        Raises:
+            KeyError: If name is neither registered nor a file in the directory.
+        """
+        with self._lock:
+            model = self._models.get(name)
+            if model is not None:
+                self._models.move_to_end(name)
+                self.hits += 1
+                self._evict(keep=name)
+                return model
+            path = self.path(name)
+            if name not in self._paths and not os.path.exists(path):
+                raise KeyError(f"no model named {name!r} (looked for {path})")
+
+        model = self._loader(path)
+
+        with self._lock:
+            # Another thread may have loaded it meanwhile; keep the first one
+            current = self._models.setdefault(name, model)
+            if current is model:
+                self.loads += 1
+            self._models.move_to_end(name)
+            self._evict(keep=name)
+            return current
+
+    def reload(self, name):
+        """Open the named model from disk again (e.g. after a rebuild), replacing the loaded copy."""
+        with self._lock:
+            self._models.pop(name, None)
+        return self.get(name)
+
+    def unload(self, name):
+        """Drop the named model if it is loaded."""
+        with self._lock:
+            self._models.pop(name, None)
+
+    def set_budget(self, budget_bytes):
+        """Change the memory budget, unloading models right away if it shrank."""
+        with self._lock:
+            self.budget_bytes = budget_bytes
+            self._evict()
+
+    def loaded(self):
+        """Names of the loaded models, least recently used first."""
+        with self._lock:
+            return list(self._models)
+
+    def _evict(self, keep=None):
+        # Sizes are read on every check: a model grows when it decodes its vocabulary
+        resident = sum(model.resident_bytes for model in self._models.values())
+        for name in list(self._models):
+            if resident <= self.budget_bytes:
+                break
+            if name != keep:
+                resident -= self._models.pop(name).resident_bytes
+                self.evictions += 1
+
+    def stats(self):
+        """
+        Returns:
+            dict: budget_bytes, resident_bytes, per-model resident bytes (least
+            recently used first), hits, loads and evictions.
+        """
+        with self._lock:
+            models = {name: model.resident_bytes for name, model in self._models.items()}
+            return {
+                'budget_bytes': self.budget_bytes,
+                'resident_bytes': sum(models.values()),
+                'models': models,
+                'hits': self.hits,
+                'loads': self.loads,
+                'evictions': self.evictions,
+            }
+
+    def __contains__(self, name):
+        return name in self._models
+
+    def __len__(self):
+        return len(self._models)
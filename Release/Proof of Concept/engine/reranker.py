@@ -0,0 +1,242 @@
+"""
+Two-stage prediction: a small neural reranker over the n-gram engine's shortlist.
+
+Scoring the whole vocabulary with a neural model is too slow on CPU, so the
+n-gram/trie engine stays the first stage: it shortlists SHORTLIST candidates
+(next words, or completions of the prefix) as usual. The second stage scores
+only those, in one batched forward pass:
+
+    h = tanh(W [E(w_-C), ..., E(w_-1)] + b)
+    score(c) = h . U(c) + u(c) + a_task * log P_ngram(c)
+
+where E and U embed the reranker's own vocabulary (words, not model ids, so it
+works with any model built from the same language) and the first-stage
+log-score is an input, so the reranker only has to learn corrections to it.
+Words outside its vocabulary share one embedding. The weights are trained by
+engine.train_reranker and stored in an .npz file.
+
+Queries without context keep the first-stage ranking: the encoder would only
+see padding, and the n-gram ranking of a bare prefix is already its frequency
+order.
+
+A caller with a deadline (see engine.deadline) gives the rerank a time budget
+too. The forward pass cannot be interrupted, so the reranker keeps a running
+estimate of its cost and returns the first-stage ranking straight away while
+the estimate is over budget, and also when a pass overran it. Either way the
+result is flagged partial, so result caches do not keep it and a UI can ask
+again without a deadline to refine it; without one, the rerank always runs.
+The deadline bounds the first stage as usual.
+"""
+import threading
+import time
+import weakref
+
+import numpy as np
+
+from engine.deadline import Suggestions
+
+# Candidates the first stage hands to the reranker
+SHORTLIST = 50
+
+# Seconds the second stage may take, when the caller has a deadline, before the
+# first-stage ranking is returned instead
+RERANK_BUDGET = 0.004
+
+# Reranker rows of the out-of-vocabulary word and of the padding before a sentence starts
+UNKNOWN, PADDING = 0, 1
+
+# Tasks, each with its own weight on the first-stage score
+NEXT_WORD, COMPLETION = 0, 1
+
+# Floor of first-stage scores before taking logs
+MIN_SCORE = 1e-12
+
+
+class Reranker:
+    """Context encoder and candidate embeddings scoring a shortlist in one pass."""
+
+    def __init__(self, words, params, context_size):
+        """
+        Args:
+            words (list): Vocabulary; row i + 2 of the embeddings is words[i].
+            params (dict): Arrays E (V x d), W (C*d x H), b (H), U (V x H), u (V), a (2).
+            context_size (int): Previous words read (C).
+        """
+        self.words = list(words)
+        self.index = {word: i + 2 for i, word in enumerate(self.words)}
+        self.params = params
+        self.context_size = context_size
+        self._rows = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self.forward_seconds = 0.0
+        self.reranked = 0
+        self.skipped = 0
+        self.overran = 0
+
+    @classmethod
+    def load(cls, path):
+        """Read a reranker saved by save()."""
+        with np.load(path) as data:
+            words = bytes(data['words']).decode('utf-8').split('\n') if len(data['words']) else []
+            params = {name: data[name] for name in ('E', 'W', 'b', 'U', 'u', 'a')}
+            return cls(words, params, int(data['context_size']))
+
+    def save(self, path):
+        """Write the vocabulary and weights (as float32) to an .npz file."""
+        words = np.frombuffer('\n'.join(self.words).encode('utf-8'), dtype=np.uint8)
+        params = {name: value.astype(np.float32) for name, value in self.params.items()}
+        with open(path, 'wb') as f:
+            np.savez(f, words=words, context_size=self.context_size, **params)
+
+    def rows(self, words):
+        """Embedding rows of words (UNKNOWN for those outside the vocabulary)."""
+        return np.array([self.index.get(word, UNKNOWN) for word in words], dtype=np.int64)
+
+    def model_rows(self, model):
+        """Embedding row of every id of a model, mapped once per model."""
+        rows = self._rows.get(model)
+        if rows is None:
+            rows = self._rows[model] = self.rows(model.vocabulary())
+        return rows
+
+    def context_rows(self, context):
+        """Rows of the last context_size words, padded on the left at the start of a sentence."""
+        context = list(context[-self.context_size:]) if self.context_size else []
+        return np.concatenate([np.full(self.context_size - len(context), PADDING, dtype=np.int64),
+                               self.rows(context)])
+
+    def scores(self, context_rows, candidate_rows, first_scores, task):
+        """
+        The forward pass over a batch of queries with shortlists of equal length.
+
+        Args:
+            context_rows (ndarray): B x C context rows.
+            candidate_rows (ndarray): B x K candidate rows.
+            first_scores (ndarray): B x K first-stage scores.
+            task (int): NEXT_WORD or COMPLETION.
+
+        Returns:
+            tuple: (B x K scores, B x H hidden states).
+        """
+        p = self.params
+        x = p['E'][context_rows].reshape(len(context_rows), -1)
+        hidden = np.tanh(x @ p['W'] + p['b'])
+        scores = np.einsum('bh,bkh->bk', hidden, p['U'][candidate_rows]) + p['u'][candidate_rows]
+        return scores + p['a'][task] * np.log(np.maximum(first_scores, MIN_SCORE)), hidden
+
+    def rank(self, context, candidate_rows, first_scores, task, budget=None):
+        """
+        Positions of the shortlist, best-first, or None to keep the first-stage order.
+
+        Args:
+            context (list): Previous words.
+            candidate_rows (ndarray): Rows of the shortlisted candidates.
+            first_scores (list): Their first-stage scores.
+            task (int): NEXT_WORD or COMPLETION.
+            budget (float): Seconds allowed; None for no limit.
+        """
+        if budget is not None and self.forward_seconds > budget:
+            with self._lock:
+                self.skipped += 1
+                # Let the estimate decay so a one-off slow pass does not disable reranking
+                self.forward_seconds *= 0.9
+            return None
+        start = time.perf_counter()
+        scores, _ = self.scores(self.context_rows(context)[None], candidate_rows[None],
+                                np.asarray(first_scores, dtype=np.float64)[None], task)
+        order = np.argsort(-scores[0], kind='stable')
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.forward_seconds = elapsed if not self.reranked else 0.9 * self.forward_seconds + 0.1 * elapsed
+            if budget is not None and elapsed > budget:
+                self.overran += 1
+                return None
+            self.reranked += 1
+        return order.tolist()
+
+    def stats(self):
+        """
+        Returns:
+            dict: reranked, skipped (estimated over budget), overran (over budget
+            after the pass) and the running forward-pass estimate in seconds.
+        """
+        with self._lock:
+            return {'reranked': self.reranked, 'skipped': self.skipped, 'overran': self.overran,
+                    'forward_seconds': self.forward_seconds}
+
+
+def next_word_shortlist(model, context_index, last_id, shortlist=SHORTLIST):
+    """First stage of next-word prediction: (ids, scores), best-first."""
+    return model.next_word_scores(context_index, last_id, shortlist)
+
+
+def completion_shortlist(model, node, context_index, shortlist=SHORTLIST, deadline=None):
+    """First stage of completion: (ids, scores) under a trie node, in completion_ids order."""
+    ids = list(model.completion_ids(node, context_index, shortlist, deadline))
+    return ids, completion_scores(model, context_index, ids)
+
+
+def completion_scores(model, context_index, ids):
+    """First-stage scores of completion ids: their successor probability, or their frequency's weighted by the backoff."""
+    total = model.total_tokens
+    weight = model.ctx_backoff[context_index] if context_index >= 0 else 1.0
+    return [max(model.successor_probability(context_index, word_id), weight * model.freq[word_id] / total)
+            for word_id in ids]
+
+
+def rerank_ids(model, reranker, context, ids, scores, task, top_k, budget=None):
+    """
+    The second stage: the shortlist reordered by the reranker, or kept in order if over budget.
+
+    Args:
+        model (MappedModel): The model the ids belong to.
+        reranker (Reranker): The second stage.
+        context (list): Previous words.
+        ids (list): The first-stage shortlist, best-first.
+        scores (list): Its first-stage scores.
+        task (int): NEXT_WORD or COMPLETION.
+        top_k (int): Number of ids to return.
+        budget (float): Seconds the reranker may take; None (without a deadline) for no limit.
+
+    Returns:
+        Suggestions: Up to top_k ids, best-first, flagged partial if they are the
+        first-stage ranking because the reranker was over budget.
+    """
+    if len(ids) < 2 or not context:
+        return Suggestions(ids[:top_k])
+    order = reranker.rank(context, reranker.model_rows(model)[np.asarray(ids, dtype=np.int64)], scores,
+                          task, budget)
+    if order is None:
+        return Suggestions(ids[:top_k], partial=True)
+    return Suggestions(ids[i] for i in order[:top_k])
+
+
+def two_stage_next_words(model, reranker, context, top_k=5, budget=None):
+    """Next words after context: the n-gram shortlist, reranked (a Suggestions list)."""
+    context_ids = model.context_ids(context)
+    last_id = context_ids[-1] if context_ids else None
+    ids, scores = next_word_shortlist(model, model.context_index(context_ids), last_id)
+    ids = rerank_ids(model, reranker, context, ids, scores, NEXT_WORD, top_k, budget)
+    return Suggestions(model.words(ids), ids.partial)
+
+
+def two_stage_complete(model, reranker, prefix, context, top_k=3, deadline=None, budget=None, narrowing=None):
+    """
+    Completions of prefix in context: the trie/n-gram shortlist, reranked (a Suggestions list).
+
+    Given a NarrowingCompleter (see engine.narrowing), the shortlist is filtered
+    from the previous keystroke's when the prefix grows.
+    """
+    if not prefix:
+        return []
+    context_index = model.context_index(model.context_ids(context)) if context else -1
+    if narrowing is not None:
+        ids = list(narrowing.completion_ids(model, prefix, context, SHORTLIST, deadline))
+        scores = completion_scores(model, context_index, ids)
+    else:
+        node = model.walk(prefix.encode('utf-8'))
+        if node < 0:
+            return []
+        ids, scores = completion_shortlist(model, node, context_index, deadline=deadline)
+    ids = rerank_ids(model, reranker, context, ids, scores, COMPLETION, top_k, budget)
+    return Suggestions(model.words(ids), ids.partial)
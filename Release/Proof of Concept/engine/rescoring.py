@@ -0,0 +1,231 @@
+"""
+N-best rescoring of speech transcripts with the n-gram model.
+
+A speech recognizer hands over its n best hypotheses for an utterance, often
+with a score of its own for each. They are reranked by
+
+    score = asr_score + LM_WEIGHT * log P_model(words) + WORD_BONUS * len(words)
+
+where log P_model is the backoff log-probability the model gives the words
+(the same one engine.kneser_ney.perplexity measures), read from the words the
+user committed before the utterance, and the word bonus offsets the model's
+preference for short hypotheses.
+
+The hypotheses of an n-best list share most of their words, so the list is
+split into whitespace-separated chunks in one go, and only the distinct chunks
+are tokenized and looked up in the vocabulary; the chunks are expanded to word
+ids with array gathers. The scoring is one vectorized pass over all the
+hypotheses: their word ids are laid out as one
+array with the previous two ids beside each, contexts are resolved with one
+searchsorted over ctx_keys, the trigram and bigram probabilities with one
+searchsorted each over (context, word) keys, and the log-probabilities are
+summed per hypothesis with bincount. The key arrays are derived from the
+model's CSR tables once per model.
+"""
+import re
+import weakref
+from itertools import chain, repeat
+
+import numpy as np
+
+# Weight of the model's log-probability against the recognizer's score (tuned with
+# benchmarks/bench_rescoring.py: a diary-sized model only helps as a tie-breaker)
+LM_WEIGHT = 0.2
+
+# Log-score added per word, so the model does not simply prefer shorter hypotheses
+WORD_BONUS = 1.0
+
+# Probability of a word outside the model's vocabulary
+UNKNOWN_PROBABILITY = 1e-7
+
+# Tokens like the corpus's: words with inner hyphens, colons, dots or commas
+# ("g-force", "6:30", "1,2,3"), and runs of other punctuation
+TOKEN = re.compile(r"\w+(?:[-:.,]\w+)*|[^\w\s]+")
+
+# Chunk put before every transcript when a list is split in one go (not whitespace, not typed)
+SEPARATOR = '\x00'
+
+_lookups = weakref.WeakKeyDictionary()
+
+
+def tokenize(text):
+    """Split a transcript into lowercase tokens like those the model was built from."""
+    return TOKEN.findall(text.lower())
+
+
+class _Lookups:
+    """Sorted (context, word) keys of a model's trigram and bigram probabilities."""
+
+    def __init__(self, model):
+        vocab_size = np.uint64(model.vocab_size)
+        succ_off = model.array('succ_off')
+        contexts = np.repeat(np.arange(len(succ_off) - 1, dtype=np.uint64), np.diff(succ_off))
+        # lex_ids lists every context's successors in id order, so these keys are sorted already
+        self.tri_keys = contexts * vocab_size + model.array('lex_ids')
+        starts = np.repeat(succ_off[:-1].astype(np.int64), np.diff(succ_off))
+        self.tri_probs = model.array('succ_probs')[starts + model.array('lex_rank')]
+
+        bi_off = model.array('bi_off')
+        previous = np.repeat(np.arange(len(bi_off) - 1, dtype=np.uint64), np.diff(bi_off))
+        keys = previous * vocab_size + model.array('bi_ids')
+        order = np.argsort(keys, kind='stable')
+        self.bi_keys = keys[order]
+        self.bi_probs = model.array('bi_probs')[order]
+
+    @classmethod
+    def of(cls, model):
+        lookups = _lookups.get(model)
+        if lookups is None:
+            lookups = _lookups[model] = cls(model)
+        return lookups
+
+
+def _find(keys, queries, valid):
+    """Positions of queries in sorted keys and whether each was found (only where valid)."""
+    if not len(keys):
+        return np.zeros(len(queries), dtype=np.int64), np.zeros(len(queries), dtype=bool)
+    positions = np.minimum(np.searchsorted(keys, queries), len(keys) - 1)
+    return positions, valid & (keys[positions] == queries)
+
+
+def encode(model, texts, context=()):
+    """
+    Word ids of transcripts, each after the last n-1 context words.
+
+    Args:
+        model (MappedModel): The n-gram model.
+        texts (list): Transcripts (strings).
+        context (list): Words before every transcript.
+
+    Returns:
+        tuple: (flat ids, -1 for unknown words; the length of every sequence,
+        context included; the number of context words at the start of each).
+    """
+    word_index = model.word_index()
+    context = list(context[-(model.n - 1):]) if model.n > 1 else []
+    if not texts:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), len(context)
+    chunks = (SEPARATOR + ' ' + f' {SEPARATOR} '.join(texts).lower()).split()
+    # Number the distinct chunks; the separator is chunk 0 and stands for the context words
+    numbers = {chunk: i for i, chunk in enumerate(dict.fromkeys(chunks))}
+    codes = np.fromiter(map(numbers.__getitem__, chunks), dtype=np.int64, count=len(chunks))
+    table = [[word_index.get(word, -1) for word in context]]
+    table += [[word_index.get(token, -1) for token in TOKEN.findall(chunk)] for chunk in list(numbers)[1:]]
+
+    # Gather the ids of every chunk from the flattened table
+    counts = np.fromiter(map(len, table), dtype=np.int64, count=len(table))
+    starts = np.cumsum(counts) - counts
+    flat = np.fromiter(chain.from_iterable(table), dtype=np.int64, count=int(counts.sum()))
+    chunk_counts = counts[codes]
+    offsets = np.arange(int(chunk_counts.sum())) - np.repeat(np.cumsum(chunk_counts) - chunk_counts, chunk_counts)
+    ids = flat[np.repeat(starts[codes], chunk_counts) + offsets]
+    owner = np.cumsum(codes == 0) - 1
+    lengths = np.bincount(owner, weights=chunk_counts, minlength=len(texts)).astype(np.int64)
+    return ids, lengths, len(context)
+
+
+def log_probabilities(model, hypotheses, context=()):
+    """
+    log P_model of every token list, in one vectorized pass.
+
+    Args:
+        model (MappedModel): The n-gram model (order 3).
+        hypotheses (list): Token lists.
+        context (list): Words before every hypothesis (only the last two are read).
+
+    Returns:
+        ndarray: One natural-log probability per hypothesis.
+    """
+    word_index = model.word_index()
+    context = list(context[-(model.n - 1):]) if model.n > 1 else []
+    lengths = np.fromiter((len(context) + len(tokens) for tokens in hypotheses), dtype=np.int64,
+                          count=len(hypotheses))
+    words = chain.from_iterable(chain(context, tokens) for tokens in hypotheses)
+    ids = np.fromiter(map(word_index.get, words, repeat(-1)), dtype=np.int64, count=int(lengths.sum()))
+    return id_log_probabilities(model, ids, lengths, len(context))
+
+
+def id_log_probabilities(model, ids, lengths, context_size):
+    """
+    log P_model of every id sequence laid out in one array.
+
+    Args:
+        model (MappedModel): The n-gram model (order 3).
+        ids (ndarray): The sequences' word ids one after the other, -1 for unknown words.
+        lengths (ndarray): Length of every sequence.
+        context_size (int): Leading ids of every sequence that are context, not scored.
+
+    Returns:
+        ndarray: One natural-log probability per sequence.
+    """
+    total = len(ids)
+    # Position of every id within its sequence (the context comes first)
+    owner = np.repeat(np.arange(len(lengths)), lengths)
+    position = np.arange(total) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    previous = np.where(position >= 1, np.roll(ids, 1), -1)
+    before = np.where(position >= 2, np.roll(ids, 2), -1)
+    known = ids >= 0
+
+    # Trigram contexts: both previous words known
+    ctx_keys = model.array('ctx_keys')
+    has_context = (before >= 0) & (previous >= 0)
+    packed = (before.astype(np.uint64) << np.uint64(32)) | previous.astype(np.uint64)
+    context_index, has_context = _find(ctx_keys, packed, has_context)
+
+    lookups = _Lookups.of(model)
+    vocab_size = np.uint64(model.vocab_size)
+    word_ids = np.maximum(ids, 0).astype(np.uint64)
+    tri_at, tri_hit = _find(lookups.tri_keys, context_index.astype(np.uint64) * vocab_size + word_ids,
+                            has_context & known)
+    bi_at, bi_hit = _find(lookups.bi_keys, np.maximum(previous, 0).astype(np.uint64) * vocab_size + word_ids,
+                          (previous >= 0) & known)
+
+    # The first level listing the word, scaled by the backoff weights above it
+    weight = np.where(has_context, model.array('ctx_backoff')[context_index], 1.0)
+    unigram_weight = weight * np.where(previous >= 0, model.array('bi_backoff')[np.maximum(previous, 0)], 1.0)
+    probabilities = np.where(tri_hit, lookups.tri_probs[tri_at],
+                             np.where(bi_hit, lookups.bi_probs[bi_at] * weight,
+                                      model.array('uni_probs')[np.maximum(ids, 0)] * unigram_weight))
+    probabilities = np.where(known, probabilities, UNKNOWN_PROBABILITY)
+    scored = position >= context_size
+    logs = np.log(np.maximum(probabilities[scored], np.finfo(np.float32).tiny))
+    return np.bincount(owner[scored], weights=logs, minlength=len(lengths))
+
+
+def rescore_scores(model, hypotheses, asr_scores=None, context=(), lm_weight=LM_WEIGHT,
+                   word_bonus=WORD_BONUS):
+    """
+    Rerank an n-best list of transcripts.
+
+    Args:
+        model (MappedModel): The n-gram model.
+        hypotheses (list): Transcripts (strings), in any order.
+        asr_scores (list): The recognizer's log-scores, one per hypothesis; zeros if None.
+        context (list): Words committed before the utterance.
+        lm_weight (float): Weight of the model's log-probability.
+        word_bonus (float): Log-score added per word.
+
+    Returns:
+        tuple: (hypotheses, scores), best-first; ties keep the recognizer's order.
+        Empty or whitespace-only transcripts are dropped: they would score 0.0,
+        above any transcript with words in it.
+    """
+    kept = [i for i, hypothesis in enumerate(hypotheses) if hypothesis.strip()]
+    if len(kept) < len(hypotheses):
+        hypotheses = [hypotheses[i] for i in kept]
+        if asr_scores is not None:
+            asr_scores = [asr_scores[i] for i in kept]
+    if not hypotheses:
+        return [], []
+    ids, lengths, context_size = encode(model, hypotheses, context)
+    scores = lm_weight * id_log_probabilities(model, ids, lengths, context_size)
+    scores += word_bonus * (lengths - context_size)
+    if asr_scores is not None:
+        scores += np.asarray(asr_scores, dtype=np.float64)
+    order = np.argsort(-scores, kind='stable')
+    return [hypotheses[i] for i in order], scores[order].tolist()
+
+
+def rescore(model, hypotheses, asr_scores=None, context=()):
+    """rescore_scores without the scores: the hypotheses, best-first."""
+    return rescore_scores(model, hypotheses, asr_scores, context)[0]
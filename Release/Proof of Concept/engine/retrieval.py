@@ -0,0 +1,335 @@
+"""
+Retrieval-augmented next words: past diary sentences similar to the context.
+
+The diary's sentences are embedded once, offline (engine.build_diary_index),
+into a flat index: one unit-length vector per sentence in an .npy file, next to
+the sentences' tokens (and optionally their text) as UTF-8 blobs with an offsets
+array each. Every file is memory-mapped, so opening the index reads nothing but
+its metadata, and a sentence is decoded only when a query fetches it. At query time the last
+QUERY_WORDS committed words are embedded the same way and the RETRIEVED most
+similar sentences (highest inner product, as a FAISS IndexFlatIP would find
+them) are fetched. Wherever the last committed word occurs in one of them, the
+word that followed it there gets a vote worth the sentence's similarity, more
+when the words before it match the context too.
+
+The votes make a RetrievalLayer, which quacks like an engine.adaptation layer
+(weight, probability, candidates), so sessions mix it into their rankings the
+same way:
+
+    P(w) = (1 - lambda) * P_model(w | context) + lambda * P_retrieved(w)
+
+with lambda up to RETRIEVAL_WEIGHT, scaled by the best similarity that voted.
+The layer is refreshed once per committed word, not per keystroke, and the scan
+reads SCAN_BLOCK sentences at a time and stops at its deadline, so a lookup is
+bounded however large the diary grows; a scan cut short leaves the next one to
+start where it stopped.
+
+On held-out sentences (benchmarks/bench_retrieval.py) the layer only helps with
+text the diary already holds; on new text it gains nothing, so sessions leave
+it off unless asked (new_session(retrieve=True)).
+
+Embedders are pluggable: anything with a name, a dim and embed(token lists)
+returning unit-length float32 rows. HashingEmbedder needs no model or network:
+it hashes words and word pairs into a fixed number of signed buckets. The
+index records the embedder it was built with, and opening it with another one
+is an error.
+"""
+import json
+import os
+import zlib
+
+import numpy as np
+
+from engine.deadline import Deadline
+
+# Committed words embedded as the query
+QUERY_WORDS = 6
+
+# Similar sentences fetched per query
+RETRIEVED = 8
+
+# Share of the mix the retrieved words get when a sentence matches exactly
+RETRIEVAL_WEIGHT = 0.2
+
+# Sentences scanned between deadline checks
+SCAN_BLOCK = 1024
+
+# Seconds a refresh may spend scanning the index
+RETRIEVAL_BUDGET = 0.002
+
+# Files of an index directory; the string tables are <name>.npy (UTF-8 bytes) and <name>_offsets.npy
+EMBEDDINGS_NAME, META_NAME = 'embeddings.npy', 'meta.json'
+TOKENS_NAME, TEXTS_NAME = 'tokens', 'texts'
+
+# Separates the tokens of a sentence in the tokens blob
+TOKEN_SEPARATOR = '\0'
+
+
+class HashingEmbedder:
+    """Signed feature hashing of the words and word pairs of a text, L2-normalized."""
+
+    name = 'hashing'
+
+    def __init__(self, dim=256):
+        """
+        Args:
+            dim (int): Number of buckets (the vector size).
+        """
+        self.dim = dim
+
+    def features(self, words):
+        """Words with a letter or digit, and the pairs of consecutive ones."""
+        words = [word for word in words if any(char.isalnum() for char in word)]
+        return words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+    def embed(self, texts):
+        """
+        Args:
+            texts (list): Token lists.
+
+        Returns:
+            ndarray: len(texts) x dim float32 rows of unit length (zero for texts without words).
+        """
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, words in enumerate(texts):
+            for feature in self.features(words):
+                # crc32 rather than hash(), which changes between processes
+                code = zlib.crc32(feature.encode('utf-8'))
+                vectors[row, code % self.dim] += 1 if code & 0x80000000 else -1
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms > 0, norms, 1)
+
+
+# Embedders an index can be reopened with by name
+EMBEDDERS = {HashingEmbedder.name: HashingEmbedder}
+
+
+class MappedStrings:
+    """A list of strings in a memory-mapped UTF-8 blob, decoded one at a time."""
+
+    def __init__(self, data, offsets, separator=None):
+        """
+        Args:
+            data (ndarray): uint8 bytes of every string, back to back.
+            offsets (ndarray): N + 1 byte offsets into data.
+            separator (str): If given, each string is split on it into a list.
+        """
+        self.data = data
+        self.offsets = offsets
+        self.separator = separator
+
+    @staticmethod
+    def write(directory, name, strings):
+        """Save strings as name.npy and name_offsets.npy in directory."""
+        encoded = [string.encode('utf-8') for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(string) for string in encoded], out=offsets[1:])
+        np.save(os.path.join(directory, f'{name}.npy'), np.frombuffer(b''.join(encoded), dtype=np.uint8))
+        np.save(os.path.join(directory, f'{name}_offsets.npy'), offsets)
+
+    @classmethod
+    def open(cls, directory, name, separator=None):
+        """Map strings saved by write."""
+        return cls(np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r'),
+                   np.load(os.path.join(directory, f'{name}_offsets.npy'), mmap_mode='r'), separator)
+
+    def __getitem__(self, row):
+        text = bytes(self.data[self.offsets[row]:self.offsets[row + 1]]).decode('utf-8')
+        if self.separator is None:
+            return text
+        return text.split(self.separator) if text else []
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+
+def build_index(sentences, directory, embedder=None, texts=None):
+    """
+    Embed sentences and write the index files into directory.
+
+    Args:
+        sentences (list): Token lists.
+        directory (str): Where to write the index (created if missing).
+        embedder: Embeds the sentences; a HashingEmbedder by default.
+        texts (list): The sentences' original text, kept for display; optional.
+
+    Returns:
+        dict: sentences, dim, embedder and bytes of the embeddings.
+
+    Raises:
+        ValueError: If a token contains TOKEN_SEPARATOR.
+    """
+    if any(TOKEN_SEPARATOR in token for sentence in sentences for token in sentence):
+        raise ValueError(f"Tokens must not contain {TOKEN_SEPARATOR!r}")
+    embedder = HashingEmbedder() if embedder is None else embedder
+    os.makedirs(directory, exist_ok=True)
+    embeddings = np.ascontiguousarray(embedder.embed(sentences), dtype=np.float32)
+    np.save(os.path.join(directory, EMBEDDINGS_NAME), embeddings)
+    MappedStrings.write(directory, TOKENS_NAME, (TOKEN_SEPARATOR.join(sentence) for sentence in sentences))
+    if texts is not None:
+        MappedStrings.write(directory, TEXTS_NAME, texts)
+    meta = {'embedder': embedder.name, 'dim': embedder.dim, 'sentences': len(sentences)}
+    with open(os.path.join(directory, META_NAME), 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    return dict(meta, bytes=embeddings.nbytes)
+
+
+class SentenceIndex:
+    """Memory-mapped sentence embeddings with exact inner-product search."""
+
+    def __init__(self, embeddings, sentences, embedder, texts=None):
+        """
+        Args:
+            embeddings (ndarray): N x dim unit-length rows (a memory map when opened).
+            sentences: The N sentences' tokens, indexable by row (a MappedStrings when opened).
+            embedder: The embedder the rows were made with.
+            texts: The sentences' original text, if kept.
+        """
+        self.embeddings = embeddings
+        self.sentences = sentences
+        self.embedder = embedder
+        self.texts = texts
+        # Block the next scan starts at: past the last one a cut-short scan reached
+        self.first_block = 0
+
+    @classmethod
+    def open(cls, directory, embedder=None):
+        """
+        Map an index written by build_index.
+
+        Args:
+            directory (str): The index directory.
+            embedder: The embedder to query with; by default the one named in the
+                index (it must be in EMBEDDERS).
+
+        Raises:
+            ValueError: If the embedder is not the one the index was built with.
+        """
+        with open(os.path.join(directory, META_NAME), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if embedder is None:
+            embedder = EMBEDDERS[meta['embedder']](meta['dim'])
+        if (embedder.name, embedder.dim) != (meta['embedder'], meta['dim']):
+            raise ValueError(f"Index built with {meta['embedder']} ({meta['dim']} dims), "
+                             f"queried with {embedder.name} ({embedder.dim} dims)")
+        embeddings = np.load(os.path.join(directory, EMBEDDINGS_NAME), mmap_mode='r')
+        sentences = MappedStrings.open(directory, TOKENS_NAME, TOKEN_SEPARATOR)
+        texts = None
+        if os.path.exists(os.path.join(directory, f'{TEXTS_NAME}.npy')):
+            texts = MappedStrings.open(directory, TEXTS_NAME)
+        return cls(embeddings, sentences, embedder, texts)
+
+    def search(self, words, top_k=RETRIEVED, deadline=None):
+        """
+        The sentences most similar to a text.
+
+        Args:
+            words (list): The query's tokens.
+            top_k (int): Number of sentences to return.
+            deadline (Deadline): Optional; the scan stops at the first block boundary
+                after it expires, keeping the best sentences seen so far. The next
+                scan then starts at the following block, so scans cut short in a
+                row cover the whole diary in turn rather than its oldest sentences.
+
+        Returns:
+            tuple: (sentence rows, similarities), best-first.
+        """
+        query = self.embedder.embed([words])[0]
+        rows, similarities = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        if not query.any():
+            return rows, similarities
+        blocks = -(-len(self.embeddings) // SCAN_BLOCK)
+        for step in range(blocks):
+            start = (self.first_block + step) % blocks * SCAN_BLOCK
+            block = self.embeddings[start:start + SCAN_BLOCK] @ query
+            if len(block) > top_k:
+                best = np.argpartition(-block, top_k)[:top_k]
+            else:
+                best = np.arange(len(block))
+            rows = np.concatenate([rows, start + best])
+            similarities = np.concatenate([similarities, block[best]])
+            if len(rows) > top_k:
+                keep = np.argpartition(-similarities, top_k)[:top_k]
+                rows, similarities = rows[keep], similarities[keep]
+            if deadline is not None and deadline.expired():
+                self.first_block = (self.first_block + step + 1) % blocks
+                break
+        order = np.lexsort((rows, -similarities))
+        return rows[order], similarities[order]
+
+    def __len__(self):
+        return len(self.sentences)
+
+
+class RetrievalLayer:
+    """Words that followed the context in the most similar diary sentences, as a mixable layer."""
+
+    def __init__(self, index, max_weight=RETRIEVAL_WEIGHT, budget=RETRIEVAL_BUDGET):
+        """
+        Args:
+            index (SentenceIndex): The diary index.
+            max_weight (float): The layer's share of the mix for an exact match.
+            budget (float): Seconds a refresh may spend scanning.
+        """
+        self.index = index
+        self.max_weight = max_weight
+        self.budget = budget
+        self.weight = 0.0
+        self.probabilities = {}
+        self.top = []
+        self.refreshes = 0
+        self.cut_short = 0
+
+    def refresh(self, context):
+        """
+        Fetch the sentences similar to the committed words and count what followed them there.
+
+        Args:
+            context (list): Committed words, oldest first.
+        """
+        self.weight, self.probabilities, self.top = 0.0, {}, []
+        if not context:
+            return
+        deadline = Deadline.start(self.budget)
+        rows, similarities = self.index.search(context[-QUERY_WORDS:], RETRIEVED, deadline)
+        self.refreshes += 1
+        self.cut_short += deadline is not None and deadline.hit
+        votes, best = {}, 0.0
+        for row, similarity in zip(rows.tolist(), similarities.tolist()):
+            if similarity <= 0:
+                continue
+            sentence = self.index.sentences[row]
+            for i in range(1, len(sentence)):
+                if sentence[i - 1] != context[-1]:
+                    continue
+                # One more share of the vote per earlier context word matched too
+                matched = 1
+                while (matched < min(i, len(context), QUERY_WORDS)
+                       and sentence[i - 1 - matched] == context[-1 - matched]):
+                    matched += 1
+                votes[sentence[i]] = votes.get(sentence[i], 0.0) + similarity * matched
+                best = max(best, similarity)
+        total = sum(votes.values())
+        if not total:
+            return
+        self.probabilities = {word: vote / total for word, vote in votes.items()}
+        self.top = sorted(votes, key=lambda word: (-votes[word], word))
+        self.weight = self.max_weight * best
+
+    def probability(self, previous, word):
+        """P_retrieved(word); the context was fixed by the last refresh."""
+        return self.probabilities.get(word, 0.0)
+
+    def candidates(self, previous):
+        """The retrieved words, most voted first."""
+        return self.top
+
+    def stats(self):
+        """
+        Returns:
+            dict: refreshes and how many were cut short by the budget.
+        """
+        return {'refreshes': self.refreshes, 'cut_short': self.cut_short}
+
+    def __bool__(self):
+        return bool(self.probabilities)
@@ -0,0 +1,146 @@
+"""
+Standalone prediction daemon: one warm model shared by every keyboard, script and pipeline.
+
+Usage (from the Proof of Concept directory):
+    python -m engine.server [--address /tmp/osk-predict.sock | 127.0.0.1:47615] [--model Models/model.osk]
+
+The model is mapped once and queries go through the inference_engine facade, so
+all clients also share its LRU result cache. Each connection is an asyncio task
+reading frames (see engine.protocol) and answering them in order; since clients
+may send the next requests before reading the answers, one connection can keep
+the daemon busy without a round trip per query. Predictions take microseconds,
+so they run directly on the event loop.
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import sys
+
+import inference_engine
+from engine.protocol import (DEFAULT_ADDRESS, MAX_BODY, OP_COMPLETE, OP_FUZZY, OP_NEXT, OP_PING, OP_STATS,
+                             REQUEST_HEADER, SEPARATOR, STATUS_ERROR, STATUS_OK, decode_words, encode_response,
+                             encode_words, parse_address)
+
+# Bytes requested from the socket per read; a full pipelined chunk usually arrives in one
+READ_SIZE = 1 << 16
+
+
+def handle_request(op, top_k, body):
+    """
+    Answer one request.
+
+    Returns:
+        tuple: (status, response body)
+    """
+    if op == OP_COMPLETE:
+        prefix, *context = (word.decode('utf-8') for word in body.split(SEPARATOR))
+        return STATUS_OK, encode_words(inference_engine.complete_current_word(prefix, context, top_k))
+    if op == OP_FUZZY:
+        max_edits, prefix, *context = (word.decode('utf-8') for word in body.split(SEPARATOR))
+        return STATUS_OK, encode_words(inference_engine.complete_current_word(prefix, context, top_k, int(max_edits)))
+    if op == OP_NEXT:
+        return STATUS_OK, encode_words(inference_engine.predict_next_word(decode_words(body), top_k))
+    if op == OP_PING:
+        return STATUS_OK, b''
+    if op == OP_STATS:
+        stats = {'model': inference_engine.model.path, 'model_bytes': inference_engine.model.nbytes,
+                 'cache': inference_engine.cache_stats(), 'registry': inference_engine.registry.stats()}
+        return STATUS_OK, json.dumps(stats).encode('utf-8')
+    return STATUS_ERROR, f"unknown opcode {op}".encode('utf-8')
+
+
+async def serve_connection(reader, writer):
+    """
+    Answer frames from one client until it disconnects.
+
+    Whatever has arrived is parsed in one go and all of its answers are written
+    together, so a pipelined burst costs one read and one write, not two awaits
+    per frame.
+    """
+    pending = bytearray()
+    try:
+        while True:
+            data = await reader.read(READ_SIZE)
+            if not data:
+                break
+            pending += data
+            responses = []
+            offset = 0
+            while len(pending) - offset >= REQUEST_HEADER.size:
+                length, request_id, op, top_k = REQUEST_HEADER.unpack_from(pending, offset)
+                if length > MAX_BODY:
+                    writer.write(b''.join(responses) + encode_response(request_id, STATUS_ERROR,
+                                                                       b"request too large"))
+                    return
+                end = offset + REQUEST_HEADER.size + length
+                if end > len(pending):
+                    break
+                try:
+                    status, response = handle_request(op, top_k, bytes(pending[offset + REQUEST_HEADER.size:end]))
+                except ValueError as e:
+                    status, response = STATUS_ERROR, str(e).encode('utf-8')
+                responses.append(encode_response(request_id, status, response))
+                offset = end
+            del pending[:offset]
+            if responses:
+                writer.write(b''.join(responses))
+                await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(address=DEFAULT_ADDRESS):
+    """Listen on a Unix socket path or a (host, port) tuple."""
+    if isinstance(address, tuple):
+        return await asyncio.start_server(serve_connection, *address)
+    if os.path.exists(address):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(address)
+        except OSError:
+            os.unlink(address)  # left behind by a daemon that did not shut down cleanly
+        else:
+            raise OSError(f"a prediction daemon is already listening on {address}")
+        finally:
+            probe.close()
+    return await asyncio.start_unix_server(serve_connection, address)
+
+
+async def run(address):
+    server = await start_server(address)
+    if sys.platform != 'win32':
+        # Let `kill` shut down as cleanly as Ctrl+C, removing the socket file
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    print(f"Prediction daemon serving '{inference_engine.model.path}' on {address}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        if not isinstance(address, tuple) and os.path.exists(address):
+            os.unlink(address)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve predictions from one shared model")
+    parser.add_argument('--address', default=None,
+                        help=f"Unix socket path or host:port (default: {DEFAULT_ADDRESS})")
+    parser.add_argument('--model', default=None, help="model file (default: Models/model.osk)")
+    args = parser.parse_args()
+
+    if args.model:
+        inference_engine.reload_model(args.model)
+    address = parse_address(args.address) if args.address else DEFAULT_ADDRESS
+    try:
+        asyncio.run(run(address))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
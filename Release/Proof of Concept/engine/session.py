@@ -0,0 +1,381 @@
+"""
+Stateful typing session on top of a MappedModel.
+
+Instead of rebuilding the prefix string and walking the trie from the root on
+every keystroke, the session keeps a cursor on the trie node of the word being
+typed and a stack of the nodes it came from. Typing a character follows one
+edge (a few bytes for non-ASCII), backspace pops the stack, and the rolling
+n-gram context is kept as word ids with its context index resolved once per
+word. A keystroke therefore costs O(1) plus reading the top-k, regardless of
+word length or how much has been typed before.
+
+Every query takes an optional deadline in seconds (see engine.deadline); with
+one, the result is a Suggestions list whose partial flag says whether the
+search was cut short.
+
+With speculate=True, the next words after the prefix's likely completions are
+precomputed in the background while it is typed (see engine.speculation), so
+committing one of them is answered from memory.
+
+Given AppLayers, the session learns every committed word into the active
+application's layer and mixes that layer into its suggestions (see
+engine.adaptation); select_app switches layers on a window change. The result
+cache and the speculation hold global-model rankings only: while a layer is
+mixed in, a list MIX_CANDIDATES times longer is read through them and the
+layers are mixed on top (and the mix reranked, given a Reranker). Typo-tolerant
+completions mix the layers into their own search and bypass both.
+
+Given an OnlineLearner, every committed word is also learned into its delta
+layer (mixed in the same way) and its log, and the session moves to the
+learner's latest model at the next commit after a compaction (see
+engine.learning).
+
+Given a Reranker, exact-prefix completions and next words are shortlisted by
+the model and reordered by it once there is context (see engine.reranker),
+speculation included. Only queries with a deadline give it a time budget.
+
+Given a RetrievalLayer, the diary sentences most similar to the committed words
+are fetched once per committed word and the words that followed the context in
+them are mixed in like an adaptation layer (see engine.retrieval).
+"""
+from collections import deque
+
+from engine.adaptation import mixed_completion_scores, mixed_next_word_scores
+from engine.deadline import Deadline, Suggestions
+from engine.fuzzy import fuzzy_completion_ids
+from engine.phrases import PhraseSearch
+from engine.speculation import Speculator
+
+# Cursor value once the typed prefix has left the trie (no completions)
+OFF_TRIE = -1
+
+# Global candidates read per suggestion when adaptation layers are mixed in on
+# top (engine.adaptation reads the model's first 2k)
+MIX_CANDIDATES = 2
+
+# Next words the speculation precomputes per context: enough to mix layers into
+# a bar of five
+SPECULATED_WORDS = MIX_CANDIDATES * 5
+
+
+class PredictionSession:
+    """Typing state for one input stream: trie cursor, node stack and context ids."""
+
+    def __init__(self, model, history_size=64, cache=None, max_edits=0, speculate=False, adaptation=None,
+                 learner=None, reranker=None, retrieval=None):
+        """
+        Args:
+            model (MappedModel): The model to query.
+            history_size (int): Committed words remembered for backspacing into them.
+            cache (PredictionCache): Optional result cache shared with other callers.
+            max_edits (int): Typing mistakes tolerated in completions; above 0, the
+                prefix is matched with engine.fuzzy instead of the trie cursor alone.
+            speculate (bool): Precompute next words for likely completions in the background.
+            adaptation (AppLayers): Optional per-application layers to learn into and mix in.
+            learner (OnlineLearner): Optional online learner to teach the committed words.
+            reranker (Reranker): Optional second stage reordering the model's shortlists.
+            retrieval (RetrievalLayer): Optional diary retrieval to refresh and mix in.
+        """
+        self.model = model
+        self.cache = cache
+        self.max_edits = max_edits
+        self.node = 0
+        self.node_stack = []
+        self.prefix_chars = []
+        self.history = deque(maxlen=history_size)
+        self.context_ids = deque(maxlen=max(model.n - 1, 0))
+        self.context_index = -1
+        self.phrase_search = None
+        self.adaptation = adaptation
+        self.learner = learner
+        self.reranker = reranker
+        self.retrieval = retrieval
+        self.speculator = self._new_speculator() if speculate else None
+
+    @property
+    def prefix(self):
+        """The word currently being typed."""
+        return ''.join(self.prefix_chars)
+
+    @property
+    def context(self):
+        """Committed words, oldest first."""
+        return list(self.history)
+
+    def reset(self):
+        """Forget the current word and the context (e.g. on Enter)."""
+        self.node = 0
+        self.node_stack.clear()
+        self.prefix_chars.clear()
+        self.history.clear()
+        self.context_ids.clear()
+        self.context_index = -1
+        if self.phrase_search is not None:
+            self.phrase_search.reset()
+        if self.speculator is not None:
+            self.speculator.cancel()
+        if self.learner is not None:
+            self.learner.end_sentence()
+        if self.retrieval is not None:
+            self.retrieval.refresh([])
+
+    def type_char(self, char):
+        """Advance the cursor by one typed character."""
+        self.node_stack.append(self.node)
+        self.prefix_chars.append(char)
+        if self.node != OFF_TRIE:
+            self.node = self.model.walk(char.encode('utf-8'), self.node)
+
+    def backspace(self):
+        """
+        Undo the last character. With an empty prefix, the last committed word
+        becomes the prefix again so it can be edited, and is unlearned.
+        """
+        if self.prefix_chars:
+            self.prefix_chars.pop()
+            self.node = self.node_stack.pop()
+        elif self.history:
+            word = self.history.pop()
+            # The word is being edited: it was not meant to be learned as it was
+            previous = self.history[-1] if self.history else None
+            if self.adaptation is not None:
+                self.adaptation.unlearn(previous, word)
+            if self.learner is not None:
+                self.learner.unobserve(previous, word)
+            self._refresh_context()
+            if self.retrieval is not None:
+                self.retrieval.refresh(self.context)
+            for char in word:
+                self.type_char(char)
+        if not self.prefix_chars and self.speculator is not None:
+            self.speculator.cancel()
+
+    def commit_word(self, word=None):
+        """
+        Finish the current word (space) or accept a suggestion in its place.
+
+        Args:
+            word (str): The accepted word; defaults to the typed prefix.
+        """
+        word = self.prefix if word is None else word
+        self.node = 0
+        self.node_stack.clear()
+        self.prefix_chars.clear()
+        if not word:
+            return
+        if self.learner is not None and self.learner.model not in (None, self.model):
+            self._switch_model(self.learner.model)
+        previous = self.history[-1] if self.history else None
+        if self.adaptation is not None:
+            self.adaptation.learn(previous, word)
+        if self.learner is not None:
+            self.learner.observe(previous, word)
+        word_id = self.model.word_id(word)
+        self.history.append(word)
+        self.context_ids.append(word_id)
+        self._resolve_context()
+        if self.phrase_search is not None:
+            self.phrase_search.advance(self.context_ids[-1])
+        if self.retrieval is not None:
+            self.retrieval.refresh(self.context)
+
+    def _switch_model(self, model):
+        """Continue on another model (e.g. a compacted one), keeping the committed words."""
+        self.model = model
+        self.context_ids = deque(maxlen=max(model.n - 1, 0))
+        self.phrase_search = None
+        if self.speculator is not None:
+            self.speculator.close()
+            self.speculator = self._new_speculator()
+        self._refresh_context()
+
+    def _refresh_context(self):
+        """Recompute the context ids after the history changed other than by appending."""
+        self.context_ids.clear()
+        self.context_ids.extend(self.model.word_id(word) for word in list(self.history)[-self.context_ids.maxlen:])
+        self._resolve_context()
+        if self.phrase_search is not None:
+            self.phrase_search.reset(self.context_ids)
+
+    def _resolve_context(self):
+        self.context_index = self.model.context_index(list(self.context_ids))
+
+    def _new_speculator(self):
+        return Speculator(self._next_words, self._context_size(), top_k=SPECULATED_WORDS)
+
+    def _context_size(self):
+        """Words of context the next-word predictions depend on."""
+        return max(self.model.n - 1, self.reranker.context_size if self.reranker is not None else 0, 0)
+
+    def _next_words(self, context, top_k):
+        """Next words for a context other than the session's own, as the speculation needs them."""
+        if self.reranker is not None:
+            from engine.reranker import two_stage_next_words
+            # In the background, so without the reranker's time budget
+            return two_stage_next_words(self.model, self.reranker, context, top_k, budget=None)
+        return self.model.next_words(context, top_k)
+
+    @staticmethod
+    def _rerank_budget(deadline):
+        """The reranker's time budget: only a query with a deadline has one."""
+        from engine.reranker import RERANK_BUDGET
+        return RERANK_BUDGET if deadline is not None else None
+
+    def select_app(self, app):
+        """Switch to an application's adaptation layer (None for the global model alone)."""
+        if self.adaptation is not None:
+            self.adaptation.select(app)
+
+    @property
+    def layers(self):
+        """The adaptation layers mixed into suggestions; empty while there is nothing to mix."""
+        layers = []
+        if self.adaptation is not None and self.adaptation.active:
+            layers.append(self.adaptation.active)
+        if self.learner is not None:
+            layers += self.learner.layers()
+        if self.retrieval:
+            layers.append(self.retrieval)
+        return layers
+
+    def suggestion_ids(self, top_k=5, deadline=None):
+        """
+        Ranked word ids: completions of the prefix, or next words if there is none.
+
+        Args:
+            top_k (int): Number of ids to return.
+            deadline (Deadline): Optional; stops the longer searches, keeping the best so far.
+        """
+        layers = self.layers
+        if not layers or (self.max_edits and self.prefix_chars):
+            return self._global_ids(top_k, deadline, layers)
+        return self._mixed_ids(layers, self._global_ids(MIX_CANDIDATES * top_k, deadline), top_k, deadline)
+
+    def _global_ids(self, top_k, deadline, layers=()):
+        """
+        The model's ranking, reordered by the reranker if there is one.
+
+        Typo-tolerant completions are the exception: the fuzzy search takes the
+        layers and mixes them in itself.
+        """
+        last_id = self.context_ids[-1] if self.context_ids else None
+        if not self.prefix_chars:
+            if self.reranker is not None:
+                from engine.reranker import NEXT_WORD, next_word_shortlist, rerank_ids
+                ids, scores = next_word_shortlist(self.model, self.context_index, last_id)
+                return rerank_ids(self.model, self.reranker, self.context, ids, scores, NEXT_WORD, top_k,
+                                  self._rerank_budget(deadline))
+            return self.model.next_word_ids(self.context_index, last_id, top_k)
+        if self.max_edits:
+            previous = self.history[-1] if self.history else None
+            return fuzzy_completion_ids(self.model, self.prefix, self.context_index, last_id, top_k,
+                                        self.max_edits, deadline, layers, previous)
+        if self.node == OFF_TRIE:
+            return []
+        if self.reranker is not None:
+            from engine.reranker import COMPLETION, completion_shortlist, rerank_ids
+            ids, scores = completion_shortlist(self.model, self.node, self.context_index, deadline=deadline)
+            return rerank_ids(self.model, self.reranker, self.context, ids, scores, COMPLETION, top_k,
+                              self._rerank_budget(deadline))
+        return self.model.completion_ids(self.node, self.context_index, top_k, deadline)
+
+    def _mixed_ids(self, layers, candidates, top_k, deadline):
+        """
+        The layers mixed into global candidate ids (see engine.adaptation); with a
+        reranker, the mixed list is its shortlist, the mix being its first-stage score.
+        """
+        last_id = self.context_ids[-1] if self.context_ids else None
+        previous = self.history[-1] if self.history else None
+        keep = top_k if self.reranker is None else None
+        if not self.prefix_chars:
+            ids, scores = mixed_next_word_scores(self.model, layers, self.context_index, last_id, previous, keep,
+                                                 candidates)
+        elif self.node == OFF_TRIE:
+            return []
+        else:
+            ids, scores = mixed_completion_scores(self.model, layers, self.node, self.context_index, previous, keep,
+                                                  candidates)
+        if self.reranker is None:
+            return ids
+        from engine.reranker import COMPLETION, NEXT_WORD, rerank_ids
+        task = COMPLETION if self.prefix_chars else NEXT_WORD
+        ranked = rerank_ids(self.model, self.reranker, self.context, ids, scores, task, top_k,
+                            self._rerank_budget(deadline))
+        return Suggestions(ranked, ranked.partial or getattr(candidates, 'partial', False))
+
+    def suggestions(self, top_k=5, deadline=None):
+        """
+        Ranked words for the prediction bar.
+
+        Args:
+            top_k (int): Number of words to return.
+            deadline (float): Optional time limit in seconds.
+
+        Returns:
+            list: Up to top_k words; a Suggestions list, flagged partial if the
+            deadline was hit, when a deadline is given.
+        """
+        limit = Deadline.start(deadline)
+        layers = self.layers
+        if layers and self.max_edits and self.prefix_chars:
+            words = self.model.words(self.suggestion_ids(top_k, limit))
+            return words if limit is None else Suggestions.of(words, limit)
+        words = self._global_words(MIX_CANDIDATES * top_k if layers else top_k, limit)
+        if layers:
+            candidates = [word_id for word_id in map(self.model.word_id, words) if word_id is not None]
+            ids = self._mixed_ids(layers, candidates, top_k, limit)
+            words = Suggestions(self.model.words(ids),
+                                getattr(words, 'partial', False) or getattr(ids, 'partial', False))
+            if limit is not None:
+                words = Suggestions.of(words, limit)
+        if self.speculator is not None and self.prefix_chars:
+            self.speculator.speculate(self.context, words)
+        return words
+
+    def _global_words(self, top_k, limit):
+        """_global_ids as words, from the speculation or the result cache when they hold them."""
+        if self.speculator is not None and not self.prefix_chars:
+            words = self.speculator.take(self.context, top_k)
+            if words is not None:
+                return words if limit is None else Suggestions(words)
+
+        def compute():
+            ids = self._global_ids(top_k, limit)
+            # A reranker over budget flags its fallback ranking partial
+            words = Suggestions(self.model.words(ids), getattr(ids, 'partial', False))
+            return words if limit is None else Suggestions.of(words, limit)
+
+        if self.cache is None:
+            return compute()
+        key = self.cache.key(self.model, self.context, self.prefix, top_k)
+        if self.max_edits and self.prefix_chars:
+            key += (self.max_edits,)
+        elif self.reranker is not None:
+            key += ('reranked', tuple(self.context[-self.reranker.context_size:]))
+        words = self.cache.get(self.model, key, compute)
+        return words if limit is None else Suggestions.of(words, limit)
+
+    def phrases(self, top_k=3, deadline=None):
+        """
+        Multi-word continuations of the committed words (see engine.phrases).
+
+        The beam search is kept for the whole session, so committing a word that
+        a suggested phrase started with continues the search instead of restarting it.
+
+        Args:
+            top_k (int): Number of phrases to return.
+            deadline (float): Optional time limit in seconds, on top of the search's own budget.
+
+        Returns:
+            Suggestions: Up to top_k phrases, each a list of 2-4 words, flagged
+            partial if the search was cut short.
+        """
+        if self.phrase_search is None:
+            self.phrase_search = PhraseSearch(self.model)
+            self.phrase_search.reset(self.context_ids)
+        return self.phrase_search.phrases(top_k, Deadline.start(deadline))
+
+    def close(self):
+        """Stop the session's background speculation, if any."""
+        if self.speculator is not None:
+            self.speculator.close()
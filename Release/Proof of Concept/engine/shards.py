@@ -0,0 +1,229 @@
+"""
+Query-time interpolation of several model shards.
+
+A large read-only global model and a small personal one (or any number of
+shards) are combined at lookup time instead of being merged into one file:
+
+    score(w) = sum_i weight_i * score_i(w)
+
+with the weights normalized to sum to 1. For next words score_i is the shard's
+backoff probability of w after the context (MappedModel.next_word_scores); for
+completions it is max(P_i(w | context), backoff * freq_i(w) / tokens_i), the
+score engine.fuzzy ranks completions by. A word missing from a shard scores 0
+there, and words are matched across shards by their text, since every shard
+numbers its own vocabulary (each shard's word index is decoded on first use).
+
+The top k are found with the threshold algorithm: every shard lists its best
+candidates (sorted access) and each new word is scored in every other shard
+(random access). Once the kth best interpolated score is at least the
+threshold, the weighted sum of the scores last listed by every shard, no word
+still unlisted can beat it, so the search stops; otherwise every list is read
+twice as deep. A shard whose list ran out bounds nothing.
+
+Only the facade's complete_current_word and predict_next_word query shards.
+Sessions walk one model's trie, and typo-tolerant completion searches one
+model's trie, so neither can interpolate: sessions answer from the model alone
+and the facade rejects max_edits while shards are set.
+
+An InterpolatedModel is immutable: adding or removing a shard, or changing a
+weight, makes a new one out of the already open models, so nothing is rebuilt
+and a result cache keyed on it (engine.cache) empties itself on the change.
+"""
+import threading
+from collections import namedtuple
+from heapq import merge
+
+# A model and its share of the interpolation
+Shard = namedtuple('Shard', 'name model weight')
+
+# One shard's side of a query: ranked(depth) -> (words, scores) best-first
+# (fewer than depth only once the list is exhausted), score(word) -> float
+Source = namedtuple('Source', 'weight ranked score')
+
+
+def threshold_top_k(sources, top_k):
+    """
+    The top_k words by weighted sum of the sources' scores, reading their lists only as deep as needed.
+
+    Args:
+        sources (list): Source tuples.
+        top_k (int): Number of words to return.
+
+    Returns:
+        tuple: (words, scores, depth, scored): the words and scores best-first,
+        ties by word, how far down the lists were read and how many words were scored.
+    """
+    depth = max(top_k, 1)
+    totals = {}
+    while True:
+        threshold = 0.0
+        exhausted = True
+        for source in sources:
+            words, scores = source.ranked(depth)
+            for word, listed in zip(words, scores):
+                if word not in totals:
+                    # The listing source's score is known; the others are looked up
+                    totals[word] = source.weight * listed + sum(other.weight * other.score(word)
+                                                                for other in sources if other is not source)
+            if len(words) >= depth:
+                threshold += source.weight * scores[depth - 1]
+                exhausted = False
+        best = sorted(totals, key=lambda word: (-totals[word], word))[:top_k]
+        if exhausted or (len(best) == top_k and totals[best[-1]] >= threshold):
+            return best, [totals[word] for word in best], depth, len(totals)
+        depth *= 2
+
+
+def next_word_source(model, weight, context):
+    """A shard's side of a next-word query."""
+    context_ids = model.context_ids(context)
+    last_id = context_ids[-1] if context_ids else None
+    context_index = model.context_index(context_ids)
+    vocabulary, word_index = model.vocabulary(), model.word_index()
+
+    def ranked(depth):
+        ids, scores = model.next_word_scores(context_index, last_id, depth)
+        return [vocabulary[word_id] for word_id in ids], scores
+
+    def score(word):
+        word_id = word_index.get(word)
+        return 0.0 if word_id is None else model.next_word_score(context_index, last_id, word_id)
+
+    return Source(weight, ranked, score)
+
+
+def completion_source(model, weight, prefix, context):
+    """A shard's side of a completion query; None if no word of the shard starts with prefix."""
+    node = model.walk(prefix.encode('utf-8'))
+    if node < 0:
+        return None
+    lo, hi = model.id_range(node)
+    context_index = model.context_index(model.context_ids(context)) if context else -1
+    total = model.total_tokens
+    backoff = model.ctx_backoff[context_index] if context_index >= 0 else 1.0
+    vocabulary, word_index = model.vocabulary(), model.word_index()
+
+    def ranked(depth):
+        # The context's successors and the frequency list are each sorted by
+        # their own score; merged, a word first shows up with the larger of the two
+        successors = []
+        if context_index >= 0:
+            successors = [(-model.successor_probability(context_index, word_id), word_id)
+                          for word_id in model.successor_ids_in_range(context_index, lo, hi, depth)]
+        frequent = [(-backoff * model.freq[word_id] / total, word_id)
+                    for word_id in model.top_completion_ids(node, depth)]
+        ids, scores = [], []
+        for negated, word_id in merge(successors, frequent):
+            if word_id not in ids:
+                ids.append(word_id)
+                scores.append(-negated)
+                if len(ids) == depth:
+                    break
+        return [vocabulary[word_id] for word_id in ids], scores
+
+    def score(word):
+        word_id = word_index.get(word)
+        if word_id is None or not lo <= word_id < hi:
+            return 0.0
+        return max(model.successor_probability(context_index, word_id), backoff * model.freq[word_id] / total)
+
+    return Source(weight, ranked, score)
+
+
+class InterpolatedModel:
+    """Weighted shards queried together, answering like a MappedModel's word-level queries."""
+
+    def __init__(self, shards):
+        """
+        Args:
+            shards (list): Shard tuples; weights must be positive and are normalized.
+        """
+        if not shards:
+            raise ValueError("at least one shard is needed")
+        if any(shard.weight <= 0 for shard in shards):
+            raise ValueError("shard weights must be positive")
+        total = sum(shard.weight for shard in shards)
+        self.shards = tuple(shard._replace(weight=shard.weight / total) for shard in shards)
+        self.n = max(shard.model.n for shard in self.shards)
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.depth = 0
+        self.random_accesses = 0
+
+    def with_shard(self, name, model, weight):
+        """A new InterpolatedModel with the named shard added (or its model and weight replaced)."""
+        shards = [shard for shard in self.shards if shard.name != name]
+        return InterpolatedModel(shards + [Shard(name, model, weight)])
+
+    def without_shard(self, name):
+        """A new InterpolatedModel without the named shard; None if it was the last one."""
+        shards = [shard for shard in self.shards if shard.name != name]
+        return InterpolatedModel(shards) if shards else None
+
+    def weights(self):
+        """Normalized weight of every shard, by name."""
+        return {shard.name: shard.weight for shard in self.shards}
+
+    def next_word_scores(self, context, top_k=5):
+        """
+        Interpolated next-word scores.
+
+        Args:
+            context (list): Previous words.
+            top_k (int): Number of words to return.
+
+        Returns:
+            tuple: (words, scores), best-first.
+        """
+        sources = [next_word_source(shard.model, shard.weight, context) for shard in self.shards]
+        return self._top_k(sources, top_k)
+
+    def next_words(self, context, top_k=5):
+        """Most probable next words after context across the shards, best-first."""
+        return self.next_word_scores(context, top_k)[0]
+
+    def complete_scores(self, prefix, context, top_k=3):
+        """
+        Interpolated completion scores.
+
+        Args:
+            prefix (str): The partial word being typed.
+            context (list): Previous words.
+            top_k (int): Number of words to return.
+
+        Returns:
+            tuple: (words, scores), best-first.
+        """
+        if not prefix:
+            return [], []
+        sources = [completion_source(shard.model, shard.weight, prefix, context) for shard in self.shards]
+        return self._top_k([source for source in sources if source is not None], top_k)
+
+    def complete(self, prefix, context, top_k=3):
+        """Completions of prefix across the shards, best-first."""
+        return self.complete_scores(prefix, context, top_k)[0]
+
+    def _top_k(self, sources, top_k):
+        if not sources:
+            return [], []
+        words, scores, depth, random_accesses = threshold_top_k(sources, top_k)
+        with self._lock:
+            self.queries += 1
+            self.depth += depth
+            self.random_accesses += random_accesses
+        return words, scores
+
+    def stats(self):
+        """
+        Returns:
+            dict: Shard weights, queries, and the mean depth read per shard list
+            and words scored per query.
+        """
+        with self._lock:
+            queries = max(self.queries, 1)
+            return {
+                'shards': self.weights(),
+                'queries': self.queries,
+                'mean_depth': self.depth / queries,
+                'mean_random_accesses': self.random_accesses / queries,
+            }
@@ -0,0 +1,154 @@
+"""
+Snippet and abbreviation expansion over the typed stream (e.g. "brb" -> "be right back").
+
+The abbreviations are compiled once into an Aho-Corasick automaton: a trie of
+the abbreviations whose failure links are folded into the transitions, so
+every state knows where each character leads without following failure links
+at typing time. Each pattern starts with a word boundary, so "addr" matches
+the typed word "addr" and not the end of "baddr". A SnippetMatcher feeds the
+automaton one character per keystroke, which is a single dictionary lookup
+however many snippets are defined, and keeps the states it passed through so
+backspace is a pop.
+
+Snippets are kept in a JSON object mapping abbreviations to expansions
+(settings/snippets.json for the keyboard).
+"""
+import json
+import os
+from collections import deque
+
+# Character standing for a word boundary (space, or the start of the text)
+BOUNDARY = ' '
+
+
+def load_snippets(path):
+    """
+    Read abbreviation -> expansion pairs from a JSON object.
+
+    Args:
+        path (str): The JSON file.
+
+    Returns:
+        dict: The snippets; empty if the file does not exist.
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        snippets = json.load(f)
+    return {abbreviation: expansion for abbreviation, expansion in snippets.items() if abbreviation and expansion}
+
+
+class SnippetAutomaton:
+    """Aho-Corasick automaton over boundary-anchored abbreviations, as a complete transition table."""
+
+    def __init__(self, snippets):
+        """
+        Args:
+            snippets (dict): Abbreviation -> expansion.
+        """
+        self.snippets = dict(snippets)
+        goto = [{}]
+        ends = [None]
+        for abbreviation in self.snippets:
+            state = 0
+            for char in BOUNDARY + abbreviation:
+                following = goto[state].get(char)
+                if following is None:
+                    following = goto[state][char] = len(goto)
+                    goto.append({})
+                    ends.append(None)
+                state = following
+            ends[state] = abbreviation
+
+        # Breadth-first, so the failure state of every state is complete before it is read.
+        # Only transitions that leave the root are kept: a missing character means state 0.
+        self.transitions = [dict(goto[0])] + [None] * (len(goto) - 1)
+        self.outputs = [[]] * len(goto)
+        failure = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            fallback = failure[state]
+            self.transitions[state] = dict(self.transitions[fallback], **goto[state])
+            own = [ends[state]] if ends[state] is not None else []
+            # Longest match first; the shorter ones end here too (only with spaces in abbreviations)
+            self.outputs[state] = own + self.outputs[fallback]
+            for char, following in goto[state].items():
+                failure[following] = self.transitions[fallback].get(char, 0)
+                queue.append(following)
+        # The start of the text counts as a boundary
+        self.start = self.transitions[0].get(BOUNDARY, 0)
+
+    def step(self, state, char):
+        """The state after reading one character."""
+        return self.transitions[state].get(char, 0)
+
+    def matches(self, state):
+        """Abbreviations ending at a state, longest first."""
+        return self.outputs[state]
+
+    def __len__(self):
+        return len(self.snippets)
+
+
+class SnippetMatcher:
+    """Tracks the automaton across keystrokes, mirroring a PredictionSession's edits."""
+
+    def __init__(self, automaton):
+        """
+        Args:
+            automaton (SnippetAutomaton): The compiled snippets.
+        """
+        self.automaton = automaton
+        self.state = automaton.start
+        # States before every typed character, and the length of every committed word
+        self.stack = []
+        self.word_lengths = []
+        self.word_length = 0
+
+    def reset(self):
+        """Forget what was typed (e.g. on Enter)."""
+        self.state = self.automaton.start
+        self.stack.clear()
+        self.word_lengths.clear()
+        self.word_length = 0
+
+    def type_char(self, char):
+        """Advance by one typed character."""
+        self.stack.append(self.state)
+        self.state = self.automaton.step(self.state, char)
+        self.word_length += 1
+
+    def backspace(self):
+        """Undo the last character; with none in the current word, return into the last committed one."""
+        if self.word_length:
+            self.state = self.stack.pop()
+            self.word_length -= 1
+        elif self.word_lengths:
+            self.state = self.stack.pop()
+            self.word_length = self.word_lengths.pop()
+
+    def commit_word(self, word=None):
+        """
+        Finish the current word, or replace it with an accepted one, and read the boundary after it.
+
+        Args:
+            word (str): The accepted word (or words); defaults to what was typed.
+        """
+        if word is not None:
+            if self.word_length:
+                del self.stack[len(self.stack) - self.word_length + 1:]
+                self.state = self.stack.pop()
+                self.word_length = 0
+            for char in word:
+                self.type_char(char)
+        self.word_lengths.append(self.word_length)
+        self.word_length = 0
+        self.type_char(BOUNDARY)
+        self.word_length = 0
+
+    def expansions(self):
+        """Expansions of the abbreviations the current word completes, longest abbreviation first."""
+        if not self.word_length:
+            return []
+        return [self.automaton.snippets[abbreviation] for abbreviation in self.automaton.matches(self.state)]
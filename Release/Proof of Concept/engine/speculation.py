@@ -0,0 +1,156 @@
+"""
+Speculative next-word prediction while a word is being typed.
+
+The word about to be committed is most likely one of the current prefix's top
+completions. A Speculator computes, on a background thread, the next-word
+predictions that would follow the first SPECULATED_COMPLETIONS of them (just
+the top one by default), so when it is accepted (a suggestion click, or space
+after typing it out) the next-word bar is served from memory instead of by a
+query on the keystroke that commits the word.
+
+Results are keyed by the context the next-word query will see (its last n-1
+words). Each new prefix replaces the speculation: results for completions that
+are still in the running are kept, the others are dropped and counted as wasted.
+A commit takes the matching result if it is ready (a hit) and ends the
+speculation; one that finds nothing (a miss) is computed as usual. A ranked
+result answers any shorter top_k too, so a session can speculate on a longer
+list than its bar shows (e.g. to mix adaptation layers on top).
+
+A compute that raises is reported and counted as wasted; the thread carries on.
+"""
+import threading
+
+# Completions of the current prefix whose next words are precomputed. Only the
+# first: by the time a word is committed it is almost always the top completion,
+# and every further one was computed on nearly every keystroke only to be dropped
+SPECULATED_COMPLETIONS = 1
+
+
+class Speculator:
+    """Background precomputation of next-word predictions for likely completions."""
+
+    def __init__(self, compute, context_size, top_k=5, candidates=SPECULATED_COMPLETIONS):
+        """
+        Args:
+            compute (callable): compute(context, top_k) -> ranked next words, where
+                context is a list of words; called on the background thread.
+            context_size (int): Words of context the predictions depend on (n-1).
+            top_k (int): Next words precomputed per context.
+            candidates (int): Completions speculated on per prefix.
+        """
+        self._compute = compute
+        self.context_size = context_size
+        self.top_k = top_k
+        self.candidates = candidates
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._pending = []
+        self._running = None
+        self._results = {}
+        self._thread = None
+        self._closed = False
+        self.speculated = 0
+        self.hits = 0
+        self.misses = 0
+        self.wasted = 0
+
+    def key(self, context):
+        """Result key of a context: only the last n-1 words affect the prediction."""
+        return tuple(context[-self.context_size:]) if self.context_size > 0 else ()
+
+    def speculate(self, context, completions):
+        """
+        Precompute the next words after context + [word] for the best completions.
+
+        Args:
+            context (list): Committed words.
+            completions (list): Ranked completions of the current prefix.
+        """
+        keys = list(dict.fromkeys(self.key(list(context) + [word]) for word in completions[:self.candidates]))
+        with self._lock:
+            for key in [key for key in self._results if key not in keys]:
+                del self._results[key]
+                self.wasted += 1
+            self._pending = [key for key in keys if key not in self._results and key != self._running]
+            if self._pending:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='speculator', daemon=True)
+                    self._thread.start()
+                self._wake.notify()
+
+    def take(self, context, top_k):
+        """
+        The precomputed next words for context, ending the current speculation.
+
+        Returns:
+            list: The ranked words, or None if they were not speculated on or not
+            ready yet (or for a top_k above the speculated one).
+        """
+        key = self.key(context)
+        with self._lock:
+            active = bool(self._results or self._pending or self._running is not None)
+            words = self._results.pop(key, None) if top_k <= self.top_k else None
+            if words is not None:
+                self.hits += 1
+            elif active:
+                self.misses += 1
+            self._cancel()
+        return None if words is None else list(words[:top_k])
+
+    def cancel(self):
+        """Drop the current speculation (e.g. the prefix was erased or the context reset)."""
+        with self._lock:
+            self._cancel()
+
+    def close(self):
+        """Stop the background thread."""
+        with self._lock:
+            self._cancel()
+            self._closed = True
+            self._wake.notify()
+
+    def _cancel(self):
+        self.wasted += len(self._results)
+        self._results.clear()
+        self._pending = []
+        # A result still being computed is counted as wasted when it arrives
+        self._running = None
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._pending and not self._closed:
+                    self._wake.wait()
+                if self._closed:
+                    return
+                key = self._running = self._pending.pop(0)
+            words = None
+            try:
+                words = tuple(self._compute(list(key), self.top_k))
+            except Exception as e:
+                print(f"Speculating next words failed: {e}")
+            finally:
+                with self._lock:
+                    self.speculated += 1
+                    if self._running == key and words is not None:
+                        self._results[key] = words
+                    else:
+                        self.wasted += 1
+                    if self._running == key:
+                        self._running = None
+
+    def stats(self):
+        """
+        Returns:
+            dict: speculated, hits, misses, wasted and hit_rate (hits per commit
+            that found a speculation under way).
+        """
+        with self._lock:
+            commits = self.hits + self.misses
+            return {
+                'speculated': self.speculated,
+                'hits': self.hits,
+                'misses': self.misses,
+                'wasted': self.wasted,
+                'hit_rate': self.hits / commits if commits else 0.0,
+            }
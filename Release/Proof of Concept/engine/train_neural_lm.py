@@ -0,0 +1,282 @@
+"""
+Train the LSTM next-word model (engine.neural_lm) on CPU.
+
+Usage (from the Proof of Concept directory):
+    python -m engine.train_neural_lm [--corpus preprocessed_diary.json] [--samples DIR]
+                                     [--output Models/neural_lm.npz] [--epochs 8]
+
+Every sentence is read from a start token and the model learns to predict each
+word from the ones before it (backpropagation through time over the whole
+sentence, cut into pieces of at most MAX_LENGTH words). --samples adds the
+next-word and completion .jsonl files written by dual_transformers.save_datasets
+(Stress-Testing Models/Claude/word_prediction_data), each sample read as its
+context followed by the word.
+
+Training minimizes the cross-entropy over the model's vocabulary with Adam, in
+NumPy. A share of the sentences is held out: the epoch with the lowest held-out
+loss is kept, and the perplexity and top-1/top-3 next-word accuracy on it are
+reported for the float weights, the int8 weights that are saved, and the n-gram
+model built from the same sentences.
+"""
+import argparse
+import json
+import os
+import random
+
+import numpy as np
+
+from engine.build_model import DATA_DIR, PROOF_OF_CONCEPT_DIR
+from engine.csr_model import build_from_corpus
+from engine.model_format import MappedModel
+from engine.neural_lm import START, UNKNOWN, NeuralLanguageModel, quantize
+from engine.train_reranker import MIN_COUNT, read_samples
+
+# Longest piece of a sentence trained on at once
+MAX_LENGTH = 32
+
+
+def sequences(model, sentences):
+    """Rows of each sentence after a start token, cut into pieces of at most MAX_LENGTH words."""
+    pieces = []
+    for sentence in sentences:
+        rows = [model.row(word) for word in sentence]
+        for start in range(0, len(rows), MAX_LENGTH):
+            pieces.append([START] + rows[start:start + MAX_LENGTH])
+    return pieces
+
+
+def batches(pieces, batch_size, rng=None):
+    """
+    Padded (inputs, targets, mask) batches of pieces of similar length, in a
+    random order if rng is given. Unknown words are read but never predicted.
+    """
+    pieces = sorted(pieces, key=len)
+    groups = [pieces[start:start + batch_size] for start in range(0, len(pieces), batch_size)]
+    if rng is not None:
+        rng.shuffle(groups)
+    for group in groups:
+        length = max(len(piece) for piece in group) - 1
+        rows = np.full((len(group), length + 1), UNKNOWN, dtype=np.int64)
+        for i, piece in enumerate(group):
+            rows[i, :len(piece)] = piece
+        mask = np.zeros((len(group), length), dtype=bool)
+        for i, piece in enumerate(group):
+            mask[i, :len(piece) - 1] = True
+        yield rows[:, :-1], rows[:, 1:], mask & (rows[:, 1:] != UNKNOWN)
+
+
+def initial_model(words, dim, hidden, rng):
+    size = len(words) + 2
+    b = np.zeros(4 * hidden)
+    # Forget gates start open so early gradients reach back through the sentence
+    b[hidden:2 * hidden] = 1
+    params = {
+        'E': rng.normal(0, 0.1, (size, dim)),
+        'W': rng.normal(0, 1 / np.sqrt(dim + hidden), (dim + hidden, 4 * hidden)),
+        'b': b,
+        'O': rng.normal(0, 1 / np.sqrt(hidden), (hidden, size)),
+        'c': np.zeros(size),
+    }
+    return NeuralLanguageModel(words, params)
+
+
+def forward(model, inputs):
+    """Hidden states of a batch (B x T x H) and what backward() needs of every step."""
+    p = model.params
+    count, length = inputs.shape
+    size = model.hidden_size
+    h = np.zeros((count, size))
+    c = np.zeros((count, size))
+    hiddens, steps = np.zeros((count, length, size)), []
+    for t in range(length):
+        z = np.concatenate([p['E'][inputs[:, t]], h], axis=1)
+        gates = z @ p['W'] + p['b']
+        i = 1 / (1 + np.exp(-gates[:, :size]))
+        f = 1 / (1 + np.exp(-gates[:, size:2 * size]))
+        g = np.tanh(gates[:, 2 * size:3 * size])
+        o = 1 / (1 + np.exp(-gates[:, 3 * size:]))
+        previous_c = c
+        c = f * c + i * g
+        tanh_c = np.tanh(c)
+        h = o * tanh_c
+        hiddens[:, t] = h
+        steps.append((z, i, f, g, o, previous_c, tanh_c))
+    return hiddens, steps
+
+
+def log_probabilities(model, hiddens):
+    logits = hiddens @ model.params['O'] + model.params['c']
+    logits -= logits.max(axis=-1, keepdims=True)
+    return logits - np.log(np.exp(logits).sum(axis=-1, keepdims=True))
+
+
+def loss_and_gradients(model, batch):
+    """Mean cross-entropy of the predicted words of a batch, and its gradients."""
+    inputs, targets, mask = batch
+    p = model.params
+    size = model.hidden_size
+    hiddens, steps = forward(model, inputs)
+    log_probs = log_probabilities(model, hiddens)
+    count = max(mask.sum(), 1)
+    loss = -np.take_along_axis(log_probs, targets[..., None], axis=-1)[..., 0][mask].sum() / count
+
+    d_logits = np.exp(log_probs)
+    np.put_along_axis(d_logits, targets[..., None],
+                      np.take_along_axis(d_logits, targets[..., None], axis=-1) - 1, axis=-1)
+    d_logits *= mask[..., None] / count
+    grads = {name: np.zeros_like(value) for name, value in p.items()}
+    grads['O'] = hiddens.reshape(-1, size).T @ d_logits.reshape(-1, d_logits.shape[-1])
+    grads['c'] = d_logits.sum(axis=(0, 1))
+    d_hiddens = d_logits @ p['O'].T
+
+    d_h = np.zeros((len(inputs), size))
+    d_c = np.zeros((len(inputs), size))
+    dim = p['E'].shape[1]
+    for t in reversed(range(inputs.shape[1])):
+        z, i, f, g, o, previous_c, tanh_c = steps[t]
+        d_h = d_h + d_hiddens[:, t]
+        d_c = d_c + d_h * o * (1 - tanh_c ** 2)
+        d_gates = np.concatenate([d_c * g * i * (1 - i), d_c * previous_c * f * (1 - f),
+                                  d_c * i * (1 - g ** 2), d_h * tanh_c * o * (1 - o)], axis=1)
+        d_c = d_c * f
+        grads['W'] += z.T @ d_gates
+        grads['b'] += d_gates.sum(axis=0)
+        d_z = d_gates @ p['W'].T
+        np.add.at(grads['E'], inputs[:, t], d_z[:, :dim])
+        d_h = d_z[:, dim:]
+    return loss, grads
+
+
+def heldout_loss(model, pieces, batch_size=256):
+    """Mean cross-entropy per predicted word of held-out pieces."""
+    total = count = 0
+    for batch in batches(pieces, batch_size):
+        loss, _ = evaluate(model, batch)
+        total += loss * batch[2].sum()
+        count += batch[2].sum()
+    return total / max(count, 1)
+
+
+def evaluate(model, batch):
+    """(mean cross-entropy, ranks of the typed words) of a batch, without gradients."""
+    inputs, targets, mask = batch
+    hiddens, _ = forward(model, inputs)
+    log_probs = log_probabilities(model, hiddens)
+    typed = np.take_along_axis(log_probs, targets[..., None], axis=-1)
+    # The special rows are never suggested, so they do not count against the typed word
+    log_probs[..., :START + 1] = -np.inf
+    ranks = (log_probs > typed).sum(axis=-1)
+    return -typed[..., 0][mask].sum() / max(mask.sum(), 1), ranks[mask]
+
+
+def train(model, pieces, validation, epochs, batch_size=32, learning_rate=0.003, clip=5.0, seed=0):
+    """
+    Adam over shuffled minibatches with the gradient norm clipped to clip. The
+    weights with the lowest held-out loss are kept.
+    """
+    rng = random.Random(seed)
+    moments = {name: (np.zeros_like(value), np.zeros_like(value)) for name, value in model.params.items()}
+    best_loss, best = np.inf, None
+    step = 0
+    for epoch in range(epochs):
+        losses = []
+        for batch in batches(pieces, batch_size, rng):
+            loss, grads = loss_and_gradients(model, batch)
+            losses.append(loss)
+            step += 1
+            norm = np.sqrt(sum((grad ** 2).sum() for grad in grads.values()))
+            scale = min(1.0, clip / (norm + 1e-12))
+            for name, grad in grads.items():
+                grad *= scale
+                first, second = moments[name]
+                first *= 0.9
+                first += 0.1 * grad
+                second *= 0.999
+                second += 0.001 * grad ** 2
+                model.params[name] -= (learning_rate * (first / (1 - 0.9 ** step))
+                                       / (np.sqrt(second / (1 - 0.999 ** step)) + 1e-8))
+        loss = heldout_loss(model, validation)
+        print(f"Epoch {epoch + 1}: loss {np.mean(losses):.3f}, held-out loss {loss:.3f} "
+              f"(perplexity {np.exp(loss):.1f})")
+        if loss < best_loss:
+            best_loss = loss
+            best = {name: value.copy() for name, value in model.params.items()}
+    model.params = best
+
+
+def quantized_copy(model):
+    """The model as it is loaded after saving with int8 weights."""
+    params = dict(model.params)
+    for name, axis in NeuralLanguageModel.QUANTIZED.items():
+        values, scales = quantize(params[name], axis)
+        params[name] = values.astype(np.float32) * scales
+    return NeuralLanguageModel(model.words, params)
+
+
+def accuracy(model, pieces, batch_size=256):
+    """(perplexity, top-1, top-3) of the next-word predictions on held-out pieces."""
+    losses, ranks = [], []
+    for batch in batches(pieces, batch_size):
+        loss, batch_ranks = evaluate(model, batch)
+        losses.append(loss * batch[2].sum())
+        ranks.append(batch_ranks)
+    ranks = np.concatenate(ranks)
+    return np.exp(sum(losses) / len(ranks)), (ranks < 1).mean(), (ranks < 3).mean()
+
+
+def ngram_accuracy(ngram, model, sentences):
+    """Top-1 and top-3 of the n-gram model's next words, on the words the neural model knows."""
+    hits, count = np.zeros(2), 0
+    for sentence in sentences:
+        for i, word in enumerate(sentence):
+            if model.row(word) == UNKNOWN:
+                continue
+            predicted = ngram.next_words(sentence[max(0, i - ngram.n + 1):i], 3)
+            hits += [predicted[:1] == [word], word in predicted]
+            count += 1
+    return hits / max(count, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the LSTM next-word model")
+    parser.add_argument('--corpus', default=os.path.join(DATA_DIR, 'preprocessed_diary.json'))
+    parser.add_argument('--samples', help="directory of .jsonl samples from dual_transformers.py")
+    parser.add_argument('--output', default=os.path.join(PROOF_OF_CONCEPT_DIR, 'Models', 'neural_lm.npz'))
+    parser.add_argument('--dim', type=int, default=64)
+    parser.add_argument('--hidden', type=int, default=128)
+    parser.add_argument('--epochs', type=int, default=8)
+    parser.add_argument('--heldout', type=float, default=0.1)
+    args = parser.parse_args()
+
+    with open(args.corpus, 'r', encoding='utf-8') as f:
+        sentences = json.load(f)
+    random.Random(0).shuffle(sentences)
+    split = int(len(sentences) * args.heldout)
+    heldout, training = sentences[:split], sentences[split:]
+    if args.samples:
+        training += [context + [word] for context, _, word in read_samples(args.samples)]
+
+    counts = {}
+    for sentence in training:
+        for word in sentence:
+            counts[word] = counts.get(word, 0) + 1
+    words = sorted(word for word, count in counts.items() if count >= MIN_COUNT)
+    model = initial_model(words, args.dim, args.hidden, np.random.default_rng(0))
+    pieces, validation = sequences(model, training), sequences(model, heldout)
+    print(f"{len(training)} training sentences, {len(heldout)} held out, {len(words)} words")
+
+    train(model, pieces, validation, args.epochs)
+    ngram = MappedModel(build_from_corpus(training)[0])
+    print(f"\nHeld-out next words ({args.heldout:.0%} of the sentences):")
+    for name, candidate in (('float32', model), ('int8', quantized_copy(model))):
+        perplexity, top1, top3 = accuracy(candidate, validation)
+        print(f"  {name:>8}: perplexity {perplexity:.1f}, top-1 {top1:.1%}, top-3 {top3:.1%}")
+    top1, top3 = ngram_accuracy(ngram, model, heldout)
+    print(f"  {'n-gram':>8}: top-1 {top1:.1%}, top-3 {top3:.1%}")
+
+    model.save(args.output)
+    print(f"Model written to '{args.output}' ({os.path.getsize(args.output) / 1024:.0f} KiB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""
+Train the second-stage reranker (engine.reranker) on the diary corpus.
+
+Usage (from the Proof of Concept directory):
+    python -m engine.train_reranker [--corpus preprocessed_diary.json] [--samples DIR]
+                                    [--output Models/reranker.npz] [--epochs 5] [--context 4]
+
+Every training example is a first-stage shortlist with the word that was really
+typed in it: next-word queries at every position of a sentence, and completion
+queries for one random prefix of every word longer than three letters (the
+samples Stress-Testing Models/Claude/dual_transformers.py prepares). So that the
+first-stage scores look like they will on new text rather than on memorized
+sentences, the sentences are split into folds and each fold's shortlists come
+from a model built on the other folds. --samples adds the next-word and
+completion .jsonl files written by dual_transformers.save_datasets, shortlisted
+by a model built on every training sentence.
+
+Training minimizes the cross-entropy of the typed word over its shortlist with
+Adam, in NumPy. A share of the sentences is held out: the epoch with the lowest
+loss on it is kept (the diary is small and a reranker trained for too long
+learns it by heart), and the top-1/top-3 accuracy of the first stage alone and
+of both stages on it is reported.
+"""
+import argparse
+import json
+import os
+import random
+
+import numpy as np
+
+from engine.build_model import DATA_DIR, PROOF_OF_CONCEPT_DIR
+from engine.csr_model import build_from_corpus
+from engine.model_format import MappedModel
+from engine.reranker import (COMPLETION, MIN_SCORE, NEXT_WORD, PADDING, SHORTLIST, UNKNOWN, Reranker,
+                             completion_shortlist, next_word_shortlist)
+
+# Shortest word completion examples are made for, as in dual_transformers.prepare_diary_dataset
+MIN_COMPLETION_LENGTH = 4
+
+# Occurrences a word needs in the training sentences to get its own embedding
+MIN_COUNT = 2
+
+
+class Examples:
+    """Shortlists padded to SHORTLIST, with the position of the typed word in each."""
+
+    def __init__(self, context_size):
+        self.context_size = context_size
+        self.contexts, self.candidates, self.scores, self.targets, self.tasks = [], [], [], [], []
+
+    def add(self, context, words, scores, target, task):
+        """Keep one query if the typed word made the shortlist (the reranker cannot help otherwise)."""
+        if target not in words or len(words) < 2:
+            return
+        context = list(context[-self.context_size:])
+        self.contexts.append([None] * (self.context_size - len(context)) + context)
+        self.candidates.append(words)
+        self.scores.append(scores)
+        self.targets.append(words.index(target))
+        self.tasks.append(task)
+
+    def arrays(self, reranker):
+        """(contexts, candidates, scores, mask, targets, tasks) as arrays with reranker rows."""
+        count = len(self.targets)
+        contexts = np.full((count, self.context_size), PADDING, dtype=np.int64)
+        candidates = np.full((count, SHORTLIST), UNKNOWN, dtype=np.int64)
+        scores = np.ones((count, SHORTLIST))
+        mask = np.zeros((count, SHORTLIST), dtype=bool)
+        for i, (context, words, listed) in enumerate(zip(self.contexts, self.candidates, self.scores)):
+            contexts[i] = [PADDING if word is None else reranker.index.get(word, UNKNOWN) for word in context]
+            candidates[i, :len(words)] = reranker.rows(words)
+            scores[i, :len(words)] = listed
+            mask[i, :len(words)] = True
+        return contexts, candidates, scores, mask, np.array(self.targets), np.array(self.tasks)
+
+    def __len__(self):
+        return len(self.targets)
+
+
+def shortlist_queries(model, sentences, examples, rng):
+    """Add the next-word and completion queries of sentences, shortlisted by model."""
+    for sentence in sentences:
+        for i, word in enumerate(sentence):
+            context = sentence[max(0, i - examples.context_size):i]
+            context_ids = model.context_ids(context)
+            context_index = model.context_index(context_ids) if context else -1
+            if i > 0:
+                ids, scores = next_word_shortlist(model, context_index, context_ids[-1])
+                examples.add(context, model.words(ids), scores, word, NEXT_WORD)
+            if len(word) >= MIN_COMPLETION_LENGTH:
+                node = model.walk(word[:rng.randrange(1, len(word))].encode('utf-8'))
+                if node >= 0:
+                    ids, scores = completion_shortlist(model, node, context_index)
+                    examples.add(context, model.words(ids), scores, word, COMPLETION)
+
+
+def read_samples(directory):
+    """
+    Queries from dual_transformers.save_datasets: (context words, prefix or None, word).
+    """
+    samples = []
+    for name, completion in (('train_next_word.jsonl', False), ('train_completion.jsonl', True)):
+        path = os.path.join(directory, name)
+        if not os.path.exists(path):
+            continue
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                fields = json.loads(line)
+                if completion:
+                    context, prefix, word = fields
+                else:
+                    (context, word), prefix = fields, None
+                samples.append((context.split(), prefix, word))
+    return samples
+
+
+def shortlist_samples(model, samples, examples):
+    """Add prepared samples, shortlisted by model."""
+    for context, prefix, word in samples:
+        context_ids = model.context_ids(context)
+        context_index = model.context_index(context_ids) if context else -1
+        if prefix is None:
+            ids, scores = next_word_shortlist(model, context_index, context_ids[-1] if context_ids else None)
+            examples.add(context, model.words(ids), scores, word, NEXT_WORD)
+        else:
+            node = model.walk(prefix.encode('utf-8'))
+            if node >= 0:
+                ids, scores = completion_shortlist(model, node, context_index)
+                examples.add(context, model.words(ids), scores, word, COMPLETION)
+
+
+def initial_reranker(words, context_size, dim, hidden, rng):
+    size = len(words) + 2
+    params = {
+        'E': rng.normal(0, 0.1, (size, dim)),
+        'W': rng.normal(0, 1 / np.sqrt(context_size * dim), (context_size * dim, hidden)),
+        'b': np.zeros(hidden),
+        'U': np.zeros((size, hidden)),
+        'u': np.zeros(size),
+        'a': np.ones(2),
+    }
+    return Reranker(words, params, context_size)
+
+
+def loss_and_gradients(reranker, batch):
+    """Cross-entropy of the typed words over their shortlists, and its gradients."""
+    contexts, candidates, scores, mask, targets, tasks = batch
+    p = reranker.params
+    count = len(targets)
+    log_scores = np.log(np.maximum(scores, MIN_SCORE))
+    x = p['E'][contexts].reshape(count, -1)
+    hidden = np.tanh(x @ p['W'] + p['b'])
+    out = p['U'][candidates]
+    logits = np.einsum('bh,bkh->bk', hidden, out) + p['u'][candidates] + p['a'][tasks][:, None] * log_scores
+    logits = np.where(mask, logits, -np.inf)
+    logits -= logits.max(axis=1, keepdims=True)
+    probs = np.exp(logits)
+    probs /= probs.sum(axis=1, keepdims=True)
+    rows = np.arange(count)
+    loss = -np.log(probs[rows, targets] + 1e-12).mean()
+
+    d_logits = probs
+    d_logits[rows, targets] -= 1
+    d_logits /= count
+    grads = {name: np.zeros_like(value) for name, value in p.items()}
+    np.add.at(grads['U'], candidates, d_logits[:, :, None] * hidden[:, None, :])
+    np.add.at(grads['u'], candidates, d_logits)
+    np.add.at(grads['a'], tasks, (d_logits * log_scores).sum(axis=1))
+    d_hidden = np.einsum('bk,bkh->bh', d_logits, out) * (1 - hidden ** 2)
+    grads['W'] = x.T @ d_hidden
+    grads['b'] = d_hidden.sum(axis=0)
+    np.add.at(grads['E'], contexts, (d_hidden @ p['W'].T).reshape(count, reranker.context_size, -1))
+    return loss, grads
+
+
+def train(reranker, batch, validation, epochs, batch_size=256, learning_rate=0.003, weight_decay=0.001,
+          seed=0):
+    """
+    Adam over shuffled minibatches, with L2 weight decay on the embeddings and the
+    hidden layer. The weights with the lowest held-out loss are kept, including the
+    initial ones (which rank exactly like the first stage).
+    """
+    rng = np.random.default_rng(seed)
+    moments = {name: (np.zeros_like(value), np.zeros_like(value)) for name, value in reranker.params.items()}
+    best_loss = loss_and_gradients(reranker, validation)[0]
+    best = {name: value.copy() for name, value in reranker.params.items()}
+    print(f"Initial held-out loss {best_loss:.3f}")
+    step = 0
+    for epoch in range(epochs):
+        order = rng.permutation(len(batch[0]))
+        losses = []
+        for start in range(0, len(order), batch_size):
+            rows = order[start:start + batch_size]
+            loss, grads = loss_and_gradients(reranker, [array[rows] for array in batch])
+            losses.append(loss)
+            step += 1
+            for name, grad in grads.items():
+                if name in ('E', 'W', 'U'):
+                    grad += weight_decay * reranker.params[name]
+                first, second = moments[name]
+                first *= 0.9
+                first += 0.1 * grad
+                second *= 0.999
+                second += 0.001 * grad ** 2
+                reranker.params[name] -= (learning_rate * (first / (1 - 0.9 ** step))
+                                          / (np.sqrt(second / (1 - 0.999 ** step)) + 1e-8))
+        heldout_loss = loss_and_gradients(reranker, validation)[0]
+        print(f"Epoch {epoch + 1}: loss {np.mean(losses):.3f}, held-out loss {heldout_loss:.3f}")
+        if heldout_loss < best_loss:
+            best_loss = heldout_loss
+            best = {name: value.copy() for name, value in reranker.params.items()}
+    reranker.params = best
+
+
+def accuracy(reranker, batch):
+    """Top-1 and top-3 accuracy per task, of the first stage alone and reranked."""
+    contexts, candidates, scores, mask, targets, tasks = batch
+    reranked, _ = reranker.scores(contexts, candidates, scores, tasks[:, None])
+    reranked = np.where(mask, reranked, -np.inf)
+    typed = reranked[np.arange(len(targets)), targets][:, None]
+    ranks = {'first stage': targets, 'reranked': (reranked > typed).sum(axis=1)}
+    results = {}
+    for task, name in ((NEXT_WORD, 'next word'), (COMPLETION, 'completion')):
+        selected = tasks == task
+        for stage, rank in ranks.items():
+            results[name, stage] = ((rank[selected] < 1).mean(), (rank[selected] < 3).mean(), selected.sum())
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the second-stage reranker")
+    parser.add_argument('--corpus', default=os.path.join(DATA_DIR, 'preprocessed_diary.json'))
+    parser.add_argument('--vocabulary', default=os.path.join(DATA_DIR, 'vocabulary.json'))
+    parser.add_argument('--samples', help="directory of .jsonl samples from dual_transformers.py")
+    parser.add_argument('--output', default=os.path.join(PROOF_OF_CONCEPT_DIR, 'Models', 'reranker.npz'))
+    parser.add_argument('--context', type=int, default=4, help="previous words the reranker reads")
+    parser.add_argument('--dim', type=int, default=32)
+    parser.add_argument('--hidden', type=int, default=64)
+    parser.add_argument('--epochs', type=int, default=5)
+    parser.add_argument('--folds', type=int, default=4)
+    parser.add_argument('--heldout', type=float, default=0.1)
+    args = parser.parse_args()
+
+    with open(args.corpus, 'r', encoding='utf-8') as f:
+        sentences = json.load(f)
+    vocabulary = args.vocabulary if os.path.exists(args.vocabulary) else None
+    rng = random.Random(0)
+    rng.shuffle(sentences)
+    split = int(len(sentences) * args.heldout)
+    heldout, training = sentences[:split], sentences[split:]
+
+    examples = Examples(args.context)
+    for fold in range(args.folds):
+        rest = [sentence for i, sentence in enumerate(training) if i % args.folds != fold]
+        model = MappedModel(build_from_corpus(rest, vocabulary)[0])
+        shortlist_queries(model, training[fold::args.folds], examples, rng)
+    model = MappedModel(build_from_corpus(training, vocabulary)[0])
+    if args.samples:
+        shortlist_samples(model, read_samples(args.samples), examples)
+    validation = Examples(args.context)
+    shortlist_queries(model, heldout, validation, rng)
+
+    counts = {}
+    for sentence in training:
+        for word in sentence:
+            counts[word] = counts.get(word, 0) + 1
+    words = sorted(word for word, count in counts.items() if count >= MIN_COUNT)
+    reranker = initial_reranker(words, args.context, args.dim, args.hidden, np.random.default_rng(0))
+    print(f"{len(examples)} training queries, {len(validation)} held out, {len(words)} words embedded")
+
+    validation = validation.arrays(reranker)
+    train(reranker, examples.arrays(reranker), validation, args.epochs)
+    print(f"\nHeld-out accuracy ({args.heldout:.0%} of the sentences):")
+    for (task, stage), (top1, top3, count) in accuracy(reranker, validation).items():
+        print(f"  {task:>10}, {stage:<11}: top-1 {top1:.1%}, top-3 {top3:.1%} ({count} queries)")
+
+    reranker.save(args.output)
+    print(f"Reranker written to '{args.output}' ({os.path.getsize(args.output) / 1024:.0f} KiB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,65 +1,492 @@
-import pickle
-import pygtrie as trie
+import os
 
-# Load the pre-trained models
-with open(r'Models\word_trie.pkl', 'rb') as f:
-    word_trie = pickle.load(f)
+from engine.adaptation import AppLayers
+from engine.cache import PredictionCache
+from engine.deadline import Deadline, Suggestions
+from engine.fuzzy import fuzzy_complete
+from engine.learning import COMPACT_EVERY, OnlineLearner
+from engine.model_format import MappedModel
+from engine.narrowing import NarrowingCompleter
+from engine.phrases import PhraseSearch
+from engine.registry import ModelRegistry
+from engine.session import PredictionSession
+from engine.shards import InterpolatedModel, Shard
 
-with open(r'Models\ngram_model.pkl', 'rb') as f:
-    ngram_model = pickle.load(f)
+MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Models')
+MODEL_PATH = os.path.join(MODELS_DIR, 'model.osk')
+RERANKER_PATH = os.path.join(MODELS_DIR, 'reranker.npz')
+NEURAL_LM_PATH = os.path.join(MODELS_DIR, 'neural_lm.npz')
+DIARY_INDEX_DIR = os.path.join(MODELS_DIR, 'diary_index')
+DEFAULT_MODEL = 'model'
 
+# Where the online learner keeps its log and compacted models, and the name the
+# latest compacted model is registered under
+LEARNED_DIR = os.path.join(MODELS_DIR, 'learned')
+LEARNED_MODEL = 'learned'
 
-def complete_current_word(prefix, context, top_k=3):
+# Resident bytes of all loaded models before the least recently used are unloaded
+MODEL_MEMORY_BUDGET = 512 * 1024 * 1024
+
+
+def load_model(path=MODEL_PATH):
+    """
+    Open the binary model with mmap and query it in place.
+
+    Nothing is deserialized, so this costs the same for any corpus size and the
+    pages are shared with every other process using the same file. Falls back to
+    converting the pickled models in memory when model.osk has not been built.
+
+    Args:
+        path (str): Path to the .osk model file.
+
+    Returns:
+        MappedModel: The opened model.
+    """
+    if os.path.exists(path):
+        return MappedModel.open(path)
+
+    print("model.osk not found - converting the pickled models in memory "
+          "(run 'python -m engine.convert_model' to build it once)")
+    from engine.convert_model import convert_pickles
+    return MappedModel(convert_pickles(os.path.dirname(path)), path)
+
+
+# Models by name (Models/<name>.osk, e.g. a per-language or per-corpus model),
+# opened on first use and kept resident within the memory budget
+registry = ModelRegistry(MODELS_DIR, MODEL_MEMORY_BUDGET, loader=load_model)
+registry.register(DEFAULT_MODEL, MODEL_PATH)
+
+# Map the pre-trained model
+model = registry.get(DEFAULT_MODEL)
+
+def load_reranker(path=RERANKER_PATH):
+    """
+    Load the second-stage reranker trained by engine.train_reranker.
+
+    Args:
+        path (str): Path to the .npz weights.
+
+    Returns:
+        Reranker: The reranker, or None if it has not been trained.
+    """
+    if not os.path.exists(path):
+        return None
+    from engine.reranker import Reranker
+    return Reranker.load(path)
+
+
+# Reorders the model's shortlists once use_reranker is called (see engine.reranker);
+# None answers from the n-gram model alone, as the batch functions always do
+reranker = None
+
+# Results shared by the facade functions (and any thread calling them); emptied
+# automatically when use_model or reload_model swaps the model
+cache = PredictionCache(max_entries=16384)
+
+# Per-application adaptation layers shared by the sessions (see engine.adaptation)
+app_layers = AppLayers()
+
+# Candidates of the previous complete_current_word call, filtered when the next
+# one extends its prefix (see engine.narrowing)
+narrowing = NarrowingCompleter()
+
+# Weighted models interpolated at query time by complete_current_word and
+# predict_next_word once add_shard is called (see engine.shards)
+shards = None
+
+# Learns from the words committed in sessions once start_learning is called
+# (see engine.learning)
+learner = None
+
+# The LSTM engine, loaded by the first new_neural_session call (see engine.neural_lm)
+neural_lm = None
+
+# The diary sentence index, mapped by the first new_session(retrieve=True) call
+# (see engine.retrieval)
+diary_index = None
+
+
+def use_reranker(path=RERANKER_PATH):
+    """
+    Reorder the facade's and new sessions' shortlists with the trained reranker.
+
+    Off by default, so the facade ranks exactly like predict_batch and
+    complete_batch (which never rerank). Queries without context, typo-tolerant
+    completions and shards keep the n-gram ranking.
+
+    Args:
+        path (str): Path to the .npz weights written by engine.train_reranker.
+
+    Returns:
+        Reranker: The reranker, or None if it has not been trained.
+    """
+    global reranker
+    reranker = load_reranker(path)
+    return reranker
+
+
+def reload_model(path=MODEL_PATH):
+    """
+    Swap in a freshly built model file. Cached results from the old model are
+    dropped on the next lookup, and sessions started afterwards use the new model.
+
+    Args:
+        path (str): Path to the .osk model file.
+
+    Returns:
+        MappedModel: The newly opened model.
+    """
+    global model
+    name = os.path.splitext(os.path.basename(path))[0]
+    registry.register(name, path)
+    model = registry.reload(name)
+    return model
+
+
+def use_model(name):
+    """
+    Switch the facade functions to a named model (see engine.registry).
+
+    The model is loaded on first use; one used recently is still resident and
+    switching back to it does not touch the disk. Sessions started afterwards
+    use it too.
+
+    Args:
+        name (str): A model registered with registry.register, or the name of a
+            .osk file in Models (e.g. "model" for Models/model.osk).
+
+    Returns:
+        MappedModel: The model now in use.
+    """
+    global model
+    model = registry.get(name)
+    return model
+
+
+def add_shard(name, weight, path=None):
+    """
+    Interpolate a model into complete_current_word and predict_next_word (see engine.shards).
+
+    The shards are combined at lookup time, so adding, removing or reweighting
+    one never rebuilds a model; the models themselves come from the registry and
+    stay shared and read-only. Once any shard is added, the facade answers from
+    the shards alone, so add the global model too, e.g.
+    add_shard("model", 0.8) then add_shard("diary", 0.2, "diary.osk").
+
+    Shards are facade-only: sessions (new_session), the batch functions and
+    rescore_transcripts keep answering from the model alone, and
+    complete_current_word refuses max_edits while shards are in use.
+
+    Args:
+        name (str): A registered model, a .osk file in Models, or the name to register path under.
+        weight (float): The shard's share of the interpolation (weights are normalized).
+        path (str): Optional model file outside Models.
+
+    Returns:
+        InterpolatedModel: The shards now in use.
+    """
+    global shards
+    if path is not None:
+        registry.register(name, path)
+    shard_model = registry.get(name)
+    if shards is None:
+        shards = InterpolatedModel([Shard(name, shard_model, weight)])
+    else:
+        shards = shards.with_shard(name, shard_model, weight)
+    return shards
+
+
+def remove_shard(name):
+    """Stop interpolating a shard; with none left, the facade answers from the model alone again."""
+    global shards
+    if shards is not None:
+        shards = shards.without_shard(name)
+
+
+def cache_stats():
+    """
+    Returns:
+        dict: Hit/miss/eviction counters of the result cache (see PredictionCache.stats).
+    """
+    return cache.stats()
+
+
+def complete_current_word(prefix, context, top_k=3, max_edits=0, deadline=None):
     """
     Suggest completions for the current word being typed.
 
+    Consecutive calls that extend the same prefix in the same context reuse the
+    previous call's candidates (see engine.narrowing). After use_reranker,
+    exact-prefix completions with context are the model's shortlist, narrowed
+    the same way, reordered by the reranker (see engine.reranker).
+
     Args:
         prefix (str): The partial word being typed (e.g., "bea").
         context (list): List of previous words (e.g., ["so"]).
         top_k (int): Number of suggestions to return (default: 3).
+        max_edits (int): Typing mistakes to tolerate in the prefix (default: 0,
+            exact prefix matches only; see engine.fuzzy). Not supported while
+            shards are interpolated (add_shard).
+        deadline (float): Optional time limit in seconds (e.g. 0.008); see engine.deadline.
 
     Returns:
-        list: Top k completion suggestions (e.g., ["bear", "beach", "beat"]).
+        list: Top k completion suggestions (e.g., ["bear", "beach", "beat"]); with
+        a deadline, a Suggestions list whose partial flag is set if it was hit.
+
+    Raises:
+        ValueError: If max_edits is set while shards are interpolated.
     """
-    if not prefix:  # Return empty list if no prefix is provided
-        return []
+    limit = Deadline.start(deadline)
+    if max_edits and shards is not None:
+        raise ValueError("typo-tolerant completion does not support shards: remove them or use max_edits=0")
+    if not prefix:
+        return [] if limit is None else Suggestions()
+    if shards is not None:
+        current = shards
+        key = cache.key(current, context, prefix, top_k)
+        compute = lambda: current.complete(prefix, context, top_k)
+        if limit is None:
+            return cache.get(current, key, compute)
+        return Suggestions.of(cache.get(current, key, compute), limit)
+    current, second_stage = model, reranker
+    key = cache.key(current, context, prefix, top_k)
+    if max_edits:
+        key += (max_edits,)
+        compute = lambda: fuzzy_complete(current, prefix, context, top_k, max_edits, limit)
+    elif second_stage is not None and context:
+        from engine.reranker import RERANK_BUDGET, two_stage_complete
+        # The reranker may read further back than the model
+        key += ('reranked', tuple(context[-second_stage.context_size:]))
+        budget = RERANK_BUDGET if limit is not None else None
+        compute = lambda: two_stage_complete(current, second_stage, prefix, context, top_k, limit, budget, narrowing)
+    else:
+        compute = lambda: current.words(narrowing.completion_ids(current, prefix, context, top_k, limit))
+    if limit is None:
+        return cache.get(current, key, compute)
+    return Suggestions.of(cache.get(current, key, lambda: Suggestions.of(compute(), limit)), limit)
 
-    # Get all possible completions from the trie
-    completions = [word for word in word_trie.iterkeys(prefix) if word.startswith(prefix)]
 
-    if not context:
-        # No context: rank by frequency from the trie
-        return sorted(completions, key=lambda w: word_trie[w], reverse=True)[:top_k]
+def predict_next_word(context, top_k=5, deadline=None):
+    """
+    Predict the next word based on previous words.
 
-    # Use context with n-gram model (trigram assumed)
-    n = 3
-    ngram = tuple(context[-(n - 1):]) if len(context) >= n - 1 else tuple(context)
-    scores = {}
-    for comp in completions:
-        prob = ngram_model.get(ngram, {}).get(comp, 0)  # Probability given context
-        scores[comp] = prob
+    After use_reranker (and with no shards), the model's shortlist for a non-empty
+    context is reordered by the reranker (see engine.reranker).
 
-    # Rank by n-gram probability, with frequency as tiebreaker
-    return sorted(completions, key=lambda w: (scores.get(w, 0), word_trie[w]), reverse=True)[:top_k]
+    Args:
+        context (list): List of previous words (e.g., ["good", "morning"]).
+        top_k (int): Number of suggestions to return (default: 5).
+        deadline (float): Optional time limit in seconds. Next-word prediction is a
+            few presorted lookups and always finishes, so the result is only partial
+            when the reranker went over the budget it gets with a deadline.
+
+    Returns:
+        list: Top k next word suggestions (e.g., ["to", "everyone", "sunshine"]);
+        with a deadline, a Suggestions list.
+    """
+    if shards is None and reranker is not None and context:
+        from engine.reranker import RERANK_BUDGET, two_stage_next_words
+        current, second_stage = model, reranker
+        key = cache.key(current, context, "", top_k) + ('reranked', tuple(context[-second_stage.context_size:]))
+        budget = RERANK_BUDGET if deadline is not None else None
+        words = cache.get(current, key,
+                          lambda: two_stage_next_words(current, second_stage, context, top_k, budget))
+        return words if deadline is None else Suggestions.of(words, None)
+    current = model if shards is None else shards
+    words = cache.get(current, cache.key(current, context, "", top_k),
+                      lambda: current.next_words(context, top_k))
+    return words if deadline is None else Suggestions(words)
 
 
-def predict_next_word(context, top_k=5):
+def predict_phrases(context, top_k=3, deadline=None):
     """
-    Predict the next word based on previous words.
+    Suggest multi-word continuations with a time-bounded beam search (see engine.phrases).
+
+    A PredictionSession (new_session) keeps its search across keystrokes; this
+    call starts a fresh one every time.
 
     Args:
         context (list): List of previous words (e.g., ["good", "morning"]).
-        top_k (int): Number of suggestions to return (default: 5).
+        top_k (int): Number of phrases to return (default: 3).
+        deadline (float): Optional time limit in seconds, on top of the search's own budget.
 
     Returns:
-        list: Top k next word suggestions (e.g., ["to", "everyone", "sunshine"]).
+        Suggestions: Up to top_k phrases of 2-4 words (e.g., [["my", "dear", "friend"], ...]),
+        flagged partial if the search was cut short.
     """
-    n = 3  # Assuming trigram model
-    ngram = tuple(context[-(n - 1):]) if len(context) >= n - 1 else tuple(context)
-    if ngram in ngram_model:
-        next_words = ngram_model[ngram]
-        return sorted(next_words, key=next_words.get, reverse=True)[:top_k]
-    return []  # Return empty list if no predictions available
+    search = PhraseSearch(model)
+    search.reset(model.context_ids(context))
+    return search.phrases(top_k, Deadline.start(deadline))
+
+
+def predict_batch(contexts, top_k=5, deadline=None):
+    """
+    Predict next words for many contexts in one vectorized pass (see engine.batch).
+
+    Args:
+        contexts (list): One list of previous words per query.
+        top_k (int): Number of suggestions per query (default: 5).
+        deadline (float): Optional time limit in seconds; queries not reached in
+            time get empty lists and the result is flagged partial.
+
+    Returns:
+        list: One list of suggestions per context, as predict_next_word would return.
+    """
+    from engine import batch
+    return batch.predict_batch(model, contexts, top_k, Deadline.start(deadline))
+
+
+def complete_batch(queries, top_k=3, deadline=None):
+    """
+    Complete many (context, prefix) queries in one vectorized pass (see engine.batch).
+
+    Args:
+        queries (list): (context, prefix) pairs, e.g. [(["so"], "bea"), ([], "com")].
+        top_k (int): Number of suggestions per query (default: 3).
+        deadline (float): Optional time limit in seconds, as for predict_batch.
+
+    Returns:
+        list: One list of suggestions per query, as complete_current_word would return.
+    """
+    from engine import batch
+    return batch.complete_batch(model, queries, top_k, Deadline.start(deadline))
+
+
+def rescore_transcripts(hypotheses, asr_scores=None, context=(), with_scores=False):
+    """
+    Rerank a speech recognizer's n-best list with the model (see engine.rescoring).
+
+    All hypotheses are scored in one vectorized pass; a few hundred take a few
+    milliseconds. Shards and adaptation layers are not consulted.
+
+    Args:
+        hypotheses (list): Transcripts, e.g. ["i went to the gym", "i want to the gym"].
+        asr_scores (list): The recognizer's log-scores, one per hypothesis; None to rank by the model alone.
+        context (list): Words committed before the utterance (e.g., ["this", "morning"]).
+        with_scores (bool): Also return the combined scores.
+
+    Returns:
+        list: The hypotheses, best-first; with with_scores, a (hypotheses, scores) pair.
+    """
+    from engine.rescoring import rescore_scores
+    ranked, scores = rescore_scores(model, list(hypotheses), asr_scores, context)
+    return (ranked, scores) if with_scores else ranked
+
+
+def select_app(app):
+    """
+    Switch sessions to an application's adaptation layer (see engine.adaptation).
+
+    Nothing is loaded: the layer is created empty the first time the application
+    is seen and learns from the words committed while it is active. The stateless
+    functions above always answer from the global model alone.
+
+    Args:
+        app (str): Application key, e.g. "notepad.exe"; None for the global model alone.
+    """
+    app_layers.select(app)
+
+
+def _install_learned(path):
+    """Register a compacted learned model and make it the facade's model."""
+    global model
+    registry.register(LEARNED_MODEL, path)
+    model = registry.reload(LEARNED_MODEL)
+    return model
+
+
+def start_learning(directory=LEARNED_DIR, compact_every=COMPACT_EVERY):
+    """
+    Learn from the words committed in sessions started with learn=True (see engine.learning).
+
+    Committed words are mixed into those sessions' suggestions right away and
+    logged to disk; every compact_every words the model is rebuilt from the base
+    corpus plus everything learned, in the background, and swapped in for the
+    facade functions and the sessions. A learned model from an earlier run is
+    installed right away and any words logged since are replayed.
+
+    Args:
+        directory (str): Where the log and the learned models are kept.
+        compact_every (int): Words learned between rebuilds of the model.
+
+    Returns:
+        OnlineLearner: The learner (the same one on later calls).
+    """
+    global learner
+    if learner is None:
+        learner = OnlineLearner(directory, compact_every=compact_every, install=_install_learned)
+    return learner
+
+
+def load_diary_index(directory=DIARY_INDEX_DIR):
+    """
+    Map the diary sentence index built by engine.build_diary_index.
+
+    Args:
+        directory (str): The index directory.
+
+    Returns:
+        SentenceIndex: The index (the same one on later calls), or None if it has not been built.
+    """
+    global diary_index
+    if diary_index is None and os.path.exists(directory):
+        from engine.retrieval import SentenceIndex
+        diary_index = SentenceIndex.open(directory)
+    return diary_index
+
+
+def new_session(max_edits=0, speculate=False, learn=False, retrieve=False):
+    """
+    Start a stateful typing session (see engine.session.PredictionSession).
+
+    The session follows a trie cursor on the model itself, so it does not see
+    interpolated shards (add_shard); mix personal text in through learn or
+    retrieve instead.
+
+    Args:
+        max_edits (int): Typing mistakes tolerated in completions (default: 0).
+        speculate (bool): Precompute next words for likely completions in the
+            background (default: False; see engine.speculation).
+        learn (bool): Learn from the committed words (default: False; see start_learning).
+        retrieve (bool): Mix in the words that followed similar diary sentences
+            (default: False; needs the index, see load_diary_index).
+
+    Returns:
+        PredictionSession: Tracks the trie cursor and context across keystrokes;
+        its global-model results share the facade's cache.
+    """
+    # Starting the learner may install a learned model, which the session must start on
+    learned = start_learning() if learn else None
+    index = load_diary_index() if retrieve else None
+    if index is not None:
+        from engine.retrieval import RetrievalLayer
+    return PredictionSession(model, cache=cache, max_edits=max_edits, speculate=speculate, adaptation=app_layers,
+                             learner=learned, reranker=reranker,
+                             retrieval=RetrievalLayer(index) if index is not None else None)
+
+
+def new_neural_session(path=NEURAL_LM_PATH):
+    """
+    Start a typing session answered by the LSTM model instead of the n-gram model.
+
+    The session keeps the network's recurrent state and advances it by one word
+    per committed word (see engine.neural_lm). It has the same interface as
+    new_session's, without typo tolerance, speculation, adaptation or learning.
+
+    Args:
+        path (str): Path to the weights written by engine.train_neural_lm.
+
+    Returns:
+        NeuralSession: The session.
+    """
+    global neural_lm
+    if neural_lm is None:
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No neural model at '{path}': run 'python -m engine.train_neural_lm' first")
+        from engine.neural_lm import NeuralLanguageModel
+        neural_lm = NeuralLanguageModel.load(path)
+    from engine.neural_lm import NeuralSession
+    return NeuralSession(neural_lm)
 
 
 
@@ -105,7 +532,37 @@ def run_tests():
             result = predict_next_word(context, top_k=5)
             print(f"Test {i+1}: predict_next_word({context}) → {result}")
 
+    check_equivalence(test_cases)
     print("\nTesting completed.")
 
+
+def check_equivalence(test_cases):
+    """
+    Assert that the batch and session entry points answer exactly like the per-call functions.
+
+    Args:
+        test_cases (list): (context, prefix) pairs; an empty prefix is a next-word query.
+    """
+    completions = [(context, prefix) for context, prefix in test_cases if prefix]
+    contexts = [context for context, prefix in test_cases if not prefix] + [context for context, _ in completions]
+    assert predict_batch(contexts) == [predict_next_word(context) for context in contexts]
+    assert complete_batch(completions) == [complete_current_word(prefix, context) for context, prefix in completions]
+    print(f"\npredict_batch and complete_batch match the per-call functions on {len(contexts) + len(completions)} queries")
+
+    # A session typing every case character by character, exactly and with typos tolerated
+    keystrokes = 0
+    for max_edits in (0, 1):
+        for context, prefix in test_cases:
+            session = new_session(max_edits=max_edits)
+            for word in context:
+                session.commit_word(word)
+            assert session.suggestions(5) == predict_next_word(context, 5)
+            for char in prefix:
+                session.type_char(char)
+                assert session.suggestions(3) == complete_current_word(session.prefix, context, 3, max_edits)
+                keystrokes += 1
+            session.close()
+    print(f"Sessions match complete_current_word and predict_next_word over {keystrokes} keystrokes")
+
 if __name__ == "__main__":
     run_tests()
\ No newline at end of file
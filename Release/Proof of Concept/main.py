@@ -1,3 +1,4 @@
+import multiprocessing
 import sys
 from PyQt6.QtWidgets import QApplication
 from PyQt6.QtCore import Qt
@@ -35,5 +36,7 @@ class KeyboardApp(QApplication):
 
 
 if __name__ == "__main__":
+    # Learned words are compacted into the model by a child process (see engine.learning)
+    multiprocessing.freeze_support()
     app = KeyboardApp(sys.argv)
     sys.exit(app.exec())
@@ -15,8 +15,38 @@ from ui.layouts import KeyboardLayoutManager
 from utils.window_utils import WindowManager
 import ctypes
 from ui.key_buttons import NeonKeyButton, SpecialNeonKeyButton
-from inference_engine import predict_next_word, complete_current_word
-from
+from engine.client import PredictionClient, RemoteSession
+from engine.snippets import SnippetAutomaton, SnippetMatcher, load_snippets
+
+# Mistyped letters tolerated in word completions
+TYPO_EDITS = 1
+
+# Seconds a keystroke waits for suggestions; anything cut short is refined right after
+SUGGESTION_DEADLINE = 0.008
+
+# Mix in the words that followed similar diary sentences (see engine.retrieval);
+# off since it only helps with text the diary already holds
+DIARY_RETRIEVAL = False
+
+# Prediction engine: 'ngram' for the n-gram model, 'neural' for the LSTM (engine.neural_lm)
+PREDICTION_ENGINE = 'ngram'
+
+# Abbreviation -> expansion pairs offered in the prediction bar (see engine.snippets)
+SNIPPETS_PATH = 'settings/snippets.json'
+
+def create_prediction_session():
+    """Use the shared prediction daemon when one is running, else load the models in-process"""
+    if PREDICTION_ENGINE == 'neural':
+        from inference_engine import new_neural_session
+        return new_neural_session()
+    client = PredictionClient.connect_if_running()
+    if client is not None:
+        print(f"Using the prediction daemon at {client.address}")
+        return RemoteSession(client, max_edits=TYPO_EDITS, speculate=True)
+    from inference_engine import new_session
+    return new_session(max_edits=TYPO_EDITS, speculate=True, learn=True, retrieve=DIARY_RETRIEVAL)
+
+
 # WM_HOTKEY (value 0x0312) is a Windows message that the system sends when a registered hotkey is triggered.
 # Applications that register hotkeys using RegisterHotKey() receive this message in their window procedure when the hotkey is pressed.
 WM_HOTKEY = 0x0312
@@ -90,6 +120,13 @@ class VirtualKeyboard(QMainWindow):
         self.current_prefix = ""
         self.current_context = []
         self.prediction_widgets = []
+        # Keeps the trie cursor and context ids across keystrokes, so each key costs O(1)
+        self.prediction_session = create_prediction_session()
+        # Follows the typed stream through the snippet automaton, one state per character
+        self.snippet_matcher = SnippetMatcher(SnippetAutomaton(load_snippets(SNIPPETS_PATH)))
+        # Bumped on every prediction update, so a pending refinement of older
+        # partial suggestions knows it has been overtaken
+        self.prediction_generation = 0
 
         # Initialize UI
         self.initUI()
@@ -136,10 +173,14 @@ class VirtualKeyboard(QMainWindow):
             if self.current_prefix:
                 self.current_context.append(self.current_prefix)
                 self.current_prefix = ""
+                self.prediction_session.commit_word()
+                self.snippet_matcher.commit_word()
             # Show next word predictions
             self.update_predictions(is_next_word=True, context=self.current_context)
         elif key_text == "\b":
             # Backspace was pressed
+            self.prediction_session.backspace()
+            self.snippet_matcher.backspace()
             if self.current_prefix:
                 # Remove last character from prefix
                 self.current_prefix = self.current_prefix[:-1]
@@ -159,10 +200,14 @@ class VirtualKeyboard(QMainWindow):
             # Enter was pressed - reset context
             self.current_context = []
             self.current_prefix = ""
+            self.prediction_session.reset()
+            self.snippet_matcher.reset()
             self.update_predictions(is_next_word=True, context=self.current_context)
         else:
             # Regular character input
             self.current_prefix += key_text
+            self.prediction_session.type_char(key_text)
+            self.snippet_matcher.type_char(key_text)
             # Update completion suggestions
             self.update_predictions(is_next_word=False, context=self.current_context, prefix=self.current_prefix)
 
@@ -232,34 +277,54 @@ class VirtualKeyboard(QMainWindow):
         # For example, using something like:
         # self.send_text_to_active_window(prediction_text)
 
+        # The selected word replaces whatever part of it was typed; a snippet
+        # expansion replaces the abbreviation and is committed word by word
+        if prediction_text in self.snippet_matcher.expansions():
+            words = prediction_text.split()
+        else:
+            words = [prediction_text]
+        for word in words:
+            self.prediction_session.commit_word(word)
+            self.snippet_matcher.commit_word(word)
+
         # Update context with the selected word
         if not self.current_prefix:
             # If we were showing next word predictions, add the word to context
-            self.current_context.append(prediction_text)
+            self.current_context.extend(words)
             # Reset prefix and update predictions for the next word
             self.current_prefix = ""
             self.update_predictions(is_next_word=True, context=self.current_context)
         else:
             # If we were showing completions, replace the prefix with the full word
             # and add it to the context
-            self.current_context.append(prediction_text)
+            self.current_context.extend(words)
             # Reset prefix and update predictions for the next word
             self.current_prefix = ""
             self.update_predictions(is_next_word=True, context=self.current_context)
 
-    def update_predictions(self, is_next_word=True, context=None, prefix=""):
+    def update_predictions(self, is_next_word=True, context=None, prefix="", deadline=SUGGESTION_DEADLINE):
         """Update the prediction widgets with new predictions
 
         Args:
             is_next_word: If True, show next word predictions, otherwise show completions
             context: The context for prediction (previous words) as a list
             prefix: The prefix of the current word for completion
+            deadline: Seconds to wait for suggestions (None for no limit); partial
+                results are shown at once and refined without a deadline afterwards
         """
         # Default empty context if None is provided
         if context is None:
             context = []
+        self.prediction_generation += 1
+        generation = self.prediction_generation
         import random
 
+        # Asks again without a deadline once the event loop is idle, unless another
+        # keystroke has updated the predictions by then
+        def refine():
+            if generation == self.prediction_generation:
+                self.update_predictions(is_next_word, context, prefix, deadline=None)
+
         # Random word generator function
         def generate_random_words(count=5):
             # Dictionary of 25 common words
@@ -276,28 +341,33 @@ class VirtualKeyboard(QMainWindow):
         # Get predictions from inference engine
         try:
             if is_next_word:
-                # Debugging: Print input parameters
-                print(f"Calling predict_next_word with context: {context}, top_k: 5")
-
-                # Get next word predictions
-                predictions = predict_next_word(context, top_k=5)
+                # Get next word predictions from the session's resolved context
+                predictions = self.prediction_session.suggestions(top_k=5, deadline=deadline)
 
                 # Debugging: Print returned value
-                print(f"predict_next_word returned: {predictions}")
+                print(f"Next word predictions after {context}: {predictions}")
 
                 prediction_type = "Next word"
             else:
-                # Debugging: Print input parameters
-                print(f"Calling complete_current_word with prefix: {prefix}, context: {context}, top_k: 5")
-
-                # Get word completion suggestions
-                predictions = complete_current_word(prefix, context, top_k=5)
+                # Get word completion suggestions from the session's trie cursor
+                predictions = self.prediction_session.suggestions(top_k=5, deadline=deadline)
 
                 # Debugging: Print returned value
-                print(f"complete_current_word returned: {predictions}")
+                print(f"Completions for '{prefix}' after {context}: {predictions}")
 
                 prediction_type = "Completion"
 
+            partial = getattr(predictions, 'partial', False)
+            if partial and not predictions:
+                # Nothing in time (e.g. the prediction daemon is busy): keep the bar until refined
+                QTimer.singleShot(0, refine)
+                return
+
+            # Expansions of a typed abbreviation come first
+            expansions = [] if is_next_word else self.snippet_matcher.expansions()
+            if expansions:
+                predictions = expansions + [word for word in predictions or [] if word not in expansions]
+
             # Handle case where predictions might be None or empty
             if not predictions or predictions is None:
                 print("No predictions returned, generating random words")
@@ -308,6 +378,7 @@ class VirtualKeyboard(QMainWindow):
             print(f"Error getting predictions: {e}")
             predictions = generate_random_words(count=5)  # Use random words on error too
             prediction_type = "Error in (using random words)"
+            partial = False
 
         # At this point, predictions will always contain values:
         # - Either from the inference engine if successful
@@ -327,6 +398,10 @@ class VirtualKeyboard(QMainWindow):
         else:
             self.status_label.setText(f"{prediction_type} suggestions for '{prefix}' after '{context_str}'")
 
+        # The deadline cut the search short: refine the suggestions just shown
+        if partial:
+            QTimer.singleShot(0, refine)
+
 
     def initUI(self):
         """Initialize the user interface"""
@@ -588,6 +663,12 @@ class VirtualKeyboard(QMainWindow):
         current_window = self.window_manager.get_active_window()
         window_title = self.window_manager.get_window_title(current_window)
 
+        # Predictions adapt to the application being typed into; selecting its
+        # layer is a lookup, so it is safe on every poll
+        if current_window and current_window != int(self.winId()):
+            app = self.window_manager.get_window_app(current_window) or window_title
+            self.prediction_session.select_app(app)
+
         if current_window and window_title:
             # Truncate if too long
             if len(window_title) > 30:
@@ -624,6 +705,16 @@ class VirtualKeyboard(QMainWindow):
         if hasattr(self, 'hotkey'):
             self.hotkey.unregister()
 
+        # Stop background next-word speculation and report how well it did
+        if self.prediction_session.speculator is not None:
+            print(f"Speculation: {self.prediction_session.speculator.stats()}")
+        self.prediction_session.close()
+
+        # Write out the words still queued for the learning log
+        if self.prediction_session.learner is not None:
+            print(f"Learning: {self.prediction_session.learner.stats()}")
+            self.prediction_session.learner.close()
+
         event.accept()
 
     def get_resize_edge(self, pos):
@@ -1,5 +1,6 @@
 # Windows APIs
 
+import os
 import sys
 import ctypes
 
@@ -30,6 +31,29 @@ class WindowManager:
                 return None
         return None
 
+    @staticmethod
+    def get_window_app(hwnd):
+        """Get the executable name (e.g. 'notepad.exe') of the process owning a window"""
+        if sys.platform == 'win32' and hwnd:
+            try:
+                PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+                pid = ctypes.c_ulong()
+                ctypes.windll.user32.GetWindowThreadProcessId(hwnd, ctypes.byref(pid))
+                process = ctypes.windll.kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid.value)
+                if not process:
+                    return None
+                try:
+                    size = ctypes.c_ulong(1024)
+                    buff = ctypes.create_unicode_buffer(size.value)
+                    if ctypes.windll.kernel32.QueryFullProcessImageNameW(process, 0, buff, ctypes.byref(size)):
+                        return os.path.basename(buff.value).lower()
+                    return None
+                finally:
+                    ctypes.windll.kernel32.CloseHandle(process)
+            except Exception:
+                return None
+        return None
+
     @staticmethod
     def set_foreground_window(hwnd):
         """Set the foreground window to the specified handle"""